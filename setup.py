@@ -2,9 +2,9 @@
 # -*- coding: utf-8 -*-
 
 try:
-    from setuptools import setup, Extension, find_packages
+    from setuptools import setup
 except ImportError:
-    from distutils.core import setup, Extension
+    from distutils.core import setup
 
 
 setup( 
@@ -17,5 +17,5 @@ setup(
     long_description=open('README.md').read(),
     license=open('LICENSE').read(),
     packages=['shadow', 'shadow.taskstats'],
-    ext_modules=[Extension('libshadow', sources=['shadow/libshadow/libshadow.c'])]
+    entry_points={'console_scripts':['shadow = shadow.top:main']}
 )
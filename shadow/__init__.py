@@ -1,4 +1,13 @@
 #!/usr/bin/env python
 # -*- coding: utf-8
 
-from shadow import Profile 
+from .shadow import Profile 
+from .table import ProcessTable
+from .sampler import Sampler
+from .delays import DelayProfiler
+from .proctree import ProcessTree
+from .system import SystemSampler
+from .memory import MemoryTracker
+from .recorder import Recorder, RecordReader
+from .isolation import IsolationManager
+from .policy import Policy, PolicyEngine
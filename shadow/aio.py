@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Asyncio variant of <Profile>.  Taskstats queries go through the event loop's
+shared <AsyncTaskstats> connection; procfs reads are served inline since
+they never wait on a device.
+'''
+
+from .exception import *
+from .snapshot import read_file, read_snapshot
+from .smaps import rollup
+from .taskstats.aio import loop_taskstats
+
+
+class AsyncProfile(object):
+    '''
+    AsyncProfile object: coroutine based profile of "pid".  Any number of
+    AsyncProfiles may be queried concurrently from one event loop; their
+    taskstats requests share a single non-blocking netlink socket (pass
+    "taskstats" to use a specific <AsyncTaskstats>).
+
+    As with <Profile>, snapshots are reused for up to "max_age" seconds.
+    '''
+    def __init__(self, pid, taskstats=None, max_age=0):
+        self.pid = pid
+        self.max_age = max_age
+        self.__taskstats = taskstats
+        self.__snapshot = None
+
+    @property
+    def connection(self):
+        '''
+        Class property: returns the <AsyncTaskstats> queries are sent over.
+        '''
+        if self.__taskstats is None:
+            self.__taskstats = loop_taskstats()
+        return self.__taskstats
+
+    async def snapshot(self):
+        '''
+        Coroutine: returns <Snapshot> of the profiled pid read from "stat",
+        "status", "io" and "statm" in a single pass.
+        '''
+        self.__snapshot = read_snapshot(self.pid, read_file)
+        return self.__snapshot
+
+    async def recent_snapshot(self):
+        '''
+        Coroutine: returns the last <Snapshot> if it is younger than
+        `max_age` seconds, otherwise a fresh one.
+        '''
+        snapshot = self.__snapshot
+        if snapshot is None or snapshot.age() >= self.max_age:
+            snapshot = await self.snapshot()
+        return snapshot
+
+    async def taskstats(self):
+        '''
+        Coroutine: returns <TaskstatsRecord> of every taskstats field of the
+        profiled pid.
+        '''
+        taskstats = await self.connection.get_stats(self.pid)
+        if taskstats is None:
+            raise InsufficientRights('taskstats', self.pid)
+        return taskstats
+
+    async def rwBytes(self):
+        '''
+        Coroutine: returns <type 'tuple'> of pids total read and write bytes
+        since startup, from procfs when taskstats is not permitted.
+        '''
+        try:
+            return await self.connection.read_write(self.pid)
+        except InsufficientRights:
+            snapshot = await self.recent_snapshot()
+            if snapshot.rchar is None:
+                raise InvalidPath('/proc/%s/io' % self.pid)
+            return snapshot.rchar, snapshot.wchar
+
+    async def rBytes(self):
+        return (await self.rwBytes())[0]
+
+    async def wBytes(self):
+        return (await self.rwBytes())[1]
+
+    async def smap_rollup(self):
+        '''
+        Coroutine: returns <type 'dict'> of the profiled pids total memory
+        consumption (in kB) across all of its mappings.
+        '''
+        return rollup(self.pid)
+
+    def __repr__(self):
+        return "<class '%s (pid: %s)'>" % (self.__class__.__name__, self.pid)
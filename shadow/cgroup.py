@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+cgroup v2 resource collection.  Every pid is resolved to its cgroup and the
+cgroup's "cpu.stat", "memory.current", "memory.stat", "io.stat" and pressure
+files are read once per cgroup, then shared by all of its member pids for
+up to "max_age" seconds.
+'''
+
+import os
+import threading
+import time
+
+from .exception import *
+
+
+CGROUP2_DEFAULT_MOUNT = '/sys/fs/cgroup'
+
+
+def parse_flat_keyed(raw):
+    '''
+    Returns <type 'dict'> of a flat keyed file ("<key> <int>" per line, e.g.
+    "cpu.stat" and "memory.stat").
+    '''
+    values = dict()
+    for line in raw.split('\n'):
+        key, _, value = line.partition(' ')
+        if key:
+            values[key] = int(value)
+    return values
+
+def parse_nested_keyed(raw):
+    '''
+    Returns <type 'dict'> of a nested keyed file ("<key> <name>=<value> ..."
+    per line, e.g. "io.stat" keyed by device and the pressure files keyed by
+    'some' and 'full').  Values are <type 'int'>, or <type 'float'> where
+    fractional.
+    '''
+    values = dict()
+    for line in raw.split('\n'):
+        fields = line.split()
+        if not fields:
+            continue
+        nested = values[fields[0]] = dict()
+        for field in fields[1:]:
+            name, _, value = field.partition('=')
+            nested[name] = float(value) if '.' in value else int(value)
+    return values
+
+def parse_single(raw):
+    '''
+    Returns <type 'int'> of a single value file (e.g. "memory.current"), or
+    <type 'NoneType'> for 'max'.
+    '''
+    raw = raw.strip()
+    return None if raw == 'max' else int(raw)
+
+
+CGROUP_FILES = {'cpu.stat':parse_flat_keyed,
+                'memory.current':parse_single,
+                'memory.stat':parse_flat_keyed,
+                'io.stat':parse_nested_keyed,
+                'cpu.pressure':parse_nested_keyed,
+                'memory.pressure':parse_nested_keyed,
+                'io.pressure':parse_nested_keyed}
+
+
+def cgroup2_mount():
+    '''
+    Returns <type 'str'> mount point of the cgroup v2 hierarchy, as found in
+    "/proc/self/mountinfo" (CGROUP2_DEFAULT_MOUNT if it is not listed).
+    '''
+    try:
+        with open('/proc/self/mountinfo') as f:
+            for line in f:
+                _, _, tail = line.partition(' - ')
+                if tail.split(' ', 1)[0] == 'cgroup2':
+                    return line.split()[4]
+    except IOError:
+        pass
+    return CGROUP2_DEFAULT_MOUNT
+
+def pid_cgroup(pid):
+    '''
+    Returns <type 'str'> cgroup v2 path of "pid" (e.g.
+    '/system.slice/nginx.service'), or <type 'NoneType'> if it is only in
+    v1 hierarchies.
+    '''
+    fpath = '/proc/%s/cgroup' % pid
+    try:
+        with open(fpath) as f:
+            raw_cgroup = f.read()
+    except IOError:
+        raise BadProcess(pid)
+    for line in raw_cgroup.split('\n'):
+        if line.startswith('0::'):
+            return line[3:]
+
+
+class CgroupStats(object):
+    '''
+    Immutable record of the resource files of one cgroup read at "timestamp".
+    Files are looked up by name (`stats['cpu.stat']`) and hold the output of
+    their parser in CGROUP_FILES, or <type 'NoneType'> when the file does not
+    exist (e.g. its controller is not enabled for the cgroup).
+    '''
+
+    __slots__ = ('path', 'timestamp', 'files')
+
+    def __init__(self, path, timestamp, files):
+        setter = super(CgroupStats, self).__setattr__
+        setter('path', path)
+        setter('timestamp', timestamp)
+        setter('files', files)
+
+    def __getitem__(self, name):
+        return self.files[name]
+
+    def get(self, name, default=None):
+        value = self.files.get(name)
+        return default if value is None else value
+
+    def age(self):
+        '''
+        Returns <type 'float'> seconds since the files were read.
+        '''
+        return time.time() - self.timestamp
+
+    def __setattr__(self, name, value):
+        raise AttributeError("<CgroupStats> attribute '%s' is read-only" %
+                             name)
+
+    def __repr__(self):
+        return "<CgroupStats (path: %s)>" % self.path
+
+
+class CgroupCache(object):
+    '''
+    CgroupCache object: reads the "files" of a cgroup at most once per
+    "max_age" seconds however many pids (or callers, it is thread-safe) ask
+    for it.
+    '''
+    def __init__(self, max_age=1.0, files=CGROUP_FILES, mount=None):
+        self.max_age = max_age
+        self.files = dict(files)
+        self.mount = mount or cgroup2_mount()
+        self.cache = dict()
+        self.lock = threading.Lock()
+
+    def stats(self, path, max_age=None):
+        '''
+        Class method: returns <CgroupStats> of the cgroup at "path", read
+        afresh if the cached one is older than "max_age" (defaults to the
+        cache's `max_age`).
+        '''
+        max_age = self.max_age if max_age is None else max_age
+        with self.lock:
+            stats = self.cache.get(path)
+        if stats is None or stats.age() >= max_age:
+            stats = self.read(path)
+            with self.lock:
+                self.cache[path] = stats
+        return stats
+
+    def read(self, path):
+        '''
+        Class method: returns <CgroupStats> of the cgroup at "path" read
+        without going through the cache.
+        '''
+        cgroup_path = os.path.join(self.mount, path.lstrip('/'))
+        if not os.path.isdir(cgroup_path):
+            raise InvalidPath(cgroup_path)
+        files = dict()
+        for name, parser in self.files.items():
+            try:
+                with open(os.path.join(cgroup_path, name)) as f:
+                    files[name] = parser(f.read())
+            except (IOError, OSError):
+                files[name] = None
+        return CgroupStats(path, time.time(), files)
+
+    def pid_stats(self, pid, max_age=None):
+        '''
+        Class method: returns <CgroupStats> of the cgroup "pid" belongs to.
+        '''
+        path = pid_cgroup(pid)
+        if path is None:
+            raise InvalidPath('/proc/%s/cgroup' % pid)
+        return self.stats(path, max_age)
+
+    def collect(self, pids, max_age=None):
+        '''
+        Class method: returns <type 'dict'> of cgroup path to a
+        (<CgroupStats>, member pids) pair for the cgroups of "pids", reading
+        each cgroup once; pids that exit meanwhile are left out.
+        '''
+        members = dict()
+        for pid in pids:
+            try:
+                path = pid_cgroup(pid)
+            except BadProcess:
+                continue
+            if path is not None:
+                members.setdefault(path, list()).append(pid)
+        collected = dict()
+        for path, cgroup_pids in members.items():
+            try:
+                collected[path] = (self.stats(path, max_age), cgroup_pids)
+            except InvalidPath:
+                continue
+        return collected
+
+    def clear(self):
+        with self.lock:
+            self.cache.clear()
+
+    def __len__(self):
+        return len(self.cache)
+
+    def __repr__(self):
+        return "<class '%s (cgroups: %d)'>" % (self.__class__.__name__,
+                                               len(self.cache))
+
+
+_cgroup_cache = None
+_cgroup_cache_lock = threading.Lock()
+
+
+def cgroup_cache():
+    '''
+    Returns the process-wide <CgroupCache>.
+    '''
+    global _cgroup_cache
+    with _cgroup_cache_lock:
+        if _cgroup_cache is None:
+            _cgroup_cache = CgroupCache()
+        return _cgroup_cache
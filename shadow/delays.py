@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Latency profiling from the taskstats delay accounting fields.  Every kind of
+delay the kernel accounts (runqueue wait, block I/O, swap-in, page reclaim,
+...) is kept as an event count and a total wait in nanoseconds; sampling
+both over time tells cpu starvation apart from disk or memory stalls.
+'''
+
+import time
+
+from collections import namedtuple
+
+from .exception import *
+from .sampler import RingSampler
+
+
+# Delay kind to its (event count, total delay in ns) taskstats fields
+DELAY_FIELDS = (('cpu', ('cpu_count', 'cpu_delay_total')),
+                ('blkio', ('blkio_count', 'blkio_delay_total')),
+                ('swapin', ('swapin_count', 'swapin_delay_total')),
+                ('freepages', ('freepages_count', 'freepages_delay_total')),
+                ('thrashing', ('thrashing_count', 'thrashing_delay_total')),
+                ('compact', ('compact_count', 'compact_delay_total')),
+                ('wpcopy', ('wpcopy_count', 'wpcopy_delay_total')),
+                ('irq', ('irq_count', 'irq_delay_total')))
+
+DELAY_KINDS = tuple(kind for kind, _ in DELAY_FIELDS)
+
+DEFAULT_KINDS = ('cpu', 'blkio', 'swapin', 'freepages')
+
+# Key the whole process' (thread group) delays are stored under
+PROCESS = 'process'
+
+Delay = namedtuple('Delay', ['events', 'delay', 'per_event', 'share'])
+
+
+def delay_counts(record, kinds=DEFAULT_KINDS):
+    '''
+    Returns <type 'tuple'> of (event count, total delay in ns) pairs of each
+    of "kinds" in a <TaskstatsRecord>; kinds the kernel does not report are
+    <type 'NoneType'>.
+    '''
+    fields = dict(DELAY_FIELDS)
+    counts = list()
+    for kind in kinds:
+        count_field, total_field = fields[kind]
+        count = record.get(count_field)
+        total = record.get(total_field)
+        counts.append(None if count is None or total is None else
+                      (count, total))
+    return tuple(counts)
+
+
+class DelayProfiler(RingSampler):
+    '''
+    DelayProfiler object: samples the delay accounting of "profile" (and of
+    each of its threads with "threads") into a ring buffer of the last
+    "size" samples.
+
+    Each sample costs one thread group query plus, with "threads", one
+    batched query over the task list.  Delays are reported per kind as a
+    <Delay>: the number of "events" waited on, the total "delay" and the
+    mean delay "per_event" in nanoseconds, and the "share" of wall time
+    spent waiting (which may exceed 1.0 for a process summed over threads).
+    '''
+    def __init__(self, profile, kinds=DEFAULT_KINDS, size=60, threads=False):
+        for kind in kinds:
+            if kind not in DELAY_KINDS:
+                raise ValueError("unknown delay kind '%s'" % kind)
+        super(DelayProfiler, self).__init__(size)
+        self.profile = profile
+        self.kinds = tuple(kinds)
+        self.threads = threads
+
+    def sample(self):
+        '''
+        Class method: returns <type 'tuple'> of the sample's timestamp and
+        <type 'dict'> of PROCESS (and every thread id) to its delay counts,
+        after appending it to the ring buffer.
+        '''
+        counts = dict()
+        timestamp = time.time()
+        counts[PROCESS] = delay_counts(self.profile.tgid_stats(), self.kinds)
+        if self.threads:
+            for tid, record in self.profile.thread_stats().items():
+                counts[tid] = delay_counts(record, self.kinds)
+        sample = (timestamp, counts)
+        self.samples.append(sample)
+        return sample
+
+    def averages(self, tid=PROCESS):
+        '''
+        Class method: returns <type 'dict'> of delay kind to the mean delay
+        per event (in ns) since the task started, from the newest sample.
+        '''
+        if not self.samples:
+            return dict()
+        _, counts = self.samples[-1]
+        averages = dict()
+        for kind, pair in zip(self.kinds, counts.get(tid, ())):
+            if pair is not None:
+                count, total = pair
+                averages[kind] = total / float(count) if count else 0.0
+        return averages
+
+    def interval(self, tid=PROCESS, span=1):
+        '''
+        Class method: returns <type 'dict'> of delay kind to the <Delay> over
+        the last "span" sampling intervals (empty without enough samples or
+        if "tid" was not sampled at both ends).
+        '''
+        if span < 1 or len(self.samples) <= span:
+            return dict()
+        t_first, first = self.samples[-1 - span]
+        t_last, last = self.samples[-1]
+        if tid not in first or tid not in last:
+            return dict()
+        return self.__delays(first[tid], last[tid], t_last - t_first)
+
+    def intervals(self, tid=PROCESS):
+        '''
+        Class method: returns <type 'list'> of (timestamp, <type 'dict'> of
+        delay kind to <Delay>) for each interval between consecutive samples.
+        '''
+        samples = list(self.samples)
+        return [(t1, self.__delays(c0[tid], c1[tid], t1 - t0)) for
+                (t0, c0), (t1, c1) in zip(samples, samples[1:])
+                if tid in c0 and tid in c1]
+
+    def thread_intervals(self, span=1):
+        '''
+        Class method: returns <type 'dict'> of thread id to its `interval`
+        report, for the threads alive across the last "span" intervals.
+        '''
+        if not self.samples:
+            return dict()
+        _, counts = self.samples[-1]
+        reports = dict()
+        for tid in counts:
+            if tid != PROCESS:
+                report = self.interval(tid, span)
+                if report:
+                    reports[tid] = report
+        return reports
+
+    def dominant(self, tid=PROCESS, span=1):
+        '''
+        Class method: returns <type 'str'> delay kind with the largest total
+        delay over the last "span" intervals, or <type 'NoneType'> when none
+        was waited on.
+        '''
+        report = self.interval(tid, span)
+        delays = [(delay.delay, kind) for kind, delay in report.items()
+                  if delay.delay > 0]
+        if not delays:
+            return
+        return max(delays)[1]
+
+    def __delays(self, first, last, elapsed):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'dict'> of delay kind to <Delay> between two delay counts taken
+        "elapsed" seconds apart.
+        '''
+        delays = dict()
+        for kind, start, end in zip(self.kinds, first, last):
+            if start is None or end is None:
+                continue
+            events = end[0] - start[0]
+            delay = end[1] - start[1]
+            per_event = delay / float(events) if events else 0.0
+            share = delay / (elapsed * 1e9) if elapsed > 0 else None
+            delays[kind] = Delay(events, delay, per_event, share)
+        return delays
+
+    def __repr__(self):
+        return "<class '%s (pid: %s | samples: %d/%d)'>" % (
+            self.__class__.__name__, self.profile.pid, len(self.samples),
+            self.size)
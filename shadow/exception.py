@@ -81,3 +81,16 @@ class InvalidPath(Exception):
     def __str__(self):
         msg = "Invalid path <%s>" % self.fpath
         return msg
+
+class InsufficientCpus(Exception):
+    '''
+    Error planning cpu isolation with too few free cores.
+    '''
+    def __init__(self, pid, needed):
+        self.pid = pid
+        self.needed = needed
+
+    def __str__(self):
+        msg = "No %d free core(s) left to isolate process <%s>" % (
+            self.needed, self.pid)
+        return msg
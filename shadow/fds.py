@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+File-descriptor inventory for "/proc/<pid>/fd".  Descriptors are classified
+from their link target alone, so counting and listing a process' fds never
+stats the files behind them; "fdinfo" is only read for the fds asked about.
+'''
+
+import os
+
+from collections import namedtuple
+
+from .exception import *
+
+
+FdEntry = namedtuple('FdEntry', ['fd', 'type', 'target', 'inode'])
+
+FD_TYPES = ('file', 'socket', 'pipe', 'eventfd', 'anon_inode', 'other')
+
+# Link targets of the form "<prefix>:[<inode>]"
+INODE_PREFIXES = {'socket':'socket', 'pipe':'pipe'}
+
+# "fdinfo" fields that are always numeric (flags are printed in octal)
+FDINFO_INTS = {'pos':10, 'flags':8, 'mnt_id':10, 'ino':10}
+
+
+def fd_type(target):
+    '''
+    Returns <type 'str'> class of an fd link "target": 'file' for paths
+    (including deleted and memfd files), 'socket', 'pipe', 'eventfd',
+    'anon_inode' for the other anonymous inodes (epoll, inotify, timerfd,
+    signalfd, ...) and 'other' for anything else (e.g. namespace handles).
+    '''
+    if target.startswith('/'):
+        return 'file'
+    prefix, _, rest = target.partition(':')
+    if prefix in INODE_PREFIXES:
+        return INODE_PREFIXES[prefix]
+    if prefix == 'anon_inode':
+        return 'eventfd' if rest == '[eventfd]' else 'anon_inode'
+    return 'other'
+
+def target_inode(target):
+    '''
+    Returns <type 'int'> inode of a "socket:[<inode>]" or "pipe:[<inode>]"
+    link "target", <type 'NoneType'> for other targets.
+    '''
+    if target.endswith(']'):
+        prefix, _, inode = target[:-1].partition(':[')
+        if prefix in INODE_PREFIXES and inode.isdigit():
+            return int(inode)
+
+def iter_fds(pid):
+    '''
+    Returns a generator of <FdEntry> records for the open fds of "pid", one
+    `readlink` each; fds closed while being listed are skipped.
+    '''
+    fd_path = '/proc/%s/fd' % pid
+    try:
+        entries = os.scandir(fd_path)
+    except OSError:
+        raise BadProcess(pid)
+    with entries:
+        for entry in entries:
+            try:
+                target = os.readlink(entry.path)
+            except OSError:
+                continue
+            yield FdEntry(int(entry.name), fd_type(target), target,
+                          target_inode(target))
+
+def fd_counts(pid):
+    '''
+    Returns <type 'dict'> of every fd type (see FD_TYPES) to the number of
+    open fds of "pid" of that type.
+    '''
+    counts = dict.fromkeys(FD_TYPES, 0)
+    for entry in iter_fds(pid):
+        counts[entry.type] += 1
+    return counts
+
+def socket_inodes(pid):
+    '''
+    Returns <type 'dict'> of socket inode to fd for every socket "pid" has
+    open.
+    '''
+    return {entry.inode:entry.fd for entry in iter_fds(pid)
+            if entry.type == 'socket'}
+
+def fd_info(pid, fd):
+    '''
+    Returns <type 'dict'> of the "fdinfo" of "fd": 'pos', 'flags', 'mnt_id'
+    and 'ino' as <type 'int'>, any type specific lines (e.g. 'eventfd-count',
+    'tfd') as <type 'str'>.
+    '''
+    fpath = '/proc/%s/fdinfo/%s' % (pid, fd)
+    try:
+        with open(fpath) as f:
+            lines = f.read().split('\n')
+    except IOError:
+        raise InvalidPath(fpath)
+    info = dict()
+    for line in lines:
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        value = value.strip()
+        if name in FDINFO_INTS:
+            value = int(value, FDINFO_INTS[name])
+        info[name] = value
+    return info
+
+def fd_mode(flags):
+    '''
+    Returns <type 'str'> access mode 'r', 'w' or 'rw' of the open "flags" of
+    an fd (as given by `fd_info`).
+    '''
+    return {os.O_RDONLY:'r', os.O_WRONLY:'w',
+            os.O_RDWR:'rw'}.get(flags & os.O_ACCMODE, '')
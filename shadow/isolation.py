@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Cpu isolation across many processes.  An <IsolationManager> gives a set of
+latency-critical profiles dedicated cores (whole SMT cores, on the NUMA node
+each process already runs on where possible), moves every other thread off
+those cores with `sched_setaffinity` and keeps an undo log of the masks it
+replaced so `restore` puts the system back as it was.
+'''
+
+import errno
+import json
+import os
+import threading
+
+from collections import OrderedDict
+
+from .exception import *
+from .libshadow import online_cpus, parse_cpulist
+from .snapshot import read_start_time
+
+
+SYSFS_CPU = '/sys/devices/system/cpu'
+SYSFS_NODE = '/sys/devices/system/node'
+
+SMT_MODES = ('exclusive', 'share')
+
+# cpu id to the manager that reserved it, shared by every manager so two of
+# them never hand out the same core
+_reserved_cpus = dict()
+_reserved_cpus_lock = threading.Lock()
+
+
+def read_sysfs_cpulist(fpath):
+    '''
+    Returns <type 'list'> of the cpu ids listed in the sysfs file "fpath", or
+    <type 'NoneType'> when it cannot be read.
+    '''
+    try:
+        with open(fpath) as f:
+            return parse_cpulist(f.read())
+    except (IOError, OSError, ValueError):
+        return
+
+def iter_tasks():
+    '''
+    Returns a generator of (pid, tid) for every thread of every process in
+    "/proc"; processes that exit during the sweep are skipped.
+    '''
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            tids = os.listdir('/proc/%s/task' % entry)
+        except OSError:
+            continue
+        for tid in tids:
+            yield int(entry), int(tid)
+
+
+class CpuTopology(object):
+    '''
+    CpuTopology object: the online cpus grouped into "cores" (tuples of SMT
+    sibling cpus) and NUMA "nodes" (node id to its cpus).  Both are read from
+    sysfs unless given, falling back to one cpu per core on a single node 0.
+    '''
+    def __init__(self, cores=None, nodes=None):
+        if cores is None:
+            cores = self.__read_cores()
+        self.cores = sorted(tuple(sorted(core)) for core in cores)
+        self.cpus = sorted(cpu for core in self.cores for cpu in core)
+        if nodes is None:
+            nodes = self.__read_nodes()
+        if not nodes:
+            nodes = {0:self.cpus}
+        online = set(self.cpus)
+        self.nodes = {node:sorted(online.intersection(cpus)) for node, cpus in
+                      nodes.items()}
+        self.node_of = dict()
+        for node, cpus in self.nodes.items():
+            for cpu in cpus:
+                self.node_of[cpu] = node
+
+    def core_of(self, cpu):
+        '''
+        Class method: returns <type 'tuple'> of the SMT siblings of "cpu"
+        (itself included).
+        '''
+        for core in self.cores:
+            if cpu in core:
+                return core
+        raise KeyError("cpu %s is not online" % cpu)
+
+    def node_cores(self, node):
+        '''
+        Class method: returns <type 'list'> of the cores whose first cpu is
+        on NUMA "node".
+        '''
+        return [core for core in self.cores if
+                self.node_of.get(core[0]) == node]
+
+    def __read_cores(self):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'set'> of the sibling tuples of the online cpus.
+        '''
+        online = online_cpus()
+        cores = set()
+        for cpu in online:
+            siblings = read_sysfs_cpulist('%s/cpu%d/topology/'
+                                          'thread_siblings_list' %
+                                          (SYSFS_CPU, cpu)) or [cpu]
+            cores.add(tuple(sibling for sibling in siblings
+                            if sibling in online))
+        return cores
+
+    def __read_nodes(self):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'dict'> of NUMA node id to its cpus.
+        '''
+        nodes = dict()
+        try:
+            entries = os.listdir(SYSFS_NODE)
+        except OSError:
+            return nodes
+        for entry in entries:
+            if not entry.startswith('node') or not entry[4:].isdigit():
+                continue
+            cpus = read_sysfs_cpulist('%s/%s/cpulist' % (SYSFS_NODE, entry))
+            if cpus:
+                nodes[int(entry[4:])] = cpus
+        return nodes
+
+    def __repr__(self):
+        return "<class '%s (cpus: %d | cores: %d | nodes: %d)'>" % (
+            self.__class__.__name__, len(self.cpus), len(self.cores),
+            len(self.nodes))
+
+
+class IsolationManager(object):
+    '''
+    IsolationManager object: plans and applies dedicated cores for
+    "profiles" (<Profile> objects of the latency-critical processes).
+
+    Each profile gets "cpus" cores (an <type 'int'> for all of them, or a
+    <type 'dict'> of pid to its count).  With "smt" 'exclusive' the process
+    runs on one cpu of each of its cores and the SMT siblings are left idle;
+    with 'share' it runs on every sibling.  Cores are taken from the NUMA
+    node given for the pid in "nodes", else the node the process last ran
+    on, else whichever node has room.  The "housekeeping" cpus (the first
+    core by default) and the cores of other managers are never handed out.
+
+    `apply` pins every thread of the isolated processes to their cores and
+    moves all other threads off the reserved cpus, logging each replaced
+    mask first; a failure part way rolls back what was changed.  `restore`
+    replays the log in reverse, skipping threads that have since exited
+    (matched by start time, so reused tids are left alone).
+    '''
+    def __init__(self, profiles, cpus=1, smt='exclusive', housekeeping=None,
+                 topology=None, nodes=None):
+        if smt not in SMT_MODES:
+            raise ValueError("smt is one of %s, not %r" %
+                             (', '.join(SMT_MODES), smt))
+        self.profiles = OrderedDict((profile.pid, profile) for profile in
+                                    profiles)
+        self.cpus = cpus
+        self.smt = smt
+        self.topology = CpuTopology() if topology is None else topology
+        if housekeeping is None:
+            housekeeping = self.topology.cores[0]
+        self.housekeeping = tuple(sorted(housekeeping))
+        self.nodes = nodes or dict()
+        self.assignments = OrderedDict()
+        self.reserved = frozenset()
+        self.undo = OrderedDict()
+        self.applied = False
+
+    def plan(self):
+        '''
+        Class method: returns <type 'dict'> of pid to the <type 'tuple'> of
+        cpus it will be pinned to, reserving the cores taken (and their
+        siblings) against other managers.  Raises <InsufficientCpus> when the
+        free cores run out, keeping the reservations of an earlier plan.
+        '''
+        with _reserved_cpus_lock:
+            taken = set(self.housekeeping)
+            taken.update(cpu for cpu, owner in _reserved_cpus.items()
+                         if owner is not self)
+            free = [core for core in self.topology.cores
+                    if not taken.intersection(core)]
+            assignments = OrderedDict()
+            reserved = set()
+            for pid, profile in self.profiles.items():
+                needed = self.__cores_needed(pid)
+                node = self.__preferred_node(pid, profile)
+                ordered = sorted(free, key=lambda core: (
+                    self.topology.node_of.get(core[0]) != node,
+                    -self.__node_free(free, core), core))
+                if len(ordered) < needed:
+                    raise InsufficientCpus(pid, needed)
+                cores = ordered[:needed]
+                for core in cores:
+                    free.remove(core)
+                    reserved.update(core)
+                if self.smt == 'exclusive':
+                    assignments[pid] = tuple(core[0] for core in cores)
+                else:
+                    assignments[pid] = tuple(cpu for core in cores
+                                             for cpu in core)
+            self.__release()
+            for cpu in reserved:
+                _reserved_cpus[cpu] = self
+            self.assignments = assignments
+            self.reserved = frozenset(reserved)
+        return dict(self.assignments)
+
+    def apply(self):
+        '''
+        Class method: returns <type 'int'> of threads whose affinity was
+        changed.  Plans first if `plan` has not run; on a failure to pin an
+        isolated process every change is rolled back, the reserved cores
+        released and the error raised.
+        '''
+        if not self.assignments:
+            self.plan()
+        for pid, profile in self.profiles.items():
+            if not profile.is_alive:
+                self.__abandon()
+                raise BadProcess(pid)
+        try:
+            changed = self.__sweep()
+        except Exception:
+            self.__abandon()
+            raise
+        self.applied = True
+        return changed
+
+    def rebalance(self):
+        '''
+        Class method: returns <type 'int'> of threads moved by a new sweep:
+        threads started since `apply` are pinned or moved off the reserved
+        cpus like the rest (their original masks join the undo log).
+        '''
+        if not self.applied:
+            return self.apply()
+        return self.__sweep()
+
+    def restore(self):
+        '''
+        Class method: returns <type 'int'> of threads whose previous mask was
+        put back, after which the reserved cores are released.
+        '''
+        restored = replay(reversed(list(self.undo.values())))
+        self.undo.clear()
+        self.__unreserve()
+        return restored
+
+    def save(self, fpath):
+        '''
+        Class method: returns <type 'NoneType'> :: writes the undo log to
+        "fpath" as JSON so `restore_log` can undo the isolation from another
+        process (e.g. after this one died).
+        '''
+        log = {'assignments':{str(pid):list(cpus) for pid, cpus in
+                              self.assignments.items()},
+               'undo':[[tid, start, list(mask)] for tid, start, mask in
+                       self.undo.values()]}
+        with open(fpath, 'w') as f:
+            json.dump(log, f)
+
+    @property
+    def remaining(self):
+        '''
+        Class property: returns <type 'tuple'> of the online cpus left to
+        every process that is not isolated.
+        '''
+        with _reserved_cpus_lock:
+            return tuple(cpu for cpu in self.topology.cpus
+                         if cpu not in _reserved_cpus)
+
+    def __sweep(self):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'int'> of threads whose affinity was changed to match the plan.
+        '''
+        pinned = {pid:frozenset(cpus) for pid, cpus in
+                  self.assignments.items()}
+        remaining = frozenset(self.remaining)
+        reserved = frozenset(self.topology.cpus) - remaining
+        others = reserved - self.reserved
+        changed = 0
+        for pid, tid in iter_tasks():
+            try:
+                mask = os.sched_getaffinity(tid)
+            except OSError:
+                continue
+            target = pinned.get(pid)
+            if target is None:
+                if not mask & self.reserved or mask <= others:
+                    # untouched, or isolated by another manager
+                    continue
+                target = (mask - reserved) or remaining
+            if target == mask:
+                continue
+            identity = read_start_time(tid)
+            if identity is None:
+                continue
+            if tid not in self.undo:
+                self.undo[tid] = (tid, identity[0], tuple(sorted(mask)))
+            try:
+                os.sched_setaffinity(tid, target)
+            except OSError as err:
+                if pid not in pinned:
+                    # per-cpu kernel threads refuse with EINVAL
+                    continue
+                if err.errno == errno.ESRCH:
+                    continue
+                if err.errno == errno.EPERM:
+                    raise InsufficientRights('apply', pid)
+                raise
+            changed += 1
+        return changed
+
+    def __rollback(self):
+        replay(reversed(list(self.undo.values())))
+        self.undo.clear()
+
+    def __abandon(self):
+        '''
+        Private class method: (not meant to be called directly) rolls back a
+        failed `apply` and gives up its plan, so no cores stay reserved for
+        processes that were never pinned.
+        '''
+        self.__rollback()
+        self.__unreserve()
+
+    def __unreserve(self):
+        self.applied = False
+        with _reserved_cpus_lock:
+            self.__release()
+            self.assignments = OrderedDict()
+            self.reserved = frozenset()
+
+    def __release(self):
+        '''
+        Private class method: (not meant to be called directly) drops this
+        manager's cpus from the shared reservations; the caller holds the
+        lock.
+        '''
+        for cpu in [cpu for cpu, owner in _reserved_cpus.items()
+                    if owner is self]:
+            del _reserved_cpus[cpu]
+
+    def __cores_needed(self, pid):
+        cpus = self.cpus.get(pid, 1) if isinstance(self.cpus, dict) else \
+            self.cpus
+        if self.smt == 'share':
+            width = max(len(core) for core in self.topology.cores)
+            return -(-cpus // width)
+        return cpus
+
+    def __preferred_node(self, pid, profile):
+        '''
+        Private class method: (not meant to be called directly) returns the
+        NUMA node "pid" should be isolated on, or <type 'NoneType'>.
+        '''
+        if pid in self.nodes:
+            return self.nodes[pid]
+        try:
+            return self.topology.node_of.get(profile.snapshot().task_cpu)
+        except (BadProcess, InvalidPath):
+            return
+
+    def __node_free(self, free, core):
+        node = self.topology.node_of.get(core[0])
+        return sum(1 for other in free if
+                   self.topology.node_of.get(other[0]) == node)
+
+    def __enter__(self):
+        self.apply()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.restore()
+
+    def __repr__(self):
+        return "<class '%s (profiles: %d | reserved: %d | logged: %d)'>" % (
+            self.__class__.__name__, len(self.profiles), len(self.reserved),
+            len(self.undo))
+
+
+def replay(entries):
+    '''
+    Returns <type 'int'> of (tid, start_time, mask) undo "entries" put back,
+    skipping threads that exited or whose tid now belongs to another thread.
+    '''
+    restored = 0
+    for tid, start_time, mask in entries:
+        identity = read_start_time(tid)
+        if identity is None or identity[0] != start_time:
+            continue
+        try:
+            os.sched_setaffinity(tid, mask)
+        except OSError:
+            continue
+        restored += 1
+    return restored
+
+def restore_log(fpath):
+    '''
+    Returns <type 'int'> of threads restored from an undo log written by
+    `IsolationManager.save`.
+    '''
+    try:
+        with open(fpath) as f:
+            log = json.load(f)
+    except (IOError, OSError):
+        raise InvalidPath(fpath)
+    return replay(reversed([tuple(entry) for entry in log['undo']]))
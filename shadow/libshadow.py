@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Process control helpers: resource limits, cpu affinity and thread signals.
+Formerly a C extension, now built on `resource.prlimit`,
+`os.sched_{get,set}affinity` and the tgkill syscall so nothing needs
+compiling at install time.
+'''
+
+import ctypes
+import os
+import resource
+import signal
+
+from .priorities import libc, tgkill
+
+
+__all__ = ['curlimit', 'maxlimit', 'iso', 'release_iso', 'affinity', 'tkill',
+           'online_cpus', 'parse_cpulist', 'SIGHUP', 'SIGINT', 'SIGQUIT',
+           'SIGABRT', 'SIGKILL', 'SIGTERM', 'SIGSTOP']
+
+RLIMIT_NAMES = ('RLIMIT_AS', 'RLIMIT_CORE', 'RLIMIT_CPU', 'RLIMIT_DATA',
+                'RLIMIT_FSIZE', 'RLIMIT_LOCKS', 'RLIMIT_MEMLOCK',
+                'RLIMIT_MSGQUEUE', 'RLIMIT_NICE', 'RLIMIT_NOFILE',
+                'RLIMIT_NPROC', 'RLIMIT_RSS', 'RLIMIT_RTPRIO',
+                'RLIMIT_RTTIME', 'RLIMIT_SIGPENDING', 'RLIMIT_STACK')
+
+# Linux values of the limits the resource module may not export
+LINUX_RLIMITS = {'RLIMIT_LOCKS':10, 'RLIMIT_MSGQUEUE':12, 'RLIMIT_NICE':13,
+                 'RLIMIT_RTPRIO':14, 'RLIMIT_RTTIME':15,
+                 'RLIMIT_SIGPENDING':11}
+
+for _name in RLIMIT_NAMES:
+    globals()[_name] = getattr(resource, _name, LINUX_RLIMITS.get(_name))
+__all__.extend(RLIMIT_NAMES)
+
+SIGHUP = signal.SIGHUP
+SIGINT = signal.SIGINT
+SIGQUIT = signal.SIGQUIT
+SIGABRT = signal.SIGABRT
+SIGKILL = signal.SIGKILL
+SIGTERM = signal.SIGTERM
+SIGSTOP = signal.SIGSTOP
+
+
+class rlimit(ctypes.Structure):
+    _fields_ = [('rlim_cur', ctypes.c_uint64), ('rlim_max', ctypes.c_uint64)]
+
+
+def prlimit(pid, limit):
+    '''
+    Returns <type 'tuple'> of the soft and hard "limit" of "pid", through
+    `resource.prlimit` or libc's prlimit64 where it is missing.
+    '''
+    try:
+        return resource.prlimit(pid, limit)
+    except AttributeError:
+        pass
+    current = rlimit()
+    if libc.prlimit64(pid, limit, None, ctypes.byref(current)) == -1:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return current.rlim_cur, current.rlim_max
+
+def curlimit(pid, limit):
+    '''
+    Returns <type 'int'> current soft "limit" of "pid" (RLIM_INFINITY when
+    unlimited).
+    '''
+    return prlimit(pid, limit)[0]
+
+def maxlimit(pid, limit):
+    '''
+    Returns <type 'int'> current hard "limit" of "pid".
+    '''
+    return prlimit(pid, limit)[1]
+
+def parse_cpulist(cpulist):
+    '''
+    Returns <type 'list'> of the cpu ids of a "cpulist" string such as
+    "0-3,6".
+    '''
+    cpus = list()
+    for span in cpulist.strip().split(','):
+        if not span:
+            continue
+        first, _, last = span.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+def online_cpus():
+    '''
+    Returns <type 'list'> of the ids of the online cpus.
+    '''
+    try:
+        with open('/sys/devices/system/cpu/online') as f:
+            return parse_cpulist(f.read())
+    except IOError:
+        return list(range(os.sysconf('SC_NPROCESSORS_ONLN')))
+
+def affinity(pid):
+    '''
+    Returns <type 'int'> number of cpus in the affinity mask of "pid".
+    '''
+    return len(os.sched_getaffinity(pid))
+
+def set_all_affinity(cpus, exclude=()):
+    '''
+    Sets the affinity of every process except those of "exclude" to "cpus",
+    skipping processes that exit or refuse (e.g. per-cpu kernel threads).
+    '''
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit() or int(entry) in exclude:
+            continue
+        try:
+            os.sched_setaffinity(int(entry), cpus)
+        except OSError:
+            continue
+
+def iso(pid):
+    '''
+    Pins "pid" to the first online cpu and every other process to the rest.
+    '''
+    cpus = online_cpus()
+    if len(cpus) <= 1:
+        raise OSError('cannot isolate on a single cpu')
+    os.sched_setaffinity(pid, cpus[:1])
+    set_all_affinity(cpus[1:], exclude=(pid,))
+
+def release_iso(pid):
+    '''
+    Lets every process, "pid" included, run on all online cpus again.
+    '''
+    set_all_affinity(online_cpus())
+
+def tkill(tgid, tid, sig):
+    '''
+    Sends signal "sig" to thread "tid" of thread group "tgid".
+    '''
+    tgkill(tgid, tid, sig)
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Memory growth tracking.  A <MemoryTracker> samples "statm" (one small read)
+at a high rate and the class split of "smaps_rollup" at a low rate, keeps a
+bounded history of both and reports growth rates and whether the anonymous
+memory growth looks like a leak.
+'''
+
+import os
+import time
+
+from collections import deque
+
+from .exception import *
+from .sampler import RingSampler
+from .smaps import aggregate, iter_smaps, rollup
+from .snapshot import parse_statm
+
+
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+
+# Sizes (in kB) kept per statm sample; 'anon' is resident minus shared
+STATM_COUNTERS = ('size', 'resident', 'shared', 'data', 'anon')
+
+# "smaps_rollup" fields (in kB) kept per detail sample
+DETAIL_FIELDS = ('Rss', 'Pss', 'Pss_Anon', 'Pss_File', 'Pss_Shmem',
+                 'Anonymous', 'Swap')
+
+# Mapping class to its proportional set size field of "smaps_rollup"
+CLASS_FIELDS = {'anon':'Pss_Anon', 'file':'Pss_File', 'shmem':'Pss_Shmem'}
+
+
+def slope(points):
+    '''
+    Returns <type 'float'> least squares slope of (x, y) "points", or
+    <type 'NoneType'> for fewer than two distinct x.
+    '''
+    n = len(points)
+    if n < 2:
+        return
+    mean_x = sum(x for x, _ in points) / float(n)
+    mean_y = sum(y for _, y in points) / float(n)
+    var_x = sum((x - mean_x) ** 2 for x, _ in points)
+    if not var_x:
+        return
+    return sum((x - mean_x) * (y - mean_y) for x, y in points) / var_x
+
+def monotonic_fraction(values):
+    '''
+    Returns <type 'float'> fraction of consecutive steps of "values" that do
+    not decrease, or <type 'NoneType'> for fewer than two values.
+    '''
+    steps = list(zip(values, values[1:]))
+    if not steps:
+        return
+    return sum(1 for first, last in steps if last >= first) / float(len(steps))
+
+
+class MemoryTracker(RingSampler):
+    '''
+    MemoryTracker object: samples the memory of "profile" into bounded
+    histories of "size" entries each: every `sample` reads "statm" and every
+    "detail_every"-th sample also reads the DETAIL_FIELDS of "smaps_rollup",
+    whose Pss_Anon, Pss_File and Pss_Shmem split the process by mapping
+    class.  Entries are plain tuples of <type 'int'> kB.  With
+    "per_mapping" a detail sample also walks the full "smaps" and keeps the
+    totals of every mapping path (far costlier on large address spaces).
+
+    `leak` flags steady anonymous growth: the anon size rising at no less
+    than "min_rate" kB/s, across at least "min_growth" kB, in at least
+    "min_monotonic" of the sampling steps.
+    '''
+    def __init__(self, profile, size=600, detail_every=60, min_rate=1.0,
+                 min_growth=1024, min_monotonic=0.8, per_mapping=False):
+        super(MemoryTracker, self).__init__(size)
+        self.profile = profile
+        self.detail_every = detail_every
+        self.min_rate = min_rate
+        self.min_growth = min_growth
+        self.min_monotonic = min_monotonic
+        self.per_mapping = per_mapping
+        self.statm = self.samples
+        self.details = deque(maxlen=size)
+        self.mappings = deque(maxlen=size)
+        self.taken = 0
+
+    def sample(self):
+        '''
+        Class method: returns <type 'tuple'> of the statm sample's timestamp
+        and STATM_COUNTERS (in kB), taking a detail sample as well every
+        `detail_every` samples.
+        '''
+        statm = parse_statm(self.profile.file_reader('/proc/%s/statm' %
+                                                     self.profile.pid))
+        timestamp = time.time()
+        sample = (timestamp, statm['size'] * PAGE_KB,
+                  statm['resident'] * PAGE_KB, statm['shared'] * PAGE_KB,
+                  statm['data'] * PAGE_KB,
+                  (statm['resident'] - statm['shared']) * PAGE_KB)
+        self.statm.append(sample)
+        if self.detail_every and self.taken % self.detail_every == 0:
+            self.detail()
+        self.taken += 1
+        return sample
+
+    def detail(self):
+        '''
+        Class method: returns <type 'tuple'> of the detail sample's timestamp
+        and DETAIL_FIELDS (in kB) after appending it to the detail history
+        (and, with `per_mapping`, the per-path totals to `mappings`).
+        '''
+        timestamp = time.time()
+        totals = rollup(self.profile.pid)
+        sample = (timestamp, tuple(totals.get(field, 0) for field in
+                                   DETAIL_FIELDS))
+        self.details.append(sample)
+        if self.per_mapping:
+            self.mappings.append((timestamp,
+                                  aggregate(iter_smaps(self.profile.pid))))
+        return sample
+
+    def series(self, counter='resident'):
+        '''
+        Class method: returns <type 'list'> of (timestamp, kB) pairs of a
+        statm "counter" (see STATM_COUNTERS).
+        '''
+        i = self.__column(counter)
+        return [(sample[0], sample[i]) for sample in self.statm]
+
+    def growth(self, counter='resident', window=None):
+        '''
+        Class method: returns <type 'float'> growth rate (kB/s, least squares)
+        of a statm "counter" over the last "window" samples (all buffered
+        samples for <type 'NoneType'>).
+        '''
+        series = self.series(counter)
+        if window is not None:
+            series = series[-window:]
+        return slope(series)
+
+    def detail_series(self, field='Pss'):
+        '''
+        Class method: returns <type 'list'> of (timestamp, kB) pairs of a
+        DETAIL_FIELDS "field" from the detail history.
+        '''
+        i = DETAIL_FIELDS.index(field)
+        return [(timestamp, values[i]) for timestamp, values in
+                self.details]
+
+    def class_growth(self, window=None):
+        '''
+        Class method: returns <type 'dict'> of mapping class ('anon', 'file',
+        'shmem') to the growth rate (kB/s, least squares) of its
+        proportional set size over the last "window" detail samples.
+        '''
+        rates = dict()
+        for cls, field in CLASS_FIELDS.items():
+            series = self.detail_series(field)
+            if window is not None:
+                series = series[-window:]
+            rates[cls] = slope(series)
+        return rates
+
+    def mapping_growth(self, field='Rss', window=None):
+        '''
+        Class method: returns <type 'dict'> of mapping path to the growth
+        rate (kB/s, least squares) of its smaps "field" over the last
+        "window" per-mapping samples (empty without `per_mapping`).
+        '''
+        samples = list(self.mappings)
+        if window is not None:
+            samples = samples[-window:]
+        series = dict()
+        for timestamp, totals in samples:
+            for path, fields in totals.items():
+                series.setdefault(path, list()).append(
+                    (timestamp, fields.get(field, 0)))
+        return {path:slope(points) for path, points in series.items()}
+
+    def leak_report(self, window=None):
+        '''
+        Class method: returns <type 'dict'> of the anonymous memory's growth
+        'rate' (kB/s), total 'growth' (kB), 'monotonic' step fraction and
+        'duration' (s) over the last "window" samples, and whether a 'leak'
+        is suspected (see `MemoryTracker`).
+        '''
+        series = self.series('anon')
+        if window is not None:
+            series = series[-window:]
+        report = {'rate':slope(series), 'growth':None, 'monotonic':None,
+                  'duration':None, 'leak':False}
+        if len(series) < 2:
+            return report
+        values = [value for _, value in series]
+        report['growth'] = values[-1] - values[0]
+        report['monotonic'] = monotonic_fraction(values)
+        report['duration'] = series[-1][0] - series[0][0]
+        report['leak'] = (report['rate'] is not None and
+                          report['rate'] >= self.min_rate and
+                          report['growth'] >= self.min_growth and
+                          report['monotonic'] >= self.min_monotonic)
+        return report
+
+    def leak(self, window=None):
+        '''
+        Class method: returns <type 'bool'> if the anonymous memory growth
+        over the last "window" samples looks like a leak.
+        '''
+        return self.leak_report(window)['leak']
+
+    def clear(self):
+        super(MemoryTracker, self).clear()
+        self.details.clear()
+        self.mappings.clear()
+        self.taken = 0
+
+    def __column(self, counter):
+        try:
+            return STATM_COUNTERS.index(counter) + 1
+        except ValueError:
+            raise KeyError("counter '%s' is not sampled" % counter)
+
+    def __repr__(self):
+        return "<class '%s (pid: %s | samples: %d/%d | details: %d)'>" % (
+            self.__class__.__name__, self.profile.pid, len(self.statm),
+            self.size, len(self.details))
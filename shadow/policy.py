@@ -0,0 +1,422 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Priority policies for whole sets of processes.  A <PolicyEngine> holds
+<PolicyRule>s that select processes by name, user, cgroup, process group or
+process tree and apply a <Policy> (nice, io class and level, scheduler
+policy) to every thread of each one.  Processes spawned later are caught as
+they fork or exec through the process events connector (or by the next
+sweep of "/proc" without it).
+'''
+
+import errno
+import os
+import socket
+import time
+
+from .exception import *
+from .priorities import (PRIO_PGRP, PRIO_PROCESS, PRIO_USER, IOPRIO_LEVELS,
+                         IOPRIO_WHO_PGRP, IOPRIO_WHO_PROCESS, IOPRIO_WHO_USER,
+                         ioprio_class_ids, priority_classes, sched_policies,
+                         setioprio, setnice, setscheduler)
+from .proctree import ProcessTree
+from .sampler import run_periodic
+from .snapshot import parse_stat, parse_status, read_file
+from .taskstats.procevents import ProcEvents
+
+
+# Group selector to the setpriority and ioprio_set "who" covering it
+GROUP_TARGETS = {'pgrps':(PRIO_PGRP, IOPRIO_WHO_PGRP),
+                 'uids':(PRIO_USER, IOPRIO_WHO_USER)}
+
+SELECTORS = ('names', 'uids', 'cgroups', 'trees', 'pgrps')
+
+
+class Policy(object):
+    '''
+    Policy object: the "nice" level, io priority ("io_class" one of
+    'realtime', 'best-effort' or 'idle' at "io_level" 0-7) and "scheduler"
+    policy (one of 'other', 'batch', 'idle', 'fifo' or 'rr', with
+    "rt_priority" for the last two) to give a process.  Settings left as
+    <type 'NoneType'> are not touched.  Out of range settings raise
+    <type 'ValueError'> here rather than on every sweep.
+    '''
+    def __init__(self, nice=None, io_class=None, io_level=0, scheduler=None,
+                 rt_priority=0):
+        if io_class is not None and io_class not in ioprio_class_ids:
+            raise ValueError("io_class is one of %s, not %r" %
+                             (', '.join(priority_classes.values()), io_class))
+        if scheduler is not None and scheduler not in sched_policies:
+            raise ValueError("scheduler is one of %s, not %r" %
+                             (', '.join(sorted(sched_policies)), scheduler))
+        if nice is not None and not -20 <= nice <= 19:
+            raise ValueError("nice is -20 to 19, not %r" % (nice,))
+        if not 0 <= io_level < IOPRIO_LEVELS:
+            raise ValueError("io_level is 0 to %d, not %r" %
+                             (IOPRIO_LEVELS - 1, io_level))
+        low = high = 0
+        if scheduler in ('fifo', 'rr'):
+            low = os.sched_get_priority_min(sched_policies[scheduler])
+            high = os.sched_get_priority_max(sched_policies[scheduler])
+        if not low <= rt_priority <= high:
+            raise ValueError("rt_priority of scheduler %r is %d to %d, not %r"
+                             % (scheduler, low, high, rt_priority))
+        self.nice = nice
+        self.io_class = io_class
+        self.io_level = io_level
+        self.scheduler = scheduler
+        self.rt_priority = rt_priority
+
+    def apply(self, tid):
+        '''
+        Class method: returns <type 'NoneType'> :: applies the policy to the
+        single thread "tid" (nice and io priority are per thread on Linux).
+        '''
+        if self.scheduler is not None:
+            setscheduler(tid, self.scheduler, self.rt_priority)
+        if self.nice is not None:
+            setnice(tid, self.nice, PRIO_PROCESS)
+        if self.io_class is not None:
+            setioprio(tid, self.io_class, self.io_level, IOPRIO_WHO_PROCESS)
+
+    def apply_group(self, selector, which):
+        '''
+        Class method: returns <type 'NoneType'> :: applies nice and io
+        priority to every thread of process group or real user id "which"
+        ("selector" 'pgrps' or 'uids') with one syscall each.  There is no
+        group form of the scheduler policy, see `apply`.
+        '''
+        prio_who, ioprio_who = GROUP_TARGETS[selector]
+        if self.nice is not None:
+            setnice(which, self.nice, prio_who)
+        if self.io_class is not None:
+            setioprio(which, self.io_class, self.io_level, ioprio_who)
+
+    def __repr__(self):
+        return "<class '%s (nice: %s | io: %s/%s | scheduler: %s)'>" % (
+            self.__class__.__name__, self.nice, self.io_class,
+            self.io_level, self.scheduler)
+
+
+class PolicyRule(object):
+    '''
+    PolicyRule object: applies "policy" to the processes matching every
+    selector given: command "names", owner "uids", "cgroups" (path prefixes
+    of any hierarchy in "/proc/<pid>/cgroup"), the process "trees" rooted at
+    the given pids, or process groups "pgrps".
+
+    A rule selecting on "pgrps" alone, or "uids" alone, is applied during a
+    sweep with one setpriority and one ioprio_set per group or user instead
+    of a call per thread, as long as every process the kernel counts in that
+    group or real uid is won by the rule (see `PolicyEngine.sweep`).
+    '''
+    def __init__(self, policy, names=None, uids=None, cgroups=None,
+                 trees=None, pgrps=None):
+        self.policy = policy
+        self.names = set(names) if names is not None else None
+        self.uids = set(uids) if uids is not None else None
+        self.cgroups = tuple(cgroups) if cgroups is not None else None
+        self.trees = set(trees) if trees is not None else None
+        self.pgrps = set(pgrps) if pgrps is not None else None
+        self.members = set()
+        selected = [selector for selector in SELECTORS
+                    if getattr(self, selector) is not None]
+        self.group = None
+        if len(selected) == 1 and selected[0] in GROUP_TARGETS:
+            self.group = selected[0]
+
+    def matches(self, pid, info):
+        '''
+        Class method: returns <type 'bool'> if "pid" (described by "info",
+        see `PolicyEngine.identify`) is selected by this rule.
+        '''
+        if self.names is not None and info['name'] not in self.names:
+            return False
+        if self.uids is not None and info['uid'] not in self.uids:
+            return False
+        if self.pgrps is not None and info['pgrp'] not in self.pgrps:
+            return False
+        if self.trees is not None and pid not in self.members:
+            return False
+        if self.cgroups is not None:
+            for line in (info['cgroup'] or '').split('\n'):
+                path = line.split(':', 2)[-1]
+                if path and path.startswith(self.cgroups):
+                    return True
+            return False
+        return True
+
+    def group_id(self, info, real=False):
+        '''
+        Class method: returns the process group or uid this rule selects a
+        process described by "info" on, or with "real" the process group or
+        real uid the kernel's group syscalls find it by.
+        '''
+        if self.group == 'pgrps':
+            return info['pgrp']
+        return info['ruid'] if real else info['uid']
+
+    def __repr__(self):
+        selectors = ', '.join('%s=%s' % (selector,
+                                         sorted(getattr(self, selector)))
+                              for selector in SELECTORS
+                              if getattr(self, selector) is not None)
+        return "<class '%s (%s | %r)'>" % (self.__class__.__name__, selectors,
+                                           self.policy)
+
+
+class PolicyEngine(object):
+    '''
+    PolicyEngine object: keeps "rules" (see `add`) applied.  The first rule
+    matching a process wins.  `sweep` walks "/proc" once and applies the
+    policy of every matching process not yet handled (or whose pid has been
+    reused); `handle` does the same for the process of one <ProcEvent>, so
+    `watch` reaches new members as they fork or exec.  Threads created later
+    inherit the policy of the thread that created them.
+
+    Processes the policy could not be applied to (e.g. without the rights
+    to raise a priority) are kept in `failed` with their <type 'OSError'>
+    and retried on the next sweep.
+    '''
+    def __init__(self, rules=()):
+        self.rules = list(rules)
+        self.applied = dict()
+        self.failed = dict()
+        self.__tree = None
+
+    def add(self, policy, names=None, uids=None, cgroups=None, trees=None,
+            pgrps=None):
+        '''
+        Class method: returns the <PolicyRule> appended for "policy" (a
+        <Policy>) and the given selectors (see <PolicyRule>).
+        '''
+        rule = PolicyRule(policy, names, uids, cgroups, trees, pgrps)
+        self.rules.append(rule)
+        return rule
+
+    def identify(self, pid):
+        '''
+        Class method: returns <type 'dict'> of the 'name', 'uid' (owner of
+        "/proc/<pid>"), 'pgrp', 'ppid', 'start_time', (when a rule selects
+        on cgroups) 'cgroup' and (when a rule is applied per user) real uid
+        'ruid' of "pid", or <type 'NoneType'> once it has exited.
+        '''
+        proc_path = '/proc/%s' % pid
+        try:
+            uid = os.stat(proc_path).st_uid
+            stat = parse_stat(read_file(proc_path + '/stat'))
+            cgroup = ruid = None
+            if any(rule.cgroups is not None for rule in self.rules):
+                cgroup = read_file(proc_path + '/cgroup')
+            if any(rule.group == 'uids' for rule in self.rules):
+                status = parse_status(read_file(proc_path + '/status'))
+                ruid = int(status['uid'][0])
+        except (OSError, InvalidPath):
+            return
+        return {'name':stat['tcomm'], 'uid':uid, 'pgrp':stat['pgrp'],
+                'ppid':stat['ppid'], 'start_time':stat['start_time'],
+                'cgroup':cgroup, 'ruid':ruid}
+
+    def match(self, pid, info):
+        '''
+        Class method: returns the first <PolicyRule> selecting "pid", or
+        <type 'NoneType'>.
+        '''
+        for rule in self.rules:
+            if rule.matches(pid, info):
+                return rule
+
+    def sweep(self):
+        '''
+        Class method: returns <type 'int'> of processes the policies were
+        newly applied to by one walk over "/proc".
+
+        The group syscalls of a group rule reach every process of the
+        process group or real uid, so they are used only when the rule wins
+        all of them; a group holding a process won by another rule (or by
+        none) is applied per process instead.  So is a process whose owner
+        differs from its real uid, which the kernel counts in another user.
+        '''
+        self.__refresh_trees()
+        seen = set()
+        groups = dict()
+        winners = dict()
+        applied = 0
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            pid = int(entry)
+            info = self.identify(pid)
+            if info is None:
+                continue
+            seen.add(pid)
+            rule = self.match(pid, info)
+            winners.setdefault(('pgrps', info['pgrp']), set()).add(rule)
+            if info['ruid'] is not None:
+                winners.setdefault(('uids', info['ruid']), set()).add(rule)
+            if rule is None or self.__current(pid, info, rule):
+                continue
+            if rule.group is not None:
+                key = (rule, rule.group_id(info))
+                groups.setdefault(key, list()).append((pid, info))
+            elif self.__apply(rule, pid, info):
+                applied += 1
+        for (rule, which), members in groups.items():
+            if winners.get((rule.group, which)) != set([rule]):
+                applied += sum(self.__apply(rule, pid, info)
+                               for pid, info in members)
+                continue
+            try:
+                rule.policy.apply_group(rule.group, which)
+            except OSError as err:
+                for pid, _ in members:
+                    self.failed[pid] = err
+                continue
+            for pid, info in members:
+                if rule.policy.scheduler is None and \
+                        rule.group_id(info, real=True) == which:
+                    self.__applied(rule, pid, info)
+                    applied += 1
+                elif self.__apply(rule, pid, info):
+                    applied += 1
+        for pid in set(self.applied) - seen:
+            del self.applied[pid]
+        for pid in set(self.failed) - seen:
+            del self.failed[pid]
+        return applied
+
+    def handle(self, event):
+        '''
+        Class method: returns <type 'bool'> if a policy was applied to the
+        process of <ProcEvent> "event": a new process (fork), a changed one
+        (exec, comm, uid, gid or sid) or an exit, which forgets it.
+        '''
+        pid = event.tgid
+        if event.kind == 'exit':
+            if event.pid == event.tgid:
+                self.applied.pop(pid, None)
+                self.failed.pop(pid, None)
+                for rule in self.rules:
+                    rule.members.discard(pid)
+            return False
+        if event.kind == 'fork':
+            if event.pid != event.tgid:
+                return False
+            for rule in self.rules:
+                if event.parent_tgid in rule.members:
+                    rule.members.add(pid)
+        elif event.kind not in ('exec', 'comm', 'uid', 'gid', 'sid'):
+            return False
+        info = self.identify(pid)
+        if info is None:
+            return False
+        rule = self.match(pid, info)
+        if rule is None or self.__current(pid, info, rule):
+            return False
+        return self.__apply(rule, pid, info)
+
+    def watch(self, duration=None, resync=60.0):
+        '''
+        Class method: returns <type 'NoneType'> :: sweeps, then applies the
+        policies to processes as their events arrive for "duration" seconds
+        (forever for <type 'NoneType'>), sweeping again every "resync"
+        seconds and whenever events were dropped.  Without the process
+        events connector (it needs CAP_NET_ADMIN) it only sweeps.
+        '''
+        deadline = None if duration is None else time.time() + duration
+        try:
+            events = ProcEvents()
+            events.listen()
+        except (OSError, socket.error):
+            events = None
+        try:
+            next_sweep = 0
+            dropped = 0
+            while deadline is None or time.time() < deadline:
+                now = time.time()
+                if now >= next_sweep or (events and events.dropped != dropped):
+                    self.sweep()
+                    next_sweep = now + resync
+                    dropped = events.dropped if events else 0
+                wait = next_sweep - now
+                if deadline is not None:
+                    wait = min(wait, deadline - now)
+                if wait <= 0:
+                    continue
+                if events is None:
+                    time.sleep(wait)
+                    continue
+                for event in events.events(timeout=wait):
+                    self.handle(event)
+                    now = time.time()
+                    if now >= next_sweep or events.dropped != dropped or \
+                            (deadline is not None and now >= deadline):
+                        break
+        finally:
+            if events is not None:
+                events.close()
+
+    def run(self, interval, count=None):
+        '''
+        Class method: returns <type 'NoneType'> :: sweeps every "interval"
+        seconds, "count" times (forever for <type 'NoneType'>).
+        '''
+        run_periodic(self.sweep, interval, count)
+
+    def __current(self, pid, info, rule):
+        return self.applied.get(pid) == (info['start_time'], rule)
+
+    def __applied(self, rule, pid, info):
+        self.applied[pid] = (info['start_time'], rule)
+        self.failed.pop(pid, None)
+
+    def __apply(self, rule, pid, info):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'bool'> if "rule"'s policy was applied to every thread of
+        "pid"; threads that exit meanwhile are skipped.
+        '''
+        try:
+            tids = os.listdir('/proc/%s/task' % pid)
+        except OSError:
+            return False
+        try:
+            for tid in tids:
+                try:
+                    rule.policy.apply(int(tid))
+                except OSError as err:
+                    if err.errno != errno.ESRCH:
+                        raise
+        except OSError as err:
+            self.failed[pid] = err
+            return False
+        self.__applied(rule, pid, info)
+        return True
+
+    def __refresh_trees(self):
+        '''
+        Private class method: (not meant to be called directly) recomputes
+        the members of every rule selecting on process trees.
+        '''
+        tree_rules = [rule for rule in self.rules if rule.trees is not None]
+        if not tree_rules:
+            return
+        if self.__tree is None:
+            self.__tree = ProcessTree(io=False, fds=False, taskstats=False)
+        tree = self.__tree.refresh()
+        for rule in tree_rules:
+            members = set()
+            for root in rule.trees:
+                if root in tree:
+                    members.add(root)
+                    members.update(tree.descendants(root))
+            rule.members = members
+
+    def __len__(self):
+        return len(self.rules)
+
+    def __repr__(self):
+        return "<class '%s (rules: %d | applied: %d | failed: %d)'>" % (
+            self.__class__.__name__, len(self.rules), len(self.applied),
+            len(self.failed))
@@ -2,6 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import ctypes
+import os
+import platform
+import struct
 
 
 PRIO_PROCESS = ctypes.c_int(0)
@@ -23,13 +26,70 @@ IOPRIO_MASK = (IOPRIO_MASK_BASE.value << IOPRIO_SHIFT) - 1
 
 IOPRIO_PRIO_CLASS = lambda mask: mask >> IOPRIO_SHIFT
 IOPRIO_PRIO_DATA = lambda mask: mask & IOPRIO_MASK
-
-IOPRIO_GET = 290 #XXX will vary depending on architecture
-TGKILL     = 270 # these values are for a i686 32bit system
-
-libc = ctypes.CDLL('libc.so.6')
-
-ioprio_get = lambda WHO, WHICH: libc.syscall(IOPRIO_GET, WHO, WHICH)
+IOPRIO_PRIO_VALUE = lambda cls, data: (cls << IOPRIO_SHIFT) | data
+
+ioprio_class_ids = {name:cls for cls, name in priority_classes.items()}
+
+# Levels 0 (highest) to 7 of the realtime and best-effort classes
+IOPRIO_LEVELS = 8
+
+sched_policies = {'other':os.SCHED_OTHER, 'batch':os.SCHED_BATCH,
+                  'idle':os.SCHED_IDLE, 'fifo':os.SCHED_FIFO,
+                  'rr':os.SCHED_RR}
+
+# Syscall numbers (tgkill, ioprio_set, ioprio_get) per architecture; the
+# asm-generic table covers arm64, riscv64 and loongarch64
+SYSCALLS = {'x86_64':(234, 251, 252),
+            'i386':(270, 289, 290),
+            'arm':(268, 314, 315),
+            'ppc64':(250, 273, 274),
+            's390x':(241, 282, 283),
+            'generic':(131, 30, 31)}
+
+MACHINE_ALIASES = {'amd64':'x86_64', 'i486':'i386', 'i586':'i386',
+                   'i686':'i386', 'armv6l':'arm', 'armv7l':'arm',
+                   'armv8l':'arm', 'ppc64le':'ppc64', 'ppc':'ppc64',
+                   'aarch64':'generic', 'arm64':'generic',
+                   'riscv64':'generic', 'loongarch64':'generic'}
+
+
+def syscall_numbers(machine=None):
+    '''
+    Returns <type 'tuple'> of the tgkill, ioprio_set and ioprio_get syscall
+    numbers of "machine" (the running one by default, a 32 bit interpreter on
+    x86_64 uses the i386 table).
+    '''
+    machine = machine or platform.machine()
+    arch = MACHINE_ALIASES.get(machine, machine)
+    if arch == 'x86_64' and struct.calcsize('P') == 4:
+        arch = 'i386'
+    if arch not in SYSCALLS:
+        raise OSError('no syscall table for machine %r' % machine)
+    return SYSCALLS[arch]
+
+try:
+    TGKILL, IOPRIO_SET, IOPRIO_GET = syscall_numbers()
+except OSError:
+    TGKILL = IOPRIO_SET = IOPRIO_GET = None
+
+libc = ctypes.CDLL(None, use_errno=True)
+
+
+def syscall(number, *args):
+    '''
+    Returns <type 'int'> result of raw syscall "number", raising
+    <type 'OSError'> with its errno on failure.
+    '''
+    if number is None:
+        raise OSError('syscall not available on %s' % platform.machine())
+    ret = libc.syscall(number, *args)
+    if ret == -1:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return ret
+
+ioprio_get = lambda WHO, WHICH: syscall(IOPRIO_GET, WHO, WHICH)
+ioprio_set = lambda WHO, WHICH, MASK: syscall(IOPRIO_SET, WHO, WHICH, MASK)
 getpriority = lambda WHO, WHICH: libc.getpriority(WHO, WHICH)
 setpriority = lambda WHO, WHICH, VALUE: libc.setpriority(WHO, WHICH, VALUE)
 
@@ -51,11 +111,36 @@ def nice(which, who=PRIO_PROCESS):
     niceness = getpriority(who, which)
     return niceness
 
+def setioprio(which, io_class, level=0, who=IOPRIO_WHO_PROCESS):
+    '''
+    Sets the io priority of "which" (a pid, process group or uid as "who"
+    says) to "io_class" (a name of priority_classes or its number) at
+    "level" (0-7, ignored by the idle class).
+    '''
+    io_class = ioprio_class_ids.get(io_class, io_class)
+    if io_class not in priority_classes:
+        raise ValueError('unknown io priority class %r' % (io_class,))
+    if not 0 <= level < IOPRIO_LEVELS:
+        raise ValueError('io priority level %r is not 0-7' % (level,))
+    ioprio_set(who, which, IOPRIO_PRIO_VALUE(io_class, level))
+    return
+
 def setnice(which, level, who=PRIO_PROCESS):
-    setpriority(who, which, level)
+    if setpriority(who, which, level) == -1:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+    return
+
+def setscheduler(tid, policy, rt_priority=0):
+    '''
+    Sets the scheduling "policy" (a name of sched_policies or its number) of
+    thread "tid", with "rt_priority" (1-99) for 'fifo' and 'rr'.
+    '''
+    policy = sched_policies.get(policy, policy)
+    os.sched_setscheduler(tid, policy, os.sched_param(rt_priority))
     return
 
-def tgkill(tgid, tid):
-    libc.syscall(TGKILL, tgid, tid, signal)
+def tgkill(tgid, tid, sig):
+    syscall(TGKILL, tgid, tid, sig)
     return
 
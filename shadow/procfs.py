@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Open-descriptor procfs reader.  Files read at a high rate (a process'
+"stat", "status", "io", ...) are opened once and re-read from offset 0 with
+`pread`, skipping the path lookup and descriptor allocation of an
+open/read/close per access.
+'''
+
+import errno
+import os
+import threading
+
+from collections import OrderedDict
+
+from .exception import *
+
+
+class ProcfsReader(object):
+    '''
+    ProcfsReader object: reads files through descriptors kept open between
+    calls, at most "max_open" of them (the least recently read is closed
+    first; the default covers the four files of a <Snapshot>).  Reads go
+    into a preallocated buffer per file that grows to the largest size seen.
+
+    A procfs descriptor stays bound to the process it was opened for, so once
+    that process has exited (even if its pid was reused) reads fail with
+    ESRCH and raise <BadProcess> for "pid"; other failures raise
+    <InvalidPath> like `snapshot.read_file`.
+    '''
+    def __init__(self, pid=None, max_open=4, bufsize=4096):
+        self.pid = pid
+        self.max_open = max_open
+        self.bufsize = bufsize
+        self.files = OrderedDict()
+        self.lock = threading.Lock()
+
+    def read(self, fpath):
+        '''
+        Class method: returns <type 'str'> for the file contents of fpath.
+        '''
+        with self.lock:
+            entry = self.files.get(fpath)
+            if entry is None:
+                entry = self.__open(fpath)
+            else:
+                self.files.move_to_end(fpath)
+            fd, buf = entry
+            length = 0
+            try:
+                while True:
+                    if length == len(buf):
+                        buf.extend(bytearray(len(buf)))
+                    view = memoryview(buf)[length:]
+                    read = preadinto(fd, view, length)
+                    view.release()
+                    if not read:
+                        break
+                    length += read
+            except OSError as err:
+                self.__close(fpath)
+                if err.errno == errno.ESRCH:
+                    raise BadProcess(self.pid)
+                raise InvalidPath(fpath)
+            return buf[:length].decode('utf-8', 'replace')
+
+    def __call__(self, fpath):
+        return self.read(fpath)
+
+    def close(self):
+        with self.lock:
+            for fpath in list(self.files):
+                self.__close(fpath)
+
+    def __open(self, fpath):
+        '''
+        Private class method: (not meant to be called directly) returns the
+        (fd, buffer) of a newly opened "fpath", evicting the least recently
+        read file if `max_open` are already open.
+        '''
+        try:
+            fd = os.open(fpath, os.O_RDONLY | getattr(os, 'O_CLOEXEC', 0))
+        except OSError as err:
+            if err.errno == errno.ESRCH:
+                raise BadProcess(self.pid)
+            raise InvalidPath(fpath)
+        while len(self.files) >= self.max_open:
+            self.__close(next(iter(self.files)))
+        entry = self.files[fpath] = (fd, bytearray(self.bufsize))
+        return entry
+
+    def __close(self, fpath):
+        fd, _ = self.files.pop(fpath)
+        os.close(fd)
+
+    def __len__(self):
+        return len(self.files)
+
+    def __repr__(self):
+        return "<class '%s (pid: %s | open: %d/%d)'>" % (
+            self.__class__.__name__, self.pid, len(self.files),
+            self.max_open)
+
+
+def preadinto(fd, buf, offset=0):
+    '''
+    Returns <type 'int'> of bytes read from "offset" of "fd" into "buf",
+    without allocating where `os.preadv` is available.
+    '''
+    try:
+        return os.preadv(fd, [buf], offset)
+    except AttributeError:
+        raw = os.pread(fd, len(buf), offset)
+        buf[:len(raw)] = raw
+        return len(raw)
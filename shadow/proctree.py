@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Process-tree index: a <ProcessTree> links every pid in "/proc" to its parent
+and children from one sweep and rolls resource usage up over whole subtrees
+(e.g. a supervisor and all of its workers).
+'''
+
+import os
+
+from .exception import *
+from .snapshot import parse_stat, parse_io
+from .taskstats.taskstats import Taskstats, taskstats_pool
+
+
+# Fields summed over a subtree (or process group / session)
+ROLLUP_FIELDS = ('utime', 'stime', 'rss', 'read_bytes', 'write_bytes', 'fds')
+
+
+class ProcessNode(object):
+    '''
+    One process of a <ProcessTree>: its identity ("pid", "ppid", "pgrp",
+    "sid", "name", "start_time"), the rolled up counters of ROLLUP_FIELDS
+    ("utime"/"stime" in clock ticks, "rss" in pages, io in bytes; any of
+    them <type 'NoneType'> when unreadable) and the pids of its "children".
+    '''
+
+    __slots__ = ('pid', 'ppid', 'pgrp', 'sid', 'name', 'start_time', 'raw',
+                 'children') + ROLLUP_FIELDS
+
+    def __init__(self, raw_stat):
+        stat = parse_stat(raw_stat)
+        self.raw = raw_stat
+        self.pid = stat['pid']
+        self.ppid = stat['ppid']
+        self.pgrp = stat['pgrp']
+        self.sid = stat['sid']
+        self.name = stat['tcomm']
+        self.start_time = stat['start_time']
+        self.utime = stat['utime']
+        self.stime = stat['stime']
+        self.rss = stat['rss']
+        self.read_bytes = self.write_bytes = self.fds = None
+        self.children = list()
+
+    def as_dict(self):
+        return {field:getattr(self, field) for field in self.__slots__
+                if field != 'raw'}
+
+    def __repr__(self):
+        return "<ProcessNode (pid: %s | name: %s | children: %d)>" % (
+            self.pid, self.name, len(self.children))
+
+
+class ProcessTree(object):
+    '''
+    ProcessTree object: indexes every process in "/proc" by pid with parent
+    and child links, refreshed by `refresh`.
+
+    Refreshes are incremental: each pid's "stat" is read, but only parsed
+    again when it differs from the last sweep.  A process can run (open
+    files, do io) without its "stat" changing, so io counters and fd counts
+    are read on every refresh.  With "io" unset io counters are not
+    collected, with "fds" unset neither are fd counts; io of processes whose
+    "io" is unreadable is filled in from one batched taskstats query when
+    "taskstats" is set.
+    '''
+    def __init__(self, io=True, fds=True, taskstats=True):
+        self.io = io
+        self.fds = fds
+        self.taskstats = taskstats
+        self.__taskstats = Taskstats(pool=taskstats_pool())
+        self.nodes = dict()
+        self.reparsed = set()
+        self.__totals = None
+
+    def refresh(self):
+        '''
+        Class method: returns <ProcessTree> (self) after one sweep over
+        "/proc", reparsing only the pids that are new or have changed (see
+        `reparsed`).
+        '''
+        nodes = dict()
+        reparsed = set()
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            try:
+                with open('/proc/%s/stat' % entry) as f:
+                    raw_stat = f.read()
+            except (IOError, OSError):
+                continue
+            node = self.nodes.get(int(entry))
+            if node is None or node.raw != raw_stat:
+                node = ProcessNode(raw_stat)
+                reparsed.add(node.pid)
+            self.__read_counters(node)
+            nodes[node.pid] = node
+        self.__taskstats_io(nodes.values())
+        for node in nodes.values():
+            node.children = list()
+        for node in nodes.values():
+            parent = nodes.get(node.ppid)
+            if parent is not None and parent is not node:
+                parent.children.append(node.pid)
+        self.nodes = nodes
+        self.reparsed = reparsed
+        self.__totals = None
+        return self
+
+    def parent(self, pid):
+        '''
+        Class method: returns <ProcessNode> of the parent of "pid" or
+        <type 'NoneType'> for a root.
+        '''
+        return self.nodes.get(self[pid].ppid)
+
+    def children(self, pid):
+        '''
+        Class method: returns <type 'list'> of the pids of the direct
+        children of "pid".
+        '''
+        return list(self[pid].children)
+
+    def descendants(self, pid):
+        '''
+        Class method: returns <type 'list'> of the pids of every process
+        below "pid", parents before their children.
+        '''
+        descendants = list()
+        stack = list(reversed(self[pid].children))
+        while stack:
+            child = stack.pop()
+            descendants.append(child)
+            stack.extend(reversed(self.nodes[child].children))
+        return descendants
+
+    def ancestors(self, pid):
+        '''
+        Class method: returns <type 'list'> of the pids from the parent of
+        "pid" up to its root.
+        '''
+        ancestors = list()
+        node = self.parent(pid)
+        while node is not None and node.pid not in ancestors:
+            ancestors.append(node.pid)
+            node = self.nodes.get(node.ppid)
+        return ancestors
+
+    def roots(self):
+        '''
+        Class method: returns <type 'list'> of the pids without a parent in
+        the tree (init, kthreadd and the roots of other pid namespaces).
+        '''
+        return sorted(pid for pid, node in self.nodes.items()
+                      if node.ppid not in self.nodes or node.ppid == pid)
+
+    def find(self, name):
+        '''
+        Class method: returns <type 'list'> of the pids whose command name is
+        "name".
+        '''
+        return sorted(pid for pid, node in self.nodes.items()
+                      if node.name == name)
+
+    def subtree(self, pid):
+        '''
+        Class method: returns <type 'dict'> of ROLLUP_FIELDS summed over "pid"
+        and all of its descendants, plus the 'count' of processes.
+        '''
+        self[pid]
+        return dict(self.__subtree_totals()[pid])
+
+    def groups(self, by='pgrp'):
+        '''
+        Class method: returns <type 'dict'> of process group ("by"='pgrp') or
+        session ("by"='sid') id to the <type 'list'> of its member pids.
+        '''
+        if by not in ('pgrp', 'sid'):
+            raise ValueError("group by 'pgrp' or 'sid', not %r" % by)
+        groups = dict()
+        for pid, node in self.nodes.items():
+            groups.setdefault(getattr(node, by), list()).append(pid)
+        return groups
+
+    def group_totals(self, by='pgrp'):
+        '''
+        Class method: returns <type 'dict'> of process group or session id
+        (see `groups`) to its ROLLUP_FIELDS totals and 'count'.
+        '''
+        return {group:rollup(self.nodes[pid] for pid in pids)
+                for group, pids in self.groups(by).items()}
+
+    def __subtree_totals(self):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'dict'> of every pid to its subtree totals, computed bottom-up
+        once per refresh.
+        '''
+        if self.__totals is not None:
+            return self.__totals
+        totals = dict()
+        for root in self.roots():
+            order = [root] + self.descendants(root)
+            for pid in reversed(order):
+                node = self.nodes[pid]
+                total = rollup([node])
+                for child in node.children:
+                    for field, value in totals[child].items():
+                        total[field] += value
+                totals[pid] = total
+        self.__totals = totals
+        return totals
+
+    def __read_counters(self, node):
+        '''
+        Private class method: (not meant to be called directly) reads the
+        current io counters and fd count of "node".
+        '''
+        proc_path = '/proc/%d' % node.pid
+        node.read_bytes = node.write_bytes = node.fds = None
+        if self.io:
+            try:
+                with open(proc_path + '/io') as f:
+                    io = parse_io(f.read())
+                node.read_bytes = io['read_bytes']
+                node.write_bytes = io['write_bytes']
+            except (IOError, OSError):
+                pass
+        if self.fds:
+            try:
+                node.fds = len(os.listdir(proc_path + '/fd'))
+            except OSError:
+                pass
+
+    def __taskstats_io(self, nodes):
+        '''
+        Private class method: (not meant to be called directly) fills in the
+        io counters of "nodes" whose "io" was unreadable, summed over their
+        threads from one batched query over the pooled taskstats connection.
+        '''
+        if not self.io or not self.taskstats:
+            return
+        missing = {node.pid:node for node in nodes if node.read_bytes is None}
+        if not missing:
+            return
+        try:
+            tasks = self.__taskstats.get_io(missing)
+        except EnvironmentError:
+            self.taskstats = False
+            return
+        for pid, task in tasks.items():
+            missing[pid].read_bytes = task['read_bytes']
+            missing[pid].write_bytes = task['write_bytes']
+
+    def __getitem__(self, pid):
+        try:
+            return self.nodes[pid]
+        except KeyError:
+            raise BadProcess(pid)
+
+    def __contains__(self, pid):
+        return pid in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __iter__(self):
+        return iter(self.nodes)
+
+    def __repr__(self):
+        return "<class '%s (pids: %d)'>" % (self.__class__.__name__,
+                                            len(self.nodes))
+
+
+def rollup(nodes):
+    '''
+    Returns <type 'dict'> of ROLLUP_FIELDS summed over "nodes" (unreadable
+    values count as 0) and the 'count' of nodes.
+    '''
+    total = dict.fromkeys(ROLLUP_FIELDS, 0)
+    total['count'] = 0
+    for node in nodes:
+        total['count'] += 1
+        for field in ROLLUP_FIELDS:
+            value = getattr(node, field)
+            if value is not None:
+                total[field] += value
+    return total
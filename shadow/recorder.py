@@ -0,0 +1,380 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Append-only, column-oriented recording of process samples.  Each sweep over
+a set of pids is written as one block holding a pid column and one column
+per recorded field; values are delta-encoded against the same pid's values
+in the previous block (with periodic keyframes) and compressed, so idle
+processes cost next to nothing.  A <RecordReader> memory-maps the file and
+slices it by pid and time range.
+'''
+
+import bisect
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from array import array
+
+from .exception import *
+from .sampler import run_periodic
+from .snapshot import Snapshot, read_file, read_snapshot
+from .taskstats.taskstats import (TASKSTATS_CMD_ATTR_TGID,
+                                  TASKSTATS_IO_FIELDS, Taskstats,
+                                  taskstats_pool)
+
+
+RECORD_MAGIC = b'SHDWREC1'
+BLOCK_MAGIC = b'SHBK'
+
+# File header: magic, format version, length of the column names that follow
+FILE_HEADER = struct.Struct('=8sHI')
+RECORD_VERSION = 1
+
+# Block header: magic, payload length, timestamp, rows, keyframe flag
+BLOCK_HEADER = struct.Struct('=4sIdIB3x')
+
+# Stored for values that could not be read, or that do not fit the signed
+# 64 bit columns (e.g. an unlimited "rsslim")
+MISSING = -(1 << 63)
+INT64_MAX = (1 << 63) - 1
+
+DEFAULT_COLUMNS = ('utime', 'stime', 'min_flt', 'maj_flt', 'num_threads',
+                   'vsize', 'rss', 'resident', 'shared', 'rchar', 'wchar',
+                   'read_bytes', 'write_bytes', 'cpu_delay_total',
+                   'blkio_delay_total', 'nvcsw', 'nivcsw')
+
+# Taskstats equivalents of the "io" counters, used when "io" is unreadable
+IO_TASKSTATS = {'rchar':'read_char', 'wchar':'write_char',
+                'read_bytes':'read_bytes', 'write_bytes':'write_bytes'}
+
+
+def encode_block(timestamp, rows, previous, ncolumns, keyframe, level=1):
+    '''
+    Returns <type 'bytes'> of a block for "rows" (pid to a tuple of
+    "ncolumns" values, <type 'NoneType'> where missing), delta-encoded
+    against "previous" (the rows of the preceding block) unless "keyframe".
+    Values outside the signed 64 bit range are stored as missing.
+    '''
+    pids = array('i', sorted(rows))
+    columns = [array('q') for _ in range(ncolumns)]
+    for pid in pids:
+        values = rows[pid]
+        base = None if keyframe else previous.get(pid)
+        for i, column in enumerate(columns):
+            value = stored_value(values[i])
+            prior = MISSING if base is None else stored_value(base[i])
+            if prior == MISSING or value == MISSING:
+                column.append(value)
+            else:
+                column.append(value - prior)
+    payload = zlib.compress(pids.tobytes() +
+                            b''.join(column.tobytes() for column in columns),
+                            level)
+    return BLOCK_HEADER.pack(BLOCK_MAGIC, len(payload), timestamp, len(pids),
+                             int(keyframe)) + payload
+
+def stored_value(value):
+    '''
+    Returns <type 'int'> "value" as kept in a column: MISSING for
+    <type 'NoneType'> and for values a signed 64 bit column cannot hold.
+    '''
+    if value is None or not MISSING < value <= INT64_MAX:
+        return MISSING
+    return value
+
+def decode_block(buf, offset, previous, ncolumns):
+    '''
+    Returns <type 'dict'> of pid to the <type 'list'> of column values of
+    the block at "offset" in "buf", undoing the delta encoding against
+    "previous" (the decoded rows of the preceding block).
+    '''
+    _, length, _, nrows, keyframe = BLOCK_HEADER.unpack_from(buf, offset)
+    start = offset + BLOCK_HEADER.size
+    payload = zlib.decompress(buf[start:start + length])
+    pids = array('i')
+    pids.frombytes(payload[:nrows * pids.itemsize])
+    values = array('q')
+    values.frombytes(payload[nrows * pids.itemsize:])
+    rows = dict()
+    for row, pid in enumerate(pids):
+        base = None if keyframe else previous.get(pid)
+        decoded = list()
+        for i in range(ncolumns):
+            value = values[i * nrows + row]
+            prior = MISSING if base is None or base[i] is None else base[i]
+            if value == MISSING:
+                decoded.append(None)
+            elif prior == MISSING:
+                decoded.append(value)
+            else:
+                decoded.append(prior + value)
+        rows[pid] = decoded
+    return rows
+
+
+class Recorder(object):
+    '''
+    Recorder object: appends samples of "columns" for many pids to the file
+    at "path", one block per `record` (or `append`).
+
+    Columns are any <Snapshot> attribute (stat, io and statm fields) or
+    taskstats field; taskstats values for every pid of a sweep come from one
+    batched thread group query, so they cover the whole process like the
+    procfs columns (io fields, which thread group replies leave out, are
+    summed over the threads instead).  Every "keyframe_every"-th block is
+    stored without delta encoding so readers can start there.  Values
+    outside the signed 64 bit range (such as an unlimited "rsslim") are
+    recorded as missing.  Reopening an existing file appends to it, provided
+    its columns match, after cutting off a partially written trailing block.
+    '''
+    def __init__(self, path, columns=DEFAULT_COLUMNS, keyframe_every=60,
+                 level=1):
+        self.path = path
+        self.columns = tuple(columns)
+        self.keyframe_every = keyframe_every
+        self.level = level
+        self.previous = dict()
+        self.blocks = 0
+        self.taskstats_columns = [c for c in self.columns if
+                                  c not in Snapshot.__slots__]
+        self.io_columns = [c for c in self.taskstats_columns if
+                           c in TASKSTATS_IO_FIELDS]
+        self.tgid_columns = [c for c in self.taskstats_columns if
+                             c not in TASKSTATS_IO_FIELDS]
+        self.__taskstats = Taskstats(pool=taskstats_pool())
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            names = '\0'.join(self.columns).encode('ascii')
+            self.file.write(FILE_HEADER.pack(RECORD_MAGIC, RECORD_VERSION,
+                                             len(names)) + names)
+            self.file.flush()
+        else:
+            reader = RecordReader(path)
+            existing = reader.columns
+            end = reader.end
+            reader.close()
+            if existing != self.columns:
+                self.file.close()
+                raise ValueError("'%s' records columns %s" % (path, existing))
+            if self.file.tell() > end:
+                self.file.truncate(end)
+
+    def record(self, pids=None, timestamp=None):
+        '''
+        Class method: returns <type 'int'> of rows written after sampling
+        "pids" (every pid in "/proc" for <type 'NoneType'>) into a new
+        block; pids that exit during the sweep are left out.
+        '''
+        if pids is None:
+            pids = [int(entry) for entry in os.listdir('/proc')
+                    if entry.isdigit()]
+        timestamp = time.time() if timestamp is None else timestamp
+        snapshots = dict()
+        for pid in pids:
+            try:
+                snapshots[pid] = read_snapshot(pid, read_file)
+            except BadProcess:
+                continue
+        tasks = dict()
+        io = dict()
+        missing_io = [pid for pid, snapshot in snapshots.items()
+                      if snapshot.rchar is None]
+        try:
+            if self.tgid_columns:
+                tasks = self.__taskstats.get_tasks(
+                    snapshots, cmd_attr=TASKSTATS_CMD_ATTR_TGID)
+            wanted = snapshots if self.io_columns else missing_io
+            if wanted:
+                io = self.__taskstats.get_io(wanted)
+        except EnvironmentError:
+            pass
+        rows = dict()
+        for pid, snapshot in snapshots.items():
+            task = tasks.get(pid)
+            task_io = io.get(pid)
+            values = list()
+            for column in self.columns:
+                if column in Snapshot.__slots__:
+                    value = getattr(snapshot, column)
+                    if value is None and column in IO_TASKSTATS and task_io:
+                        value = task_io[IO_TASKSTATS[column]]
+                elif column in TASKSTATS_IO_FIELDS:
+                    value = task_io.get(column) if task_io else None
+                else:
+                    value = task.get(column) if task else None
+                values.append(value if isinstance(value, int) else None)
+            rows[pid] = tuple(values)
+        self.append(timestamp, rows)
+        return len(rows)
+
+    def append(self, timestamp, rows):
+        '''
+        Class method: returns <type 'NoneType'> :: writes a block of "rows"
+        (pid to a tuple of values in `columns` order) sampled at "timestamp".
+        '''
+        keyframe = self.blocks % self.keyframe_every == 0
+        self.file.write(encode_block(timestamp, rows, self.previous,
+                                     len(self.columns), keyframe, self.level))
+        self.file.flush()
+        self.previous = rows
+        self.blocks += 1
+
+    def run(self, interval, count=None, pids=None):
+        '''
+        Class method: returns <type 'NoneType'> :: records every "interval"
+        seconds, "count" times (forever for <type 'NoneType'>).
+        '''
+        run_periodic(lambda: self.record(pids), interval, count)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return "<class '%s (path: %s | blocks: %d)'>" % (
+            self.__class__.__name__, self.path, self.blocks)
+
+
+class RecordReader(object):
+    '''
+    RecordReader object: memory-maps a file written by <Recorder> and indexes
+    its blocks by timestamp.  Only the blocks from the keyframe preceding a
+    requested time range onwards are decompressed.  A partially written
+    trailing block is ignored until `refresh` finds it complete.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = None
+        self.offsets = list()
+        self.timestamps = list()
+        self.keyframes = list()
+        self.end = None
+        self.columns = None
+        self.refresh()
+
+    def refresh(self):
+        '''
+        Class method: returns <RecordReader> (self) after remapping the file
+        and indexing any blocks appended since the last refresh.
+        '''
+        size = os.fstat(self.file.fileno()).st_size
+        if size < FILE_HEADER.size:
+            raise InvalidPath(self.path)
+        if self.map is not None:
+            self.map.close()
+        self.map = mmap.mmap(self.file.fileno(), size, access=mmap.ACCESS_READ)
+        if self.columns is None:
+            magic, version, names_len = FILE_HEADER.unpack_from(self.map, 0)
+            if magic != RECORD_MAGIC or version != RECORD_VERSION:
+                raise ValueError("'%s' is not a shadow recording" % self.path)
+            start = FILE_HEADER.size
+            names = self.map[start:start + names_len].decode('ascii')
+            self.columns = tuple(names.split('\0'))
+            self.end = start + names_len
+        offset = self.end
+        while offset + BLOCK_HEADER.size <= size:
+            magic, length, timestamp, _, keyframe = \
+                BLOCK_HEADER.unpack_from(self.map, offset)
+            if magic != BLOCK_MAGIC:
+                raise StructParseError('RecordReader', None)
+            if offset + BLOCK_HEADER.size + length > size:
+                break
+            self.offsets.append(offset)
+            self.timestamps.append(timestamp)
+            if keyframe:
+                self.keyframes.append(len(self.offsets) - 1)
+            offset += BLOCK_HEADER.size + length
+        self.end = offset
+        return self
+
+    def blocks(self, start=None, end=None):
+        '''
+        Class method: returns a generator of (timestamp, <type 'dict'> of pid
+        to its values) for every block sampled between "start" and "end"
+        (epoch seconds, both inclusive; open ended for <type 'NoneType'>).
+        '''
+        first = 0 if start is None else bisect.bisect_left(self.timestamps,
+                                                           start)
+        last = len(self.timestamps) if end is None else \
+            bisect.bisect_right(self.timestamps, end)
+        if first >= last:
+            return
+        idx = bisect.bisect_right(self.keyframes, first) - 1
+        block = self.keyframes[idx] if idx >= 0 else 0
+        previous = dict()
+        ncolumns = len(self.columns)
+        for block in range(block, last):
+            previous = decode_block(self.map, self.offsets[block], previous,
+                                    ncolumns)
+            if block >= first:
+                yield self.timestamps[block], previous
+
+    def read(self, pids=None, start=None, end=None, columns=None):
+        '''
+        Class method: returns <type 'dict'> of pid to <type 'dict'> of
+        'timestamp' and each of "columns" (all for <type 'NoneType'>) to the
+        <type 'list'> of its values, for "pids" (all for <type 'NoneType'>)
+        between "start" and "end".
+        '''
+        columns = self.columns if columns is None else tuple(columns)
+        indices = [self.__column(column) for column in columns]
+        wanted = None if pids is None else set(pids)
+        series = dict()
+        for timestamp, rows in self.blocks(start, end):
+            for pid, values in rows.items():
+                if wanted is not None and pid not in wanted:
+                    continue
+                pid_series = series.get(pid)
+                if pid_series is None:
+                    pid_series = series[pid] = {'timestamp':list()}
+                    for column in columns:
+                        pid_series[column] = list()
+                pid_series['timestamp'].append(timestamp)
+                for column, i in zip(columns, indices):
+                    pid_series[column].append(values[i])
+        return series
+
+    def column(self, column, pid, start=None, end=None):
+        '''
+        Class method: returns <type 'list'> of (timestamp, value) pairs of
+        "column" for "pid" between "start" and "end".
+        '''
+        series = self.read([pid], start, end, [column]).get(pid)
+        if series is None:
+            return list()
+        return list(zip(series['timestamp'], series[column]))
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __column(self, column):
+        try:
+            return self.columns.index(column)
+        except ValueError:
+            raise KeyError("column '%s' is not recorded" % column)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __repr__(self):
+        return "<class '%s (path: %s | blocks: %d)'>" % (
+            self.__class__.__name__, self.path, len(self.offsets))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Periodic counter sampling for a <Profile>.  A <Sampler> keeps a fixed-size
+ring of timestamped samples from which deltas, per-second rates and moving
+averages are derived without any further reads.
+'''
+
+import time
+
+from collections import deque
+
+from .exception import *
+from .snapshot import Snapshot
+
+
+# Counters kept in "status" rather than as <Snapshot> attributes
+STATUS_COUNTERS = ('voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches')
+
+# Taskstats equivalents of the "io" counters, used when "io" is unreadable
+IO_TASKSTATS = {'rchar':'read_char', 'wchar':'write_char',
+                'syscr':'read_syscalls', 'syscw':'write_syscalls',
+                'read_bytes':'read_bytes', 'write_bytes':'write_bytes',
+                'cancelled_write_bytes':'cancelled_write_bytes'}
+
+DEFAULT_COUNTERS = ('read_bytes', 'write_bytes', 'syscr', 'syscw',
+                    'voluntary_ctxt_switches', 'nonvoluntary_ctxt_switches',
+                    'utime', 'stime', 'min_flt', 'maj_flt')
+
+
+def run_periodic(func, interval, count=None, callback=None):
+    '''
+    Returns <type 'NoneType'> :: calls "func" every "interval" seconds,
+    "count" times (forever for <type 'NoneType'>), passing each result to
+    "callback" if given.  Sleeps are scheduled against the start time so the
+    period does not drift.
+    '''
+    start = time.time()
+    taken = 0
+    while count is None or taken < count:
+        result = func()
+        taken += 1
+        if callback is not None:
+            callback(result)
+        if count is not None and taken >= count:
+            break
+        delay = start + taken * interval - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RingSampler(object):
+    '''
+    Base of the samplers that keep the last "size" results of `sample` in a
+    ring buffer ("samples"); subclasses only supply `sample`.
+    '''
+    def __init__(self, size=60):
+        self.size = size
+        self.samples = deque(maxlen=size)
+
+    def sample(self):
+        raise NotImplementedError
+
+    def run(self, interval, count=None, callback=None):
+        '''
+        Class method: returns <type 'NoneType'> :: samples every "interval"
+        seconds, "count" times (forever for <type 'NoneType'>), passing each
+        sample to "callback" if given (see `run_periodic`).
+        '''
+        run_periodic(self.sample, interval, count, callback)
+
+    def clear(self):
+        self.samples.clear()
+
+    def __len__(self):
+        return len(self.samples)
+
+
+class Sampler(RingSampler):
+    '''
+    Sampler object: samples "counters" of "profile" into a ring buffer of
+    the last "size" samples.
+
+    Counters are any <Snapshot> attribute (stat, io and statm fields), the
+    context switch counts of "status", or any taskstats field (e.g.
+    'cpu_delay_total', 'nvcsw').  Each sample costs one <Snapshot> read plus
+    at most one taskstats query, however many counters are tracked; values
+    that cannot be read are recorded as <type 'NoneType'>.
+    '''
+    def __init__(self, profile, counters=DEFAULT_COUNTERS, size=60):
+        super(Sampler, self).__init__(size)
+        self.profile = profile
+        self.counters = tuple(counters)
+        self.index = dict((counter, i) for i, counter in
+                          enumerate(self.counters))
+        self.taskstats_counters = [c for c in self.counters if not
+                                   (c in Snapshot.__slots__ or
+                                    c in STATUS_COUNTERS)]
+
+    def sample(self):
+        '''
+        Class method: returns <type 'tuple'> of the sample's timestamp and
+        counter values after appending it to the ring buffer.
+        '''
+        snapshot = self.profile.snapshot()
+        taskstats = None
+        if self.taskstats_counters or (snapshot.rchar is None and
+                                       set(IO_TASKSTATS) & set(self.counters)):
+            try:
+                taskstats = self.profile.taskstats()
+            except InsufficientRights:
+                pass
+        values = list()
+        for counter in self.counters:
+            if counter in STATUS_COUNTERS:
+                value = snapshot.status.get(counter)
+                value = int(value[0]) if value else None
+            elif counter in Snapshot.__slots__:
+                value = getattr(snapshot, counter)
+                if value is None and counter in IO_TASKSTATS and taskstats:
+                    value = taskstats[IO_TASKSTATS[counter]]
+            else:
+                value = taskstats[counter] if taskstats else None
+            values.append(value)
+        sample = (snapshot.timestamp, tuple(values))
+        self.samples.append(sample)
+        return sample
+
+    def series(self, counter):
+        '''
+        Class method: returns <type 'list'> of (timestamp, value) pairs of
+        "counter" for every sample in the ring buffer.
+        '''
+        i = self.__column(counter)
+        return [(timestamp, values[i]) for timestamp, values in self.samples]
+
+    def delta(self, counter, span=1):
+        '''
+        Class method: returns <type 'int'> change of "counter" over the last
+        "span" sampling intervals (<type 'NoneType'> without enough samples).
+        '''
+        pair = self.__span(counter, span)
+        if pair is None:
+            return
+        (_, first), (_, last) = pair
+        return last - first
+
+    def rate(self, counter, span=1):
+        '''
+        Class method: returns <type 'float'> per-second rate of "counter"
+        over the last "span" sampling intervals (<type 'NoneType'> without
+        enough samples).
+        '''
+        pair = self.__span(counter, span)
+        if pair is None:
+            return
+        (t_first, first), (t_last, last) = pair
+        if t_last <= t_first:
+            return
+        return (last - first) / float(t_last - t_first)
+
+    def rates(self, counter):
+        '''
+        Class method: returns <type 'list'> of (timestamp, per-second rate)
+        for each interval between consecutive samples.
+        '''
+        series = [(t, v) for t, v in self.series(counter) if v is not None]
+        return [(t1, (v1 - v0) / float(t1 - t0)) for (t0, v0), (t1, v1) in
+                zip(series, series[1:]) if t1 > t0]
+
+    def moving_average(self, counter, window=None):
+        '''
+        Class method: returns <type 'float'> mean of the per-interval rates
+        of "counter" over the last "window" intervals (all buffered intervals
+        for <type 'NoneType'>).
+        '''
+        rates = self.rates(counter)
+        if window is not None:
+            rates = rates[-window:]
+        if not rates:
+            return
+        return sum(rate for _, rate in rates) / float(len(rates))
+
+    def __span(self, counter, span):
+        '''
+        Private class method: (not meant to be called directly) returns the
+        (timestamp, value) pairs "span" intervals apart ending at the newest
+        sample, or <type 'NoneType'>.
+        '''
+        i = self.__column(counter)
+        if span < 1 or len(self.samples) <= span:
+            return
+        t_first, first = self.samples[-1 - span]
+        t_last, last = self.samples[-1]
+        if first[i] is None or last[i] is None:
+            return
+        return (t_first, first[i]), (t_last, last[i])
+
+    def __column(self, counter):
+        try:
+            return self.index[counter]
+        except KeyError:
+            raise KeyError("counter '%s' is not sampled" % counter)
+
+    def __repr__(self):
+        return "<class '%s (pid: %s | samples: %d/%d)'>" % (
+            self.__class__.__name__, self.profile.pid, len(self.samples),
+            self.size)
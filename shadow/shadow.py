@@ -2,60 +2,87 @@
 # -*- coding: utf-8 -*-
 
 import os
+import select
 import time
 
-from functools import partial
-from collections import namedtuple
 
-from libshadow import *
-from exception import *
-from taskstats.taskstats import Taskstats
-from priorities import nice, setnice, ioprio
+from .libshadow import *
+from .cgroup import cgroup_cache, pid_cgroup
+from .delays import DEFAULT_KINDS, DelayProfiler
+from .exception import *
+from .fds import fd_counts, fd_info, iter_fds, socket_inodes
+from .sampler import DEFAULT_COUNTERS, Sampler
+from .smaps import aggregate, iter_smaps, rollup
+from .snapshot import STAT_FIELDS, read_snapshot, read_start_time
+from .system import SC_CLK_TCK, uptime
+from .taskstats.sockdiag import SockDiag
+from .taskstats.taskstats import Taskstats, taskstats_pool
+from .memory import MemoryTracker
+from .procfs import ProcfsReader
+from .priorities import nice, setnice, ioprio, setioprio
 
 
 class Profile(object):
     '''
     Profile object: builds a <Profile> object from the "pid" provided on
     initialization.
+
+    Attribute lookups are answered from a <Snapshot> (see `snapshot`) that is
+    reused for up to "max_age" seconds; the default of 0 re-reads procfs on
+    every lookup.
+
+    The process is identified by its pid together with its start time (and
+    a pidfd where the kernel supports one), so a <Profile> whose process has
+    exited or whose pid was recycled is flagged `stale` rather than silently
+    reporting on the new process.
     '''
 
-    STAT_FIELDS = ['pid', 'tcomm', 'state', 'ppid', 'pgrp', 'sid', 'tty_nr', 
-                   'tty_pgrp', 'flags', 'min_flt', 'cmin_flt', 'maj_flt',
-                   'cmaj_flt', 'utime', 'stime', 'cutime', 'cstime',
-                   'priority', 'nice', 'num_threads', 'it_real_value', 
-                   'start_time', 'vsize', 'rss', 'rsslim', 'start_code', 
-                   'end_code', 'start_stack', 'esp', 'eip', 'pending', 
-                   'blocked', 'sigign', 'sigcatch', 'wchan', 'NONE', 'NONE', 
-                   'exit_signal', 'task_cpu', 'rt_priority', 'policy', 
-                   'blkio_ticks', 'gtime', 'cgtime', 'start_data', 'end_data', 
-                   'arg_start', 'arg_end', 'env_start', 'env_end', 'exit_code'
-                  ]
+    STAT_FIELDS = STAT_FIELDS
 
     PROC_STATES = {'R':'running', 'S':'interruptible_sleep', 
                    'D':'uninterruptible_disk_sleep', 'Z':'zombie', 
                    'T':'traced', 'W':'paging'
                   }
 
-    def __init__(self, pid):
+    def __init__(self, pid, max_age=0):
         self.pid = pid
-        self.__taskstats = Taskstats(self.pid)
-        self.__rst_state = self.rBytes()
-        self.__wst_state = self.wBytes()
+        self.max_age = max_age
+        self.__snapshot = None
+        self.__reader = ProcfsReader(self.pid)
+        self.__stale = False
+        self.__pidfd = self.__poller = None
+        self.__open_pidfd()
+        identity = read_start_time(self.pid)
+        if identity is None:
+            self.close()
+            raise BadProcess(self.pid)
+        self.__start_ticks = identity[0]
+        self.__taskstats = Taskstats(self.pid, pool=taskstats_pool())
+        self.__rst_state, self.__wst_state = self.rwBytes()
         self._last_r = self.__rst_state
         self._last_w = self.__wst_state
-        self.__st_switches = self.__pid_status_attrs.get(
-                                 'voluntary_ctxt_switches')
+        self.__st_switches = self.switches()
         if self.__st_switches is None:
             self.__st_switches = 0
-        
+
     @property
     def is_alive(self):
         '''
         Class property.getter: returns <type 'bool'> response of processes 
-        state.
+        state.  A zombie, or a new process reusing the pid, is not alive; the
+        check costs one poll of the pidfd (or one read of "stat").
         '''
-        all_processes = filter(lambda i: i.isdigit(), os.listdir('/proc'))
-        return self.pid in map(int, all_processes)
+        if self.__stale:
+            return False
+        if self.__poller is not None:
+            alive = not self.__poller.poll(0)
+        else:
+            identity = read_start_time(self.pid)
+            alive = (identity is not None and identity[1] != 'Z' and
+                     identity[0] == self.__start_ticks)
+        if not alive:
+            self.__stale = True
+        return alive
 
     @is_alive.setter
     def is_alive(self, state):
@@ -69,21 +96,50 @@ class Profile(object):
             raise BadProcess(self.pid)
         tkill(self.tgid, self.pid, SIGKILL)
         
+    @property
+    def stale(self):
+        '''
+        Class property: returns <type 'bool'> True once the profiled process
+        has been seen to exit or its pid to be reused.
+        '''
+        return self.__stale
+
+    def close(self):
+        '''
+        Class method: returns <type 'NoneType'> :: releases the pidfd held
+        for liveness checks and the descriptors of `file_reader`.
+        '''
+        self.__reader.close()
+        if self.__pidfd is not None:
+            os.close(self.__pidfd)
+            self.__pidfd = self.__poller = None
+
+    def __open_pidfd(self):
+        '''
+        Private class method: (not meant to be called directly) opens a pidfd
+        for the profiled pid, left unset on kernels (or pythons) without
+        `pidfd_open` and for pids that are not thread group leaders.
+        '''
+        try:
+            self.__pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            return
+        self.__poller = select.poll()
+        self.__poller.register(self.__pidfd, select.POLLIN)
+
     @property
     def ppid(self):
         '''
         Class property: returns <type 'int'> of the profiled pid's parent.
         '''
-        pid_stats = self.file_reader('/proc/%s/stat' % self.pid)
-        return int(pid_stats.split()[3])
+        return self.__recent_snapshot.ppid
 
     @property
     def name(self):
         '''
         Class property: returns <type 'str'> of profiled pid's name.
         '''
-        pid_name = self.file_reader('/proc/%s/comm' % self.pid)
-        return pid_name.strip('\n')
+        return self.__recent_snapshot.tcomm
 
     @property
     def fds(self):
@@ -103,7 +159,7 @@ class Profile(object):
         Class property: returns <type 'str'> or <type 'NoneType'> of profiled 
         pids group id.
         '''
-        gid = self.__pid_status_attrs.get('gid')
+        gid = self.__recent_snapshot.status.get('gid')
         if gid:
             return gid[0]
         return
@@ -113,7 +169,7 @@ class Profile(object):
         '''
         Class property: returns <type 'int'> of profiled pids thread group id.
         '''
-        tgid = self.__pid_status_attrs.get('tgid')
+        tgid = self.__recent_snapshot.status.get('tgid')
         if tgid:
             return int(tgid[0])
         return 
@@ -126,13 +182,53 @@ class Profile(object):
         threads = os.listdir(threads_path)
         return threads
 
+    def thread_stats(self):
+        '''
+        Class method: returns <type 'dict'> of every thread id of the profiled
+        pid to its <TaskstatsRecord> (cpu time, delay accounting, io bytes and
+        context switches), collected in one batched taskstats pass.
+        '''
+        try:
+            tids = list(map(int, self.get_tids()))
+        except OSError:
+            raise BadProcess(self.pid)
+        thread_stats = self.__taskstats.get_tasks(tids)
+        if tids and not thread_stats:
+            raise InsufficientRights('thread_stats', self.pid)
+        return thread_stats
+
+    def tgid_stats(self):
+        '''
+        Class method: returns <TaskstatsRecord> of the profiled pids whole
+        thread group, aggregated by the kernel from a single query.
+        '''
+        tgid_stats = self.__taskstats.get_tgid_stats(self.tgid or self.pid)
+        if tgid_stats is None:
+            raise InsufficientRights('tgid_stats', self.pid)
+        return tgid_stats
+
+    def hot_threads(self, field='cpu_run_real_total', count=1):
+        '''
+        Class method: returns <type 'list'> of the "count" (tid,
+        <TaskstatsRecord>) pairs with the highest "field", busiest first.
+
+        @type 'field': <type 'str'>
+        @param 'field': any taskstats field, e.g. 'cpu_delay_total' or
+                        'read_bytes'.
+        '''
+        thread_stats = self.thread_stats()
+        ranked = sorted(thread_stats.items(),
+                        key=lambda item: item[1].get(field) or 0,
+                        reverse=True)
+        return ranked[:count]
+
     @property
     def threads(self):
         '''
         Class property: returns <type 'int'> or <type 'NoneType'> of profiled 
         pids thread count.
         '''
-        threads = self.__pid_status_attrs.get('threads')
+        threads = self.__recent_snapshot.status.get('threads')
         if threads:
             return int(threads[0])
         return
@@ -143,7 +239,7 @@ class Profile(object):
         Class property: returns <type 'str'> or <type 'NoneType'> of profiled
         pids current state.
         '''
-        state = self.__pid_stat_attrs.get('state')
+        state = self.__recent_snapshot.state
         if state:
             return self.PROC_STATES[state]
         return 'Unknown'
@@ -153,7 +249,7 @@ class Profile(object):
         Class method: returns <type 'NoneType'>, this method creates additional
         auxillary instance attributes.
         '''
-        aux_attrs = self.__pid_status_attrs
+        aux_attrs = self.__recent_snapshot.status
         for attr in aux_attrs:
             if not aux_attrs[attr]: continue
             attr_value = ' '.join(aux_attrs[attr])
@@ -166,7 +262,7 @@ class Profile(object):
         auxillary attributes (if load_aux_attrs methods has already been)
         called.
         '''
-        aux_attrs = self.__pid_status_attrs
+        aux_attrs = self.__recent_snapshot.status
         for attr in aux_attrs:
             if hasattr(self, 'aux_' + attr):
                 aux_attr = 'self.aux_' + attr
@@ -196,13 +292,28 @@ class Profile(object):
         class and ioprio_nice. 
         '''
         return ioprio(self.pid)
+
+    def setioprio(self, io_class, level=0):
+        '''
+        Class method: sets the io priority of profiled pid, returns
+        <type 'NoneType'>.
+
+        @type 'io_class': <type 'str'>
+        @param 'io_class': 'realtime', 'best-effort' or 'idle'.
+
+        @type 'level': <type 'int'>
+        @param 'level': 0 (highest) to 7 within the class.
+        '''
+        setioprio(self.pid, io_class, level)
+        return
         
     def switches(self):
         '''
         Class method: returns <type 'int'> for the number of context switches
         of profiled pid.
         '''
-        switches = self.__pid_status_attrs.get('voluntary_ctxt_switches')
+        switches = self.__recent_snapshot.status.get(
+                       'voluntary_ctxt_switches')
         if switches:
             return int(switches[0])
         return
@@ -212,8 +323,7 @@ class Profile(object):
         Class method: returns <type 'bool'> to signal if there have voluntary
         context switches since initialization or last call of this method.
         '''
-        current_switches = self.__pid_status_attrs.get(
-                                'voluntary_ctxt_switches')
+        current_switches = self.switches()
         if current_switches > self.__st_switches:
             self.__st_switches = current_switches
             return True
@@ -241,13 +351,78 @@ class Profile(object):
             bytes_written = self.procfs_write()
         return bytes_written
 
+    def rwBytes(self):
+        '''
+        Class method: returns <type 'tuple'> of pids total read and write
+        bytes since startup from a single query.
+        '''
+        try:
+            bytes_rw = self.__taskstats.read_write()
+        except InsufficientRights:
+            bytes_rw = (self.procfs_read(), self.procfs_write())
+        return bytes_rw
+
+    def taskstats(self):
+        '''
+        Class method: returns <TaskstatsRecord> of every taskstats field of
+        the profiled pid from a single query.
+        '''
+        taskstats = self.__taskstats.get_stats()
+        if taskstats is None:
+            raise InsufficientRights('taskstats', self.pid)
+        return taskstats
+
+    def sampler(self, counters=DEFAULT_COUNTERS, size=60):
+        '''
+        Class method: returns <Sampler> of "counters" for the profiled pid
+        keeping the last "size" samples (see `sampler.Sampler`).
+        '''
+        return Sampler(self, counters, size)
+
+    def cgroup(self):
+        '''
+        Class method: returns <type 'str'> cgroup v2 path of the profiled pid.
+        '''
+        return pid_cgroup(self.pid)
+
+    def cgroup_stats(self, max_age=None):
+        '''
+        Class method: returns <CgroupStats> ("cpu.stat", "memory.current",
+        "memory.stat", "io.stat" and pressure) of the profiled pids cgroup,
+        shared with every other pid of the same cgroup for up to "max_age"
+        seconds (see `cgroup.CgroupCache`).
+        '''
+        return cgroup_cache().pid_stats(self.pid, max_age)
+
+    def memory_tracker(self, size=600, detail_every=60, per_mapping=False):
+        '''
+        Class method: returns <MemoryTracker> of the profiled pid keeping the
+        last "size" statm samples, with a per mapping class breakdown of
+        "smaps_rollup" (and, with "per_mapping", per path totals of "smaps")
+        every "detail_every" samples (see `memory.MemoryTracker`).
+        '''
+        return MemoryTracker(self, size, detail_every,
+                             per_mapping=per_mapping)
+
+    def delays(self, kinds=DEFAULT_KINDS, size=60, threads=False):
+        '''
+        Class method: returns <DelayProfiler> of the delay accounting
+        "kinds" of the profiled pid (and with "threads" of each of its
+        threads) keeping the last "size" samples (see `delays.DelayProfiler`).
+        '''
+        return DelayProfiler(self, kinds, size, threads)
+
     def procfs_read(self):
-        read = self.file_reader('/proc/%s/io' % self.pid)
-        return int(read.split()[1])
+        read = self.__recent_snapshot.rchar
+        if read is None:
+            raise InvalidPath('/proc/%s/io' % self.pid)
+        return read
  
     def procfs_write(self):
-        write = self.file_reader('/proc/%s/io' % self.pid)
-        return int(write.split()[3])
+        write = self.__recent_snapshot.wchar
+        if write is None:
+            raise InvalidPath('/proc/%s/io' % self.pid)
+        return write
  
     def has_read(self):
         '''
@@ -287,30 +462,27 @@ class Profile(object):
         current_w = self.wBytes()
         return current_w - self.__wst_state
 
-    def smap(self):        
-        '''
-        Class method: returns <type 'dict'> of namedtuples for the profiled
-        pids mapping memory consumption.
-        '''
-        smap_tuple = namedtuple('smap', ['Size', 'Rss', 'Pss', 'Shared_Clean', 
-                                         'Shared_Dirty', 'Private_Clean', 
-                                         'Private_Dirty', 'Referenced', 
-                                         'Anonymous', 'AnonHugePages', 'Swap', 
-                                         'KernelPageSize', 'MMUPageSize',
-                                         'Locked', 'VmFlags']
-                               )
-        proc_smap = self.file_reader('/proc/%s/smaps' % self.pid).split('\n')
-        proc_smaps = [proc_smap[i:i + 16] for i in 
-                      xrange(0, len(proc_smap), 16)]
-        smappings = dict()
-        rm_newline = lambda ln: ln.strip('\n')
-        for smap in proc_smaps:
-            if not smap[0]: continue
-            path_name = smap[0].split()[-1]
-            _smap = [''.join(i.split()[1:]) for i in smap[1:]]
-            _smap = map(rm_newline, _smap)
-            smappings[path_name] = smap_tuple(*_smap)
-        return smappings
+    def smap(self, by='path'):
+        '''
+        Class method: returns <type 'dict'> of the profiled pids mapping
+        memory consumption (in kB) summed per mapping path, or per mapping
+        class with "by"='class' (see `smaps.mapping_class`).
+        '''
+        return aggregate(self.smaps(), by)
+
+    def smaps(self):
+        '''
+        Class method: returns a generator of <Mapping> records streamed from
+        the profiled pids "smaps", one per mapping.
+        '''
+        return iter_smaps(self.pid)
+
+    def smap_rollup(self):
+        '''
+        Class method: returns <type 'dict'> of the profiled pids total memory
+        consumption (in kB) across all of its mappings.
+        '''
+        return rollup(self.pid)
 
     def pmap(self):
         '''
@@ -331,22 +503,62 @@ class Profile(object):
         Class method: returns <type 'dict'> for all file-descriptors as the keys
         and tuple for the files stats.
         '''
-        path = '/proc/%s/fd/' % self.pid
-        path_constructor = partial(lambda drt, fn: os.path.join(drt, fn), path)
-        try:
-            fds = map(path_constructor, os.listdir(path))
-            fdstat = dict(zip(map(os.readlink, fds), map(os.stat, fds)))
-        except IOError:
-            raise BadProcess(self.pid)
+        path = '/proc/%s/fd/%d'
+        fdstat = dict()
+        for entry in iter_fds(self.pid):
+            try:
+                fdstat[entry.target] = os.stat(path % (self.pid, entry.fd))
+            except OSError:
+                continue
         return fdstat
 
+    def fdlist(self):
+        '''
+        Class method: returns <type 'list'> of <FdEntry> (fd, type, link
+        target and socket/pipe inode) for every open file-descriptor, without
+        statting any of them.
+        '''
+        return sorted(iter_fds(self.pid))
+
+    def fdcounts(self):
+        '''
+        Class method: returns <type 'dict'> of file-descriptor type ('file',
+        'socket', 'pipe', 'eventfd', 'anon_inode', 'other') to the number
+        open of each.
+        '''
+        return fd_counts(self.pid)
+
+    def sockets(self, protocols=('tcp', 'udp', 'unix')):
+        '''
+        Class method: returns <type 'dict'> of file-descriptor to <SocketInfo>
+        (state, addresses, queue depths and TCP round trip time) for each of
+        the profiled pids sockets of "protocols".  Sockets outside the
+        callers network namespace are not reported.
+        '''
+        inodes = socket_inodes(self.pid)
+        if not inodes:
+            return dict()
+        sockdiag = SockDiag()
+        try:
+            sockets = sockdiag.sockets(protocols, inodes)
+        finally:
+            sockdiag.close()
+        return {inodes[inode]:info for inode, info in sockets.items()}
+
+    def fdinfo(self, fd):
+        '''
+        Class method: returns <type 'dict'> of the "fdinfo" fields (position,
+        open flags, mount id, inode and any type specific lines) of "fd".
+        '''
+        return fd_info(self.pid, fd)
+
     def fdperms(self):
         '''
         Class method: returns <type 'dict'> for all file-descriptors real path
         as keys and their file permissions as octal values.
         '''
         fdstats = self.fdstat()
-        permission_mask = lambda mask: oct(mask & 0777)
+        permission_mask = lambda mask: oct(mask & 0o777)
         modes = [fdstats[i].st_mode for i in fdstats]
         permissions = dict(zip(fdstats.keys(), map(permission_mask, modes)))
         return permissions
@@ -393,44 +605,41 @@ class Profile(object):
         Class method: returns <type 'float'> of seconds since boot that the 
         process started at.
         '''
-        sc_clk_tck = os.sysconf('SC_CLK_TCK')
-        uptime_data = self.file_reader('/proc/uptime')
-        stat_data = self.file_reader('/proc/%s/stat' % self.pid)
-        uptime = float(uptime_data.split()[0])
-        start_time = float(stat_data.split()[21])
-        return uptime - (start_time / sc_clk_tck)
+        start_time = float(self.__recent_snapshot.start_time)
+        return uptime() - (start_time / SC_CLK_TCK)
 
     def file_reader(self, fpath):
         '''
-        Class method: returns <type 'str'> for the file contents of fpath.
+        Class method: returns <type 'str'> for the file contents of fpath,
+        re-read through a descriptor kept open across calls (see
+        `procfs.ProcfsReader`).
         '''
-        try:
-            with open(fpath) as f:
-                raw_file_data = f.read()
-        except IOError:
-            raise InvalidPath(fpath)
-        return raw_file_data
+        return self.__reader.read(fpath)
 
-    @property
-    def __pid_status_attrs(self):
+    def snapshot(self):
         '''
-        Private class property: (not meant to be called directly) populates a
-        <type 'dict'> with pid attributes read from "status".
+        Class method: returns <Snapshot> of the profiled pid read from "stat",
+        "status", "io" and "statm" in a single pass.  The snapshot is kept and
+        reused by the class properties for up to `max_age` seconds.
         '''
-        raw_attrs = self.file_reader('/proc/%s/status' % self.pid)
-        pid_attrs = {i[0].strip(':').lower():i[1:] for i in 
-                     map(str.split, raw_attrs.split('\n')) if i}
-        return pid_attrs
+        snapshot = read_snapshot(self.pid, self.file_reader)
+        if snapshot.start_time != self.__start_ticks:
+            self.__stale = True
+            raise BadProcess(self.pid)
+        self.__snapshot = snapshot
+        return self.__snapshot
 
     @property
-    def __pid_stat_attrs(self):
+    def __recent_snapshot(self):
         '''
-        Private class property: (not meant to be called directly) populates a
-        <type 'dict'> with pid attributes read from "stat".
+        Private class property: (not meant to be called directly) returns the
+        last <Snapshot> taken if it is younger than `max_age` seconds,
+        otherwise a fresh one.
         '''
-        stats = self.file_reader('/proc/%s/stat' % self.pid)
-        pid_stats = dict(zip(self.STAT_FIELDS, stats.split()))
-        return pid_stats
+        snapshot = self.__snapshot
+        if snapshot is None or snapshot.age() >= self.max_age:
+            snapshot = self.snapshot()
+        return snapshot
 
     def tgkill(self, tid, sig):
         '''
@@ -444,6 +653,10 @@ class Profile(object):
             tkill(tgid, tid, sig)
         return
 
+    def __del__(self):
+        if getattr(self, '_Profile__reader', None) is not None:
+            self.close()
+
     def __str__(self):
         return self.__repr__()
 
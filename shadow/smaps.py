@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Streaming parser for "/proc/<pid>/smaps".  Mappings are read one at a time
+without assuming how many fields the kernel prints per mapping, and may be
+rolled up per path or per class instead of being held in memory.
+'''
+
+from collections import namedtuple
+
+from .exception import *
+
+
+Mapping = namedtuple('Mapping', ['start', 'end', 'perms', 'offset', 'dev',
+                                 'inode', 'path', 'fields', 'vmflags'])
+
+# Header lines open with a (lower case) hex address, field lines with a name
+HEX_DIGITS = frozenset('0123456789abcdef')
+
+SPECIAL_PATHS = frozenset(['[vdso]', '[vvar]', '[vvar_vclock]', '[vsyscall]',
+                           '[uprobes]'])
+
+ANON_PATH = '[anon]'
+
+# Per mapping properties rather than sizes, left out of any totals
+NON_ADDITIVE = frozenset(['KernelPageSize', 'MMUPageSize', 'THPeligible',
+                          'ProtectionKey'])
+
+
+def mapping_class(path):
+    '''
+    Returns <type 'str'> class of a mapping "path": 'file' for file-backed,
+    'special' for the kernel provided mappings and 'anon' for the rest
+    (heap, stacks and unnamed mappings).
+    '''
+    if path.startswith('/'):
+        return 'file'
+    if path in SPECIAL_PATHS:
+        return 'special'
+    return 'anon'
+
+def iter_smaps(pid, fpath=None):
+    '''
+    Returns a generator of <Mapping> records, one per mapping of "pid" in
+    address order.  "fields" holds every numeric field (sizes in kB) the
+    running kernel reports; "path" is ANON_PATH for unnamed mappings.
+    '''
+    fpath = fpath or '/proc/%s/smaps' % pid
+    try:
+        smaps = open(fpath)
+    except IOError:
+        raise InvalidPath(fpath)
+    with smaps:
+        header = None
+        fields = vmflags = None
+        for line in smaps:
+            if line[0] in HEX_DIGITS:
+                if header is not None:
+                    yield build_mapping(header, fields, vmflags)
+                header, fields, vmflags = line, dict(), list()
+                continue
+            name, _, value = line.partition(':')
+            if name == 'VmFlags':
+                vmflags = value.split()
+                continue
+            if value.endswith(' kB\n'):
+                value = value[:-4]
+            try:
+                fields[name] = int(value)
+            except (ValueError, TypeError):
+                pass
+        if header is not None:
+            yield build_mapping(header, fields, vmflags)
+
+def build_mapping(header, fields, vmflags):
+    '''
+    Returns <Mapping> from a mapping's "header" line and parsed fields.
+    '''
+    parts = header.split(None, 5)
+    start, _, end = parts[0].partition('-')
+    path = parts[5].strip() if len(parts) > 5 else ANON_PATH
+    return Mapping(int(start, 16), int(end, 16), parts[1], int(parts[2], 16),
+                   parts[3], int(parts[4]), path, fields, vmflags)
+
+def aggregate(mappings, by='path'):
+    '''
+    Returns <type 'dict'> of summed fields (in kB) keyed by mapping path
+    ("by"='path') or mapping class ("by"='class', see `mapping_class`).  Each
+    total also carries a 'Count' of the mappings it covers.
+    '''
+    if by == 'path':
+        key_of = lambda mapping: mapping.path
+    elif by == 'class':
+        key_of = lambda mapping: mapping_class(mapping.path)
+    else:
+        raise ValueError("aggregate by 'path' or 'class', not %r" % by)
+    totals = dict()
+    for mapping in mappings:
+        total = totals.setdefault(key_of(mapping), {'Count':0})
+        total['Count'] += 1
+        add_fields(total, mapping.fields)
+    return totals
+
+def add_fields(total, fields):
+    '''
+    Sums the additive "fields" of a mapping into "total".
+    '''
+    for name, value in fields.items():
+        if name not in NON_ADDITIVE:
+            total[name] = total.get(name, 0) + value
+
+def rollup(pid):
+    '''
+    Returns <type 'dict'> of the process-wide totals (in kB) from
+    "/proc/<pid>/smaps_rollup", summing "smaps" on kernels without it.
+    '''
+    try:
+        for mapping in iter_smaps(pid, '/proc/%s/smaps_rollup' % pid):
+            return mapping.fields
+        return dict()
+    except InvalidPath:
+        pass
+    totals = dict()
+    for mapping in iter_smaps(pid):
+        add_fields(totals, mapping.fields)
+    return totals
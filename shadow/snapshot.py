@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+Single-read process snapshots.  A <Snapshot> is built from one read each of
+"/proc/<pid>/stat", "status", "io" and "statm" so that any number of
+attributes can be answered from the same parse.
+'''
+
+import time
+
+from .exception import *
+
+
+STAT_FIELDS = ['pid', 'tcomm', 'state', 'ppid', 'pgrp', 'sid', 'tty_nr',
+               'tty_pgrp', 'flags', 'min_flt', 'cmin_flt', 'maj_flt',
+               'cmaj_flt', 'utime', 'stime', 'cutime', 'cstime',
+               'priority', 'nice', 'num_threads', 'it_real_value',
+               'start_time', 'vsize', 'rss', 'rsslim', 'start_code',
+               'end_code', 'start_stack', 'esp', 'eip', 'pending',
+               'blocked', 'sigign', 'sigcatch', 'wchan', 'NONE', 'NONE',
+               'exit_signal', 'task_cpu', 'rt_priority', 'policy',
+               'blkio_ticks', 'gtime', 'cgtime', 'start_data', 'end_data',
+               'arg_start', 'arg_end', 'env_start', 'env_end', 'exit_code'
+              ]
+
+IO_FIELDS = ['rchar', 'wchar', 'syscr', 'syscw', 'read_bytes', 'write_bytes',
+             'cancelled_write_bytes']
+
+# Position of "start_time" among the fields following the command name
+START_TIME_INDEX = STAT_FIELDS.index('start_time') - 2
+
+STATM_FIELDS = ['size', 'resident', 'shared', 'text', 'lib', 'data', 'dt']
+
+
+def read_file(fpath):
+    '''
+    Returns <type 'str'> for the file contents of fpath.
+    '''
+    try:
+        with open(fpath) as f:
+            raw_file_data = f.read()
+    except IOError:
+        raise InvalidPath(fpath)
+    return raw_file_data
+
+def read_start_time(pid):
+    '''
+    Returns <type 'tuple'> of the start time (in clock ticks after boot) and
+    state of "pid" from a single read of its "stat", or <type 'NoneType'>
+    when the process is gone.  The start time identifies the process across
+    pid reuse.
+    '''
+    try:
+        with open('/proc/%s/stat' % pid) as f:
+            raw_stat = f.read()
+    except (IOError, OSError):
+        return
+    tail = raw_stat.rpartition(')')[2].split()
+    return int(tail[START_TIME_INDEX]), tail[0]
+
+def parse_stat(raw_stat):
+    '''
+    Returns <type 'dict'> of the named "stat" fields.  The command name is
+    split off on its closing parenthesis since it may itself hold spaces.
+    '''
+    head, _, tail = raw_stat.rpartition(')')
+    pid, _, tcomm = head.partition(' (')
+    values = [pid, tcomm] + tail.split()
+    stats = dict()
+    for field, value in zip(STAT_FIELDS, values):
+        if field == 'NONE':
+            continue
+        if field in ('tcomm', 'state'):
+            stats[field] = value
+        else:
+            stats[field] = int(value)
+    return stats
+
+def parse_status(raw_status):
+    '''
+    Returns <type 'dict'> of "status" keys (lower-cased) mapped to the list of
+    their whitespace separated values.
+    '''
+    return {i[0].strip(':').lower():i[1:] for i in
+            map(str.split, raw_status.split('\n')) if i}
+
+def parse_io(raw_io):
+    '''
+    Returns <type 'dict'> of the "io" counters.
+    '''
+    counters = dict()
+    for line in raw_io.split('\n'):
+        if not line: continue
+        field, value = line.split(':')
+        counters[field] = int(value)
+    return counters
+
+def parse_statm(raw_statm):
+    '''
+    Returns <type 'dict'> of the "statm" page counts.
+    '''
+    return dict(zip(STATM_FIELDS, map(int, raw_statm.split())))
+
+
+class Snapshot(object):
+    '''
+    Immutable record of a process at one point in time.
+
+    Every named "stat" field is an attribute (`tcomm` and `state` are
+    <type 'str'>, the rest <type 'int'>), as are the "io" counters (<type 'int'>
+    or <type 'NoneType'> when "io" is not readable) and the "statm" page counts
+    (<type 'int'>).  `status` holds the parsed "status" file as returned by
+    `parse_status` and `timestamp` the <type 'float'> epoch time of the read.
+    '''
+
+    __slots__ = (['timestamp', 'status'] +
+                 [f for f in STAT_FIELDS if f != 'NONE'] +
+                 IO_FIELDS + STATM_FIELDS)
+
+    def __init__(self, timestamp, stat, status, io, statm):
+        setter = super(Snapshot, self).__setattr__
+        setter('timestamp', timestamp)
+        setter('status', status)
+        for fields, values in ((STAT_FIELDS, stat), (IO_FIELDS, io),
+                               (STATM_FIELDS, statm)):
+            for field in fields:
+                if field == 'NONE': continue
+                setter(field, values.get(field))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("<Snapshot> attribute '%s' is read-only" % name)
+
+    def __delattr__(self, name):
+        raise AttributeError("<Snapshot> attribute '%s' is read-only" % name)
+
+    def age(self):
+        '''
+        Returns <type 'float'> of seconds elapsed since the snapshot was read.
+        '''
+        return time.time() - self.timestamp
+
+    def __repr__(self):
+        return "<Snapshot (pid: %s | name: %s | %.3f)>" % (self.pid,
+                                                           self.tcomm,
+                                                           self.timestamp)
+
+
+def read_snapshot(pid, reader):
+    '''
+    Returns <Snapshot> for "pid" reading each procfs file once through the
+    callable "reader" (see `Profile.file_reader`).  An unreadable "io" (for
+    processes of other users) leaves the io counters as <type 'NoneType'>.
+    '''
+    timestamp = time.time()
+    try:
+        stat = parse_stat(reader('/proc/%s/stat' % pid))
+        status = parse_status(reader('/proc/%s/status' % pid))
+        statm = parse_statm(reader('/proc/%s/statm' % pid))
+    except InvalidPath:
+        raise BadProcess(pid)
+    try:
+        io = parse_io(reader('/proc/%s/io' % pid))
+    except InvalidPath:
+        io = dict()
+    return Snapshot(timestamp, stat, status, io, statm)
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+System-wide context for per-process samples.  A <SystemSampler> keeps the
+host's "/proc/stat", "loadavg", pressure, "meminfo" and "vmstat" files open
+and re-reads them with `pread`, so host-level cpu, memory and io pressure can
+be lined up with a <Sampler> over the same time window.
+'''
+
+import bisect
+import os
+import time
+
+from .exception import *
+from .cgroup import parse_flat_keyed, parse_nested_keyed
+from .procfs import ProcfsReader
+from .sampler import RingSampler
+
+
+CPU_FIELDS = ('user', 'nice', 'system', 'idle', 'iowait', 'irq', 'softirq',
+              'steal', 'guest', 'guest_nice')
+
+# Idle time of the cpu lines, the rest counts as busy
+IDLE_FIELDS = ('idle', 'iowait')
+
+# guest time is already included in user and nice
+GUEST_FIELDS = ('guest', 'guest_nice')
+
+PRESSURE_RESOURCES = ('cpu', 'io', 'memory')
+
+SC_CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+def parse_proc_stat(raw_stat):
+    '''
+    Returns <type 'dict'> of "/proc/stat": each 'cpu'/'cpuN' line as a
+    <type 'dict'> of CPU_FIELDS (in clock ticks), 'intr' and 'softirq' as
+    their totals and every other line ('ctxt', 'btime', 'processes',
+    'procs_running', 'procs_blocked') as <type 'int'>.
+    '''
+    stats = dict()
+    for line in raw_stat.split('\n'):
+        fields = line.split()
+        if not fields:
+            continue
+        if fields[0].startswith('cpu'):
+            stats[fields[0]] = dict(zip(CPU_FIELDS, map(int, fields[1:])))
+        else:
+            stats[fields[0]] = int(fields[1])
+    return stats
+
+def parse_loadavg(raw_loadavg):
+    '''
+    Returns <type 'dict'> of "/proc/loadavg": the 'load1', 'load5' and
+    'load15' averages, the 'running' and 'total' scheduling entities and the
+    'last_pid'.
+    '''
+    fields = raw_loadavg.split()
+    running, _, total = fields[3].partition('/')
+    return {'load1':float(fields[0]), 'load5':float(fields[1]),
+            'load15':float(fields[2]), 'running':int(running),
+            'total':int(total), 'last_pid':int(fields[4])}
+
+def parse_meminfo(raw_meminfo):
+    '''
+    Returns <type 'dict'> of "/proc/meminfo" (values in kB, counts for the
+    'HugePages_*' lines).
+    '''
+    meminfo = dict()
+    for line in raw_meminfo.split('\n'):
+        name, _, value = line.partition(':')
+        if name:
+            meminfo[name] = int(value.split()[0])
+    return meminfo
+
+
+SYSTEM_FILES = {'stat':('/proc/stat', parse_proc_stat),
+                'loadavg':('/proc/loadavg', parse_loadavg),
+                'meminfo':('/proc/meminfo', parse_meminfo),
+                'vmstat':('/proc/vmstat', parse_flat_keyed)}
+SYSTEM_FILES.update(('%s.pressure' % resource,
+                     ('/proc/pressure/%s' % resource, parse_nested_keyed))
+                    for resource in PRESSURE_RESOURCES)
+
+
+def uptime():
+    '''
+    Returns <type 'float'> seconds since boot (the clock "/proc/uptime"
+    reports), without reading any file where CLOCK_BOOTTIME is available.
+    '''
+    try:
+        return time.clock_gettime(time.CLOCK_BOOTTIME)
+    except AttributeError:
+        with open('/proc/uptime') as f:
+            return float(f.read().split()[0])
+
+def cpu_busy(first, last):
+    '''
+    Returns <type 'float'> fraction of time a "cpu" line of "/proc/stat" was
+    busy between two readings, or <type 'NoneType'> if no time passed.
+    '''
+    elapsed = busy = 0
+    for field in CPU_FIELDS:
+        if field in GUEST_FIELDS:
+            continue
+        delta = last.get(field, 0) - first.get(field, 0)
+        elapsed += delta
+        if field not in IDLE_FIELDS:
+            busy += delta
+    if elapsed <= 0:
+        return
+    return busy / float(elapsed)
+
+
+class SystemSnapshot(object):
+    '''
+    Immutable record of the host at "timestamp" (<type 'float'> epoch time,
+    comparable with <Snapshot> timestamps): the parsed files of SYSTEM_FILES
+    by name (`snapshot['meminfo']`), <type 'NoneType'> for files that could
+    not be read (e.g. pressure on kernels without PSI).
+    '''
+
+    __slots__ = ('timestamp', 'files')
+
+    def __init__(self, timestamp, files):
+        setter = super(SystemSnapshot, self).__setattr__
+        setter('timestamp', timestamp)
+        setter('files', files)
+
+    def __getitem__(self, name):
+        return self.files[name]
+
+    def get(self, name, default=None):
+        value = self.files.get(name)
+        return default if value is None else value
+
+    def __setattr__(self, name, value):
+        raise AttributeError("<SystemSnapshot> attribute '%s' is read-only" %
+                             name)
+
+    def __repr__(self):
+        return "<SystemSnapshot (timestamp: %.3f)>" % self.timestamp
+
+
+class SystemSampler(RingSampler):
+    '''
+    SystemSampler object: samples the host files of "files" (defaults to all
+    of SYSTEM_FILES) into a ring buffer of the last "size" <SystemSnapshot>.
+
+    Every file is opened once and re-read with `pread` through a
+    <ProcfsReader>, so a sample costs a few system calls per file.  Files
+    that cannot be opened (e.g. pressure on kernels without PSI) are left
+    out.  Call `close` (or use the sampler as a context manager) to release
+    the descriptors.
+    '''
+    def __init__(self, files=None, size=60):
+        super(SystemSampler, self).__init__(size)
+        names = SYSTEM_FILES if files is None else files
+        self.reader = ProcfsReader(max_open=max(1, len(names)))
+        self.names = list()
+        for name in names:
+            try:
+                self.reader.read(SYSTEM_FILES[name][0])
+            except InvalidPath:
+                continue
+            self.names.append(name)
+
+    def read(self, name):
+        '''
+        Class method: returns <type 'str'> current contents of the open file
+        "name".
+        '''
+        return self.reader.read(SYSTEM_FILES[name][0])
+
+    def sample(self):
+        '''
+        Class method: returns <SystemSnapshot> of every open file after
+        appending it to the ring buffer.
+        '''
+        timestamp = time.time()
+        files = dict.fromkeys(SYSTEM_FILES)
+        for name in self.names:
+            try:
+                files[name] = SYSTEM_FILES[name][1](self.read(name))
+            except (InvalidPath, ValueError):
+                files[name] = None
+        snapshot = SystemSnapshot(timestamp, files)
+        self.samples.append(snapshot)
+        return snapshot
+
+    def nearest(self, timestamp):
+        '''
+        Class method: returns the buffered <SystemSnapshot> closest in time to
+        "timestamp", or <type 'NoneType'> with an empty buffer.
+        '''
+        if not self.samples:
+            return
+        timestamps = [snapshot.timestamp for snapshot in self.samples]
+        idx = bisect.bisect_left(timestamps, timestamp)
+        candidates = [i for i in (idx - 1, idx) if 0 <= i < len(timestamps)]
+        best = min(candidates, key=lambda i: abs(timestamps[i] - timestamp))
+        return self.samples[best]
+
+    def align(self, samples):
+        '''
+        Class method: returns <type 'list'> of (sample, <SystemSnapshot>)
+        pairing each (timestamp, values) sample of a <Sampler> (or anything
+        with a `timestamp`) with the nearest system snapshot.
+        '''
+        aligned = list()
+        for sample in samples:
+            timestamp = getattr(sample, 'timestamp', None)
+            if timestamp is None:
+                timestamp = sample[0]
+            aligned.append((sample, self.nearest(timestamp)))
+        return aligned
+
+    def cpu_busy(self, cpu='cpu', span=1):
+        '''
+        Class method: returns <type 'float'> busy fraction of "cpu" ('cpu' for
+        all of them, 'cpuN' for one) over the last "span" sampling intervals.
+        '''
+        pair = self.__span(span)
+        if pair is None:
+            return
+        first, last = pair
+        if not first.get('stat') or not last.get('stat'):
+            return
+        if cpu not in first['stat'] or cpu not in last['stat']:
+            return
+        return cpu_busy(first['stat'][cpu], last['stat'][cpu])
+
+    def stall(self, resource='cpu', kind='some', span=1):
+        '''
+        Class method: returns <type 'float'> fraction of wall time tasks were
+        stalled on "resource" ('cpu', 'io' or 'memory'; "kind" 'some' or
+        'full') over the last "span" sampling intervals, from the pressure
+        totals rather than the kernel's averages.
+        '''
+        pair = self.__span(span)
+        if pair is None:
+            return
+        first, last = pair
+        name = '%s.pressure' % resource
+        try:
+            stalled = (last[name][kind]['total'] -
+                       first[name][kind]['total'])
+        except (KeyError, TypeError):
+            return
+        elapsed = last.timestamp - first.timestamp
+        if elapsed <= 0:
+            return
+        return stalled / (elapsed * 1e6)
+
+    def rate(self, counter, span=1):
+        '''
+        Class method: returns <type 'float'> per-second rate of a "vmstat"
+        counter (e.g. 'pgmajfault', 'pswpin') or a "/proc/stat" counter
+        ('ctxt', 'processes') over the last "span" sampling intervals.
+        '''
+        pair = self.__span(span)
+        if pair is None:
+            return
+        first, last = pair
+        for name in ('vmstat', 'stat'):
+            if first.get(name) and counter in first[name] and \
+                    last.get(name) and counter in last[name]:
+                elapsed = last.timestamp - first.timestamp
+                if elapsed <= 0:
+                    return
+                return (last[name][counter] - first[name][counter]) / elapsed
+        raise KeyError("counter '%s' is not sampled" % counter)
+
+    def close(self):
+        self.reader.close()
+        self.names = list()
+
+    def __span(self, span):
+        '''
+        Private class method: (not meant to be called directly) returns the
+        pair of snapshots "span" intervals apart ending at the newest, or
+        <type 'NoneType'> without enough samples.
+        '''
+        if span < 1 or len(self.samples) <= span:
+            return
+        return self.samples[-1 - span], self.samples[-1]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return "<class '%s (files: %d | samples: %d/%d)'>" % (
+            self.__class__.__name__, len(self.names), len(self.samples),
+            self.size)
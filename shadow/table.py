@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+System-wide collection: a <ProcessTable> profiles every pid in "/proc" in a
+single sweep and keeps the results as columns.
+'''
+
+import os
+
+from .cgroup import cgroup_cache
+from .exception import *
+from .snapshot import (STAT_FIELDS, IO_FIELDS, read_file, parse_stat,
+                       parse_io)
+from .taskstats.taskstats import Taskstats, taskstats_pool
+
+
+class ProcessTable(object):
+    '''
+    ProcessTable object: walks "/proc" once per `refresh` and stores the
+    "stat" fields, "io" counters and open file-descriptor count of every
+    matching pid column-wise, i.e. `table['rss'][i]` belongs to
+    `table.pids[i]`.
+
+    The optional "names", "uids", "ppids" and "cgroups" filters are checked
+    (cheapest first) before any of the heavier per-pid reads.  "cgroups" are
+    matched as path prefixes against the entries of "/proc/<pid>/cgroup".
+
+    Processes whose "io" is not readable have their io counters filled in
+    from one batched query over a pooled taskstats connection when
+    "taskstats" is set.  With "fds" unset the fd directories are not listed
+    and the 'fds' column is left as <type 'NoneType'>.
+    '''
+
+    STAT_COLUMNS = [f for f in STAT_FIELDS if f != 'NONE']
+    COLUMNS = STAT_COLUMNS + IO_FIELDS + ['fds']
+
+    def __init__(self, names=None, uids=None, ppids=None, cgroups=None,
+                 taskstats=True, fds=True):
+        self.names = set(names) if names is not None else None
+        self.uids = set(uids) if uids is not None else None
+        self.ppids = set(ppids) if ppids is not None else None
+        self.cgroups = tuple(cgroups) if cgroups is not None else None
+        self.taskstats = taskstats
+        self.fds = fds
+        self.__taskstats = Taskstats(pool=taskstats_pool())
+        self.pids = list()
+        self.index = dict()
+        self.columns = {column:list() for column in self.COLUMNS}
+
+    def refresh(self):
+        '''
+        Class method: returns <ProcessTable> (self) after replacing the
+        columns with one fresh sweep over "/proc".
+        '''
+        rows = list()
+        for entry in os.listdir('/proc'):
+            if not entry.isdigit():
+                continue
+            row = self.__collect(int(entry))
+            if row is not None:
+                rows.append(row)
+        self.__taskstats_io(rows)
+        self.pids = [row['pid'] for row in rows]
+        self.index = {pid:i for i, pid in enumerate(self.pids)}
+        self.columns = {column:[row.get(column) for row in rows]
+                        for column in self.COLUMNS}
+        return self
+
+    def row(self, pid):
+        '''
+        Class method: returns <type 'dict'> of every column for "pid" as of
+        the last `refresh`.
+        '''
+        try:
+            idx = self.index[pid]
+        except KeyError:
+            raise BadProcess(pid)
+        return {column:self.columns[column][idx] for column in self.COLUMNS}
+
+    def cgroup_stats(self, max_age=None):
+        '''
+        Class method: returns <type 'dict'> of cgroup path to a (<CgroupStats>,
+        member pids) pair for the pids of the last `refresh`, with each
+        cgroup's files read once however many of its pids are in the table.
+        '''
+        return cgroup_cache().collect(self.pids, max_age)
+
+    def __collect(self, pid):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'dict'> of the columns for "pid" or <type 'NoneType'> when the
+        pid is filtered out or has exited.
+        '''
+        proc_path = '/proc/%d' % pid
+        try:
+            if self.uids is not None:
+                if os.stat(proc_path).st_uid not in self.uids:
+                    return
+            if self.names is not None:
+                name = read_file(proc_path + '/comm').strip('\n')
+                if name not in self.names:
+                    return
+            if self.cgroups is not None:
+                if not self.__in_cgroups(read_file(proc_path + '/cgroup')):
+                    return
+            row = parse_stat(read_file(proc_path + '/stat'))
+        except (OSError, InvalidPath):
+            return
+        if self.ppids is not None and row['ppid'] not in self.ppids:
+            return
+        try:
+            row.update(parse_io(read_file(proc_path + '/io')))
+        except InvalidPath:
+            pass
+        row['fds'] = None
+        if self.fds:
+            try:
+                row['fds'] = len(os.listdir(proc_path + '/fd'))
+            except OSError:
+                pass
+        return row
+
+    def __in_cgroups(self, raw_cgroup):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'bool'> if any hierarchy of "raw_cgroup" is under a filter path.
+        '''
+        for line in raw_cgroup.split('\n'):
+            path = line.split(':', 2)[-1]
+            if path and path.startswith(self.cgroups):
+                return True
+        return False
+
+    def __taskstats_io(self, rows):
+        '''
+        Private class method: (not meant to be called directly) fills in the
+        io counters of "rows" whose "io" was unreadable, summed over their
+        threads from one batched query over the pooled taskstats connection.
+        '''
+        missing = {row['pid']:row for row in rows if 'rchar' not in row}
+        if not missing or not self.taskstats:
+            return
+        try:
+            tasks = self.__taskstats.get_io(missing)
+        except EnvironmentError:
+            self.taskstats = False
+            return
+        for pid, task in tasks.items():
+            missing[pid].update({'rchar':task['read_char'],
+                                 'wchar':task['write_char'],
+                                 'syscr':task['read_syscalls'],
+                                 'syscw':task['write_syscalls'],
+                                 'read_bytes':task['read_bytes'],
+                                 'write_bytes':task['write_bytes'],
+                                 'cancelled_write_bytes':
+                                     task['cancelled_write_bytes']})
+
+    def __getitem__(self, column):
+        return self.columns[column]
+
+    def __len__(self):
+        return len(self.pids)
+
+    def __iter__(self):
+        return iter(self.pids)
+
+    def __repr__(self):
+        return "<class '%s (pids: %d)'>" % (self.__class__.__name__,
+                                            len(self.pids))
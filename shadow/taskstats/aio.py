@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+This module runs a taskstats netlink connection on an asyncio event loop.
+Requests from any number of coroutines share one non-blocking socket and
+their replies are routed back by netlink sequence number.
+'''
+
+import asyncio
+import errno
+import socket
+import weakref
+
+from .taskstats import *
+
+
+class AsyncTaskstats(object):
+    '''
+    The AsyncTaskstats class is the asyncio counterpart of <Taskstats>: every
+    query is a coroutine and the socket is read by an event loop reader
+    callback instead of a blocking `recv`.
+
+    At most "window" requests (by default as many replies as the receive
+    buffer holds) are outstanding at once; should the receive buffer still
+    overrun, the requests whose replies were dropped are sent again.
+    '''
+    def __init__(self, rcvbuf=TASKSTATS_RCVBUF, window=None):
+        self.genlctrl = Controller(TASKSTATS_GENL_NAME, rcvbuf)
+        self.genlctrl.conn.setblocking(False)
+        self.window = window or max(1, self.genlctrl.rcvbuf //
+                                       TASKSTATS_REPLY_SIZE)
+        self.pending = dict()
+        self.loop = None
+        self.slots = None
+
+    async def get_stats(self, pid):
+        '''
+        Coroutine: returns <TaskstatsRecord> of the whole decoded taskstats
+        struct for "pid", or <type 'NoneType'> if the kernel sent no stats.
+        '''
+        loop = self.__attach()
+        async with self.slots:
+            future = loop.create_future()
+            self.__send(pid, future)
+            return await future
+
+    async def get_tasks(self, pids):
+        '''
+        Coroutine: returns <type 'dict'> of pid to <TaskstatsRecord> for every
+        pid in "pids" that could be queried, all requested concurrently.
+        '''
+        pids = list(pids)
+        results = await asyncio.gather(*[self.get_stats(pid) for pid in pids],
+                                       return_exceptions=True)
+        return dict((pid, record) for pid, record in zip(pids, results)
+                    if isinstance(record, TaskstatsRecord))
+
+    async def get_task(self, task, pid):
+        taskstats = await self.get_stats(pid)
+        if taskstats is None:
+            return -1
+        return taskstats.get(task)
+
+    async def read_write(self, pid):
+        '''
+        Coroutine: returns <type 'tuple'> of read and write bytes of "pid".
+        '''
+        taskstats = await self.get_stats(pid)
+        if taskstats is None:
+            raise InsufficientRights('read_write', pid)
+        return taskstats.read_bytes, taskstats.write_bytes
+
+    def close(self):
+        loop = self.loop() if self.loop is not None else None
+        if loop is not None and not loop.is_closed():
+            loop.remove_reader(self.genlctrl.conn.fileno())
+        for future, pid in self.pending.values():
+            if not future.done():
+                future.cancel()
+        self.pending.clear()
+        self.genlctrl.close()
+
+    def __attach(self):
+        '''
+        Private class method: (not meant to be called directly) returns the
+        running loop, installing the socket reader on it the first time.  The
+        loop is only weakly referenced so a shared instance does not keep it
+        alive.
+        '''
+        loop = asyncio.get_event_loop()
+        if self.loop is not None and self.loop() is loop:
+            return loop
+        if self.loop is not None:
+            raise RuntimeError('<AsyncTaskstats> is bound to another loop')
+        self.loop = weakref.ref(loop)
+        self.slots = asyncio.Semaphore(self.window)
+        loop.add_reader(self.genlctrl.conn.fileno(), self.__on_readable)
+        return loop
+
+    def __send(self, pid, future):
+        seq = self.genlctrl.next_seq()
+        self.pending[seq] = (future, pid)
+        try:
+            self.genlctrl.send(request_msg(self.genlctrl.fam_id, pid, seq))
+        except socket.error as err:
+            del self.pending[seq]
+            future.set_exception(err)
+
+    def __on_readable(self):
+        '''
+        Private class method: (not meant to be called directly) event loop
+        callback resolving the futures of every reply queued on the socket.
+        '''
+        overrun = False
+        while True:
+            try:
+                task_response = self.genlctrl.recv_view(socket.MSG_DONTWAIT)
+            except socket.error as err:
+                if err.errno == errno.ENOBUFS:
+                    overrun = True
+                    continue
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            self.__resolve(task_response)
+        if overrun:
+            dropped, self.pending = self.pending, dict()
+            for future, pid in dropped.values():
+                if not future.done():
+                    self.__send(pid, future)
+
+    def __resolve(self, task_response):
+        nl_seq, taskstats_raw, err = parse_reply(task_response)
+        future, pid = self.pending.pop(nl_seq, (None, None))
+        if future is None or future.done():
+            return
+        if err in (-errno.EPERM, -errno.EACCES):
+            future.set_exception(InsufficientRights('query', pid))
+        elif err:
+            future.set_exception(NetlinkError(err, pid))
+        elif not taskstats_raw:
+            future.set_result(None)
+        else:
+            layout = taskstats_layout(taskstats_raw)
+            future.set_result(layout.decode(taskstats_raw))
+
+
+_loop_taskstats = weakref.WeakKeyDictionary()
+
+
+def loop_taskstats():
+    '''
+    Returns the <AsyncTaskstats> shared by every coroutine of the running
+    event loop.
+    '''
+    loop = asyncio.get_event_loop()
+    taskstats = _loop_taskstats.get(loop)
+    if taskstats is None:
+        taskstats = _loop_taskstats[loop] = AsyncTaskstats()
+    return taskstats
@@ -1,10 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import errno
+import os
 import socket
 import struct
+import threading
+
+from contextlib import contextmanager
         
-from netlink import *
+from .netlink import *
 
 
 NETLINK_ROUTE          = 0
@@ -30,23 +35,95 @@ NETLINK_RDMA           = 20
 NETLINK_CRYPTO         = 21
 NETLINK_INET_DIAG = NETLINK_SOCK_DIAG
 
+# Not exported by the socket module
+SO_RCVBUFFORCE = 33
+
 
 class Connection(object):
     '''
     Base class that establishes a netlink connection with the kernel.
+
+    "rcvbuf" sets the socket receive buffer; privileged callers get the full
+    size through SO_RCVBUFFORCE, everyone else is capped at net.core.rmem_max.
     '''
-    def __init__(self, family):
+    def __init__(self, family, rcvbuf=65536):
         self.family = family
+        self.seq = 0
+        self.buffer = bytearray(65536)
+        self.view = memoryview(self.buffer)
         self.conn = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, family)
         self.conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, 65536)
-        self.conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 65536)
+        try:
+            self.conn.setsockopt(socket.SOL_SOCKET, SO_RCVBUFFORCE, rcvbuf)
+        except socket.error:
+            self.conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
         self.conn.bind((0, 0))
 
+    @property
+    def rcvbuf(self):
+        return self.conn.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+
     def send(self, msg):
         self.conn.send(msg)
 
-    def recv(self):
-        return self.conn.recv(65536)
+    def recv(self, flags=0):
+        return self.conn.recv(65536, flags)
+
+    def recv_into(self, buf, flags=0):
+        return self.conn.recv_into(buf, 0, flags)
+
+    def recv_view(self, flags=0):
+        '''
+        Returns <type 'memoryview'> of the next datagram, received into the
+        connection's reusable buffer (valid until the next receive).
+        '''
+        return self.view[:self.recv_into(self.view, flags)]
+
+    def messages(self, seq, flags=0):
+        '''
+        Returns a generator of <NetlinkMsg> replies to the request sent with
+        sequence number "seq": every part of a multipart (NLM_F_MULTI) dump
+        up to its NLMSG_DONE, or the single reply otherwise.  Messages of
+        other sequence numbers are skipped and error replies raise
+        <NetlinkError>; each message is only valid until the next one.
+        '''
+        while True:
+            view = self.recv_view(flags)
+            for msg in iter_msgs(view):
+                if msg.seq != seq:
+                    continue
+                if msg.type == NLMSG_ERROR or msg.type == NLMSG_DONE:
+                    err = msg_error(msg)
+                    if err:
+                        raise NetlinkError(err, None)
+                    return
+                if msg.type == NLMSG_NOOP:
+                    continue
+                yield msg
+                if not msg.flags & NLM_F_MULTI:
+                    return
+
+    def next_seq(self):
+        self.seq = (self.seq + 1) & 0xffffffff
+        return self.seq
+
+    def close(self):
+        self.conn.close()
+
+    def recv_pending(self):
+        '''
+        Returns <type 'list'> of the datagrams already queued on the socket
+        without blocking.
+        '''
+        pending = list()
+        while True:
+            try:
+                pending.append(self.recv(socket.MSG_DONTWAIT))
+            except socket.error as err:
+                if err.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    return pending
+                if err.errno != errno.ENOBUFS:
+                    raise
 
 
 # Genetlink Controller command and attribute values
@@ -102,18 +179,43 @@ class Genlmsg(object):
         return genlhdr + self.payload
 
 
+# Family ids resolved per (network namespace, family name)
+_family_ids = dict()
+_family_ids_lock = threading.Lock()
+
+
+def netns_id():
+    '''
+    Returns <type 'tuple'> identifying the network namespace of the calling
+    thread, or <type 'NoneType'> where namespaces are not exposed.
+    '''
+    for ns_path in ('/proc/thread-self/ns/net', '/proc/self/ns/net'):
+        try:
+            ns_stat = os.stat(ns_path)
+        except OSError:
+            continue
+        return (ns_stat.st_dev, ns_stat.st_ino)
+    return
+
+
 class Controller(Connection):        
     '''
     Controller class that establishes a generic netlink connection with
-    family of the supplied 'genl_name'.
+    family of the supplied 'genl_name'.  The family id is resolved once per
+    network namespace and cached for every later Controller.
     '''
-    def __init__(self, genl_name):
-        super(Controller, self).__init__(NETLINK_GENERIC)
+    def __init__(self, genl_name, rcvbuf=65536):
+        super(Controller, self).__init__(NETLINK_GENERIC, rcvbuf)
         self.genl_name = genl_name
         self.genlhdr = Genlmsg(CTRL_CMD_GETFAMILY, Nlattr(CTRL_ATTR_FAMILY_NAME, 
                                                                 self.genl_name))
         self.attrs = dict()
-        self.fam_id = self.get_family_id
+        family_key = (netns_id(), genl_name)
+        self.fam_id = _family_ids.get(family_key)
+        if self.fam_id is None:
+            self.fam_id = self.get_family_id
+            with _family_ids_lock:
+                _family_ids[family_key] = self.fam_id
 
     @property
     def get_family_id(self):
@@ -121,4 +223,79 @@ class Controller(Connection):
         self.send(nlmsg)
         family_id_reply = self.recv()
         parse_response(self, family_id_reply)
-        return struct.unpack('I', self.attrs[CTRL_ATTR_FAMILY_ID])[0]
+        return struct.unpack_from('H', self.attrs[CTRL_ATTR_FAMILY_ID])[0]
+
+
+class ConnectionPool(object):
+    '''
+    Thread-safe pool of <Controller> connections to the 'genl_name' family.
+
+    A connection is borrowed for one request/reply exchange with `connection`
+    (or `acquire`/`release`) so any number of consumers share a handful of
+    sockets.  At most "size" connections are opened (unbounded for
+    <type 'NoneType'>); borrowers wait for one to be returned.  Connections
+    inherited across a fork are discarded rather than shared with the parent.
+    '''
+    def __init__(self, genl_name, size=None, rcvbuf=65536):
+        self.genl_name = genl_name
+        self.size = size
+        self.rcvbuf = rcvbuf
+        self.idle = list()
+        self.opened = 0
+        self.owner = os.getpid()
+        self.available = threading.Condition(threading.Lock())
+
+    def acquire(self):
+        with self.available:
+            if self.owner != os.getpid():
+                self.idle, self.opened = list(), 0
+                self.owner = os.getpid()
+            while not self.idle and self.size is not None and \
+                    self.opened >= self.size:
+                self.available.wait()
+            if self.idle:
+                return self.idle.pop()
+            self.opened += 1
+        try:
+            return Controller(self.genl_name, self.rcvbuf)
+        except Exception:
+            with self.available:
+                self.opened -= 1
+                self.available.notify()
+            raise
+
+    def release(self, genlctrl):
+        with self.available:
+            if self.owner == os.getpid():
+                self.idle.append(genlctrl)
+                self.available.notify()
+
+    @contextmanager
+    def connection(self):
+        genlctrl = self.acquire()
+        try:
+            yield genlctrl
+        finally:
+            self.release(genlctrl)
+
+    def close(self):
+        with self.available:
+            idle, self.idle = self.idle, list()
+            self.opened -= len(idle)
+        for genlctrl in idle:
+            genlctrl.close()
+
+
+_pools = dict()
+_pools_lock = threading.Lock()
+
+
+def connection_pool(genl_name, rcvbuf=65536):
+    '''
+    Returns the process-wide <ConnectionPool> for 'genl_name'.
+    '''
+    with _pools_lock:
+        pool = _pools.get(genl_name)
+        if pool is None:
+            pool = _pools[genl_name] = ConnectionPool(genl_name, rcvbuf=rcvbuf)
+        return pool
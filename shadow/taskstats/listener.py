@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+This module registers a netlink connection for taskstats exit records, so
+the final accounting of every task leaving a set of cpus is delivered as it
+happens rather than polled for.
+'''
+
+import errno
+import socket
+import struct
+
+from collections import namedtuple
+
+from .netlink import *
+from .controller import Genlmsg
+from .taskstats import *
+
+
+TaskExit = namedtuple('TaskExit', ['kind', 'pid', 'stats'])
+
+
+class TaskstatsListener(object):
+    '''
+    The TaskstatsListener class registers for the exit records of tasks on
+    the cpus of "cpumask" (a cpulist string such as "0-3,6", defaults to every
+    online cpu) and yields a <TaskExit> per record: "kind" is 'pid' for a
+    task's own totals and 'tgid' for a whole thread group once its last task
+    exits.
+
+    Records the kernel could not queue because the receive buffer was full
+    are counted in `dropped`.  A registration the kernel refuses raises
+    <InsufficientRights> (no CAP_NET_ADMIN) or <NetlinkError> (e.g. an
+    invalid cpumask).
+    '''
+    def __init__(self, cpumask=None, rcvbuf=TASKSTATS_RCVBUF):
+        self.cpumask = cpumask or online_cpus()
+        self.taskstats = Taskstats(rcvbuf=rcvbuf)
+        self.genlctrl = self.taskstats.genlctrl
+        self.dropped = 0
+        self.registered = False
+        self.pending = list()
+
+    def register(self):
+        self.__cpumask_cmd(TASKSTATS_CMD_ATTR_REGISTER_CPUMASK)
+        self.registered = True
+
+    def deregister(self):
+        if self.registered:
+            self.__cpumask_cmd(TASKSTATS_CMD_ATTR_DEREGISTER_CPUMASK)
+            self.registered = False
+
+    def close(self):
+        self.deregister()
+        self.genlctrl.close()
+
+    def records(self, timeout=None):
+        '''
+        Class method: generator of <TaskExit> records, registering first if
+        needed.  Stops once "timeout" seconds pass without a record, or runs
+        until closed when "timeout" is <type 'NoneType'>.
+        '''
+        if not self.registered:
+            self.register()
+        while self.pending:
+            yield self.pending.pop(0)
+        self.genlctrl.conn.settimeout(timeout)
+        while True:
+            try:
+                reply = self.genlctrl.recv()
+            except socket.timeout:
+                return
+            except socket.error as err:
+                if err.errno != errno.ENOBUFS:
+                    raise
+                self.dropped += 1
+                continue
+            for record in self.parse_exit(reply):
+                yield record
+
+    def listen(self, callback, timeout=None):
+        '''
+        Class method: returns <type 'NoneType'> :: calls "callback" with each
+        <TaskExit> as it arrives (see `records`).
+        '''
+        for record in self.records(timeout):
+            callback(record)
+
+    def parse_exit(self, reply):
+        '''
+        Returns <type 'list'> of the <TaskExit> records in a TASKSTATS_CMD_NEW
+        message.
+        '''
+        exits = list()
+        for msg in iter_msgs(reply):
+            if msg.type != self.genlctrl.fam_id:
+                continue
+            start = msg.offset + GENL_HDRLEN
+            for nla_type, offset, length in iter_attrs(msg.buf, start,
+                                                       msg.end):
+                if nla_type == TASKSTATS_TYPE_AGGR_PID:
+                    kind, id_type = 'pid', TASKSTATS_TYPE_PID
+                elif nla_type == TASKSTATS_TYPE_AGGR_TGID:
+                    kind, id_type = 'tgid', TASKSTATS_TYPE_TGID
+                else:
+                    continue
+                attrs = parse_attrs(msg.buf, offset, offset + length)
+                if not attrs.get(TASKSTATS_TYPE_STATS) or id_type not in attrs:
+                    continue
+                task_id = struct.unpack_from('I', attrs[id_type])[0]
+                stats = self.taskstats.decode(attrs[TASKSTATS_TYPE_STATS])
+                exits.append(TaskExit(kind, task_id, stats))
+        return exits
+
+    def __cpumask_cmd(self, cmd_attr):
+        '''
+        Private class method: (not meant to be called directly) sends the
+        (de)registration command "cmd_attr" for this listener's cpumask and
+        waits for its acknowledgement.  Exit records received meanwhile are
+        kept in `pending` for `records`.
+        '''
+        # The kernel copies the mask with nla_strscpy, which keeps at most
+        # nla_len - 1 bytes: the NUL must be sent along (as getstats.c does)
+        cmd_payload = Genlmsg(TASKSTATS_CMD_GET, Nlattr(cmd_attr,
+                                                        self.cpumask + '\0'))
+        cmd_msg = Nlmsg(self.genlctrl.fam_id, cmd_payload)
+        cmd_msg['nl_flags'] |= NLM_F_ACK
+        cmd_msg['nl_seq'] = seq = self.genlctrl.next_seq()
+        self.genlctrl.conn.settimeout(None)
+        self.genlctrl.send(cmd_msg.pack())
+        while True:
+            try:
+                reply = self.genlctrl.recv_view()
+            except socket.error as err:
+                if err.errno != errno.ENOBUFS:
+                    raise
+                self.dropped += 1
+                continue
+            for msg in iter_msgs(reply):
+                if msg.type != NLMSG_ERROR or msg.seq != seq:
+                    continue
+                err = msg_error(msg)
+                if err in (-errno.EPERM, -errno.EACCES):
+                    raise InsufficientRights('register', None)
+                if err:
+                    raise NetlinkError(err, None)
+                return
+            self.pending.extend(self.parse_exit(reply))
+
+    def __iter__(self):
+        return self.records()
+
+    def __enter__(self):
+        self.register()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def online_cpus():
+    '''
+    Returns <type 'str'> cpulist of the online cpus.
+    '''
+    with open('/sys/devices/system/cpu/online') as f:
+        return f.read().strip()
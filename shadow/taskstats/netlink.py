@@ -1,8 +1,12 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-import struct
 import os
+import struct
+
+from collections import namedtuple
+
+from ..exception import EmptyNtlnkMsg, NetlinkError, StructParseError
 
 
 # Flag values
@@ -27,11 +31,15 @@ NLM_F_APPEND    = 0x800
 NLMSG_ALIGNTO   = 4
 
 NLMSG_MIN_TYPE  = 0x10
+NLMSG_NOOP      = 0x1
 NLMSG_ERROR     = 0x2
+NLMSG_DONE      = 0x3
+NLMSG_OVERRUN   = 0x4
 
 GENL_ID_CTRL = NLMSG_MIN_TYPE
 
-NLMSG_HDRLEN = struct.calcsize('IHHII')
+NLMSG_HDR    = struct.Struct('IHHII')
+NLMSG_HDRLEN = NLMSG_HDR.size
 GENL_HDRLEN  = struct.calcsize('BBxx')
 
 
@@ -93,9 +101,18 @@ __CTRL_ATTR_OP_MAX     = 3
 
 TASKSTATS_TYPE_STATS    = 3
 TASKSTATS_TYPE_AGGR_PID = 4
-NLA_HDRLEN = struct.calcsize('HH')
+NLA_HDR    = struct.Struct('HH')
+NLA_HDRLEN = NLA_HDR.size
 NLA_MAXPAYLOAD = 16 
 
+NLA_F_NESTED        = 1 << 15
+NLA_F_NET_BYTEORDER = 1 << 14
+NLA_TYPE_MASK       = ~(NLA_F_NESTED | NLA_F_NET_BYTEORDER) & 0xffff
+
+# One message of a datagram: header fields and its payload's bounds in "buf"
+NetlinkMsg = namedtuple('NetlinkMsg', ['type', 'flags', 'seq', 'pid', 'buf',
+                                       'offset', 'end'])
+
 
 class Nlattr(object):
     '''
@@ -132,11 +149,12 @@ class Nlattr(object):
 
     @property
     def payload(self):
-        load = ''
+        load = b''
         if isinstance(self.nla_data, str):
-            padding = calc_alignment(len(self.nla_data))
+            nla_data = self.nla_data.encode('ascii')
+            padding = calc_alignment(len(nla_data))
             self.nla_len += padding
-            load = struct.pack('%ds' % padding, self.nla_data)
+            load = struct.pack('%ds' % padding, nla_data)
         elif isinstance(self.nla_data, int):
             self.nla_len += calc_alignment(struct.calcsize('I'))
             load = struct.pack('I', self.nla_data)
@@ -146,15 +164,87 @@ class Nlattr(object):
 def calc_alignment(data):
     return ((data + NLMSG_ALIGNTO - 1) & ~(NLMSG_ALIGNTO - 1))
 
-def parse_response(nlobj, reply):
-    nl_len, nl_type = struct.unpack('IHHII', reply[:NLMSG_HDRLEN])[:2]
-    if nl_type == NLMSG_ERROR:
-        raise NetlinkError(parse_msg.func_name) # pass pid?
-    nlattrs = reply[NLMSG_HDRLEN + GENL_HDRLEN:]
-    while nlattrs:
-        nla_len, nla_type = map(int, struct.unpack('HH', nlattrs[:NLA_HDRLEN]))
-        nla_len = calc_alignment(len(nlattrs[:nla_len]))
-        nla_data = nlattrs[NLA_HDRLEN:nla_len]
-        nlobj.attrs[nla_type] = nla_data
-        nlattrs = nlattrs[nla_len:]
-    return
+def iter_msgs(buf, length=None):
+    '''
+    Returns a generator of <NetlinkMsg> for each netlink message packed in the
+    first "length" bytes of the datagram "buf".  Nothing is copied: payloads
+    are addressed by offsets into a single <type 'memoryview'>.
+    '''
+    view = memoryview(buf)
+    end = len(view) if length is None else length
+    offset = 0
+    while offset + NLMSG_HDRLEN <= end:
+        nl_len, nl_type, nl_flags, nl_seq, nl_pid = NLMSG_HDR.unpack_from(
+                                                              view, offset)
+        if nl_len < NLMSG_HDRLEN or offset + nl_len > end:
+            raise StructParseError('iter_msgs', None)
+        yield NetlinkMsg(nl_type, nl_flags, nl_seq, nl_pid, view,
+                         offset + NLMSG_HDRLEN, offset + nl_len)
+        offset += calc_alignment(nl_len)
+
+def msg_error(msg):
+    '''
+    Returns <type 'int'> negative errno carried by an NLMSG_ERROR (0 for an
+    acknowledgement) or an NLMSG_DONE closing a failed dump.
+    '''
+    if msg.end - msg.offset < 4:
+        return 0
+    err = struct.unpack_from('i', msg.buf, msg.offset)[0]
+    return err if err < 0 else 0
+
+def iter_attrs(buf, offset, end):
+    '''
+    Returns a generator of (nla_type, payload offset, payload length) for the
+    attributes between "offset" and "end" of "buf", with the NLA_F_NESTED and
+    NLA_F_NET_BYTEORDER flags masked off the type.
+    '''
+    while offset + NLA_HDRLEN <= end:
+        nla_len, nla_type = NLA_HDR.unpack_from(buf, offset)
+        if nla_len < NLA_HDRLEN or offset + nla_len > end:
+            return
+        yield (nla_type & NLA_TYPE_MASK, offset + NLA_HDRLEN,
+               nla_len - NLA_HDRLEN)
+        offset += calc_alignment(nla_len)
+
+def find_attr(buf, nla_type, offset, end):
+    '''
+    Returns <type 'tuple'> of the payload offset and length of the first
+    attribute of "nla_type" between "offset" and "end" of "buf", or
+    <type 'NoneType'> when there is none.  Nothing is copied.
+    '''
+    for attr_type, attr_offset, attr_len in iter_attrs(buf, offset, end):
+        if attr_type == nla_type:
+            return attr_offset, attr_len
+
+def parse_attrs(buf, offset, end, nested=None):
+    '''
+    Returns <type 'dict'> of attribute type to its payload as a
+    <type 'memoryview'> of "buf" between "offset" and "end".  Types in
+    "nested" (a <type 'dict'> of type to the "nested" spec of its own
+    attributes, or <type 'NoneType'>) are parsed recursively into dicts.
+    '''
+    view = memoryview(buf)
+    nested = nested or dict()
+    attrs = dict()
+    for nla_type, nla_offset, nla_len in iter_attrs(view, offset, end):
+        if nla_type in nested:
+            attrs[nla_type] = parse_attrs(view, nla_offset,
+                                          nla_offset + nla_len,
+                                          nested[nla_type])
+        else:
+            attrs[nla_type] = view[nla_offset:nla_offset + nla_len]
+    return attrs
+
+def parse_response(nlobj, reply, hdrlen=GENL_HDRLEN, nested=None):
+    '''
+    Parses the attributes of the first message of "reply" (following its
+    "hdrlen" bytes of family header) into `nlobj.attrs`, raising
+    <NetlinkError> for an error reply.
+    '''
+    for msg in iter_msgs(reply):
+        if msg.type == NLMSG_ERROR:
+            raise NetlinkError(msg_error(msg), getattr(nlobj, 'pid', None))
+        nlobj.attrs = parse_attrs(msg.buf, msg.offset + hdrlen, msg.end,
+                                  nested)
+        return
+    raise EmptyNtlnkMsg('parse_response', getattr(nlobj, 'pid', None))
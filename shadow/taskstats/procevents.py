@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+This module subscribes to the kernel's process events connector
+(NETLINK_CONNECTOR, CN_IDX_PROC): a message per fork, exec, uid/gid, session,
+command name change and exit of every task on the system, delivered as it
+happens rather than found by the next sweep of "/proc".  Subscribing needs
+CAP_NET_ADMIN.
+'''
+
+import errno
+import os
+import socket
+import struct
+
+from collections import namedtuple
+
+from .netlink import *
+from .controller import Connection, NETLINK_CONNECTOR
+
+
+CN_IDX_PROC = 0x1
+CN_VAL_PROC = 0x1
+
+PROC_CN_MCAST_LISTEN = 1
+PROC_CN_MCAST_IGNORE = 2
+
+# Not exported by the socket module
+SOL_NETLINK = 270
+NETLINK_ADD_MEMBERSHIP = 1
+
+# struct cn_msg: cb_id (idx, val), seq, ack, len, flags
+CN_MSG = struct.Struct('=IIIIHH')
+
+# struct proc_event header: what, cpu, timestamp_ns
+PROC_EVENT = struct.Struct('=IIQ')
+
+PROC_EVENT_NONE     = 0x0
+PROC_EVENT_FORK     = 0x1
+PROC_EVENT_EXEC     = 0x2
+PROC_EVENT_UID      = 0x4
+PROC_EVENT_GID      = 0x40
+PROC_EVENT_SID      = 0x80
+PROC_EVENT_PTRACE   = 0x100
+PROC_EVENT_COMM     = 0x200
+PROC_EVENT_COREDUMP = 0x40000000
+PROC_EVENT_EXIT     = 0x80000000
+
+PROC_EVENTS = {PROC_EVENT_FORK:'fork', PROC_EVENT_EXEC:'exec',
+               PROC_EVENT_UID:'uid', PROC_EVENT_GID:'gid',
+               PROC_EVENT_SID:'sid', PROC_EVENT_PTRACE:'ptrace',
+               PROC_EVENT_COMM:'comm', PROC_EVENT_COREDUMP:'coredump',
+               PROC_EVENT_EXIT:'exit'}
+
+# "kind" is the event's name in PROC_EVENTS; "parent_pid"/"parent_tgid" are
+# set for a fork, "value" holds the new euid or egid, command name or exit
+# code of uid, gid, comm and exit events
+ProcEvent = namedtuple('ProcEvent', ['kind', 'cpu', 'timestamp', 'pid',
+                                     'tgid', 'parent_pid', 'parent_tgid',
+                                     'value'])
+
+
+class ProcEvents(Connection):
+    '''
+    The ProcEvents class joins the process events multicast group and yields
+    a <ProcEvent> per task event.  Events the kernel could not queue because
+    the receive buffer was full are counted in `dropped`; a caller that
+    misses events should resynchronise from "/proc".
+    '''
+    def __init__(self, rcvbuf=1 << 20):
+        super(ProcEvents, self).__init__(NETLINK_CONNECTOR, rcvbuf)
+        self.conn.setsockopt(SOL_NETLINK, NETLINK_ADD_MEMBERSHIP, CN_IDX_PROC)
+        self.dropped = 0
+        self.listening = False
+
+    def listen(self):
+        self.__mcast_op(PROC_CN_MCAST_LISTEN)
+        self.listening = True
+
+    def ignore(self):
+        if self.listening:
+            self.__mcast_op(PROC_CN_MCAST_IGNORE)
+            self.listening = False
+
+    def close(self):
+        try:
+            self.ignore()
+        finally:
+            super(ProcEvents, self).close()
+
+    def events(self, timeout=None):
+        '''
+        Class method: generator of <ProcEvent>, listening first if needed.
+        Stops once "timeout" seconds pass without an event, or runs until
+        closed when "timeout" is <type 'NoneType'>.
+        '''
+        if not self.listening:
+            self.listen()
+        self.conn.settimeout(timeout)
+        while True:
+            try:
+                view = self.recv_view()
+            except socket.timeout:
+                return
+            except socket.error as err:
+                if err.errno != errno.ENOBUFS:
+                    raise
+                self.dropped += 1
+                continue
+            for event in parse_events(view):
+                yield event
+
+    def __mcast_op(self, op):
+        '''
+        Private class method: (not meant to be called directly) sends the
+        multicast listen or ignore "op" to the process events connector.
+        '''
+        payload = struct.pack('I', op)
+        msg_len = NLMSG_HDRLEN + CN_MSG.size + len(payload)
+        self.send(NLMSG_HDR.pack(msg_len, NLMSG_DONE, 0, self.next_seq(),
+                                 os.getpid()) +
+                  CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0)
+                  + payload)
+
+    def __iter__(self):
+        return self.events()
+
+    def __enter__(self):
+        self.listen()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def parse_events(buf):
+    '''
+    Returns <type 'list'> of the <ProcEvent> in a datagram "buf" from the
+    process events connector (acknowledgements are skipped).
+    '''
+    events = list()
+    for msg in iter_msgs(buf):
+        if msg.type != NLMSG_DONE or msg.end - msg.offset < CN_MSG.size:
+            continue
+        idx, val = CN_MSG.unpack_from(msg.buf, msg.offset)[:2]
+        if idx != CN_IDX_PROC or val != CN_VAL_PROC:
+            continue
+        event = parse_event(msg.buf, msg.offset + CN_MSG.size)
+        if event is not None:
+            events.append(event)
+    return events
+
+def parse_event(buf, offset):
+    '''
+    Returns <ProcEvent> of the struct proc_event at "offset" of "buf", or
+    <type 'NoneType'> for kinds not in PROC_EVENTS.
+    '''
+    what, cpu, timestamp = PROC_EVENT.unpack_from(buf, offset)
+    kind = PROC_EVENTS.get(what)
+    if kind is None:
+        return
+    data = offset + PROC_EVENT.size
+    parent_pid = parent_tgid = value = None
+    if kind == 'fork':
+        parent_pid, parent_tgid, pid, tgid = struct.unpack_from('=4i', buf,
+                                                                data)
+    elif kind in ('uid', 'gid'):
+        pid, tgid, _, value = struct.unpack_from('=2i2I', buf, data)
+    elif kind == 'comm':
+        pid, tgid, comm = struct.unpack_from('=2i16s', buf, data)
+        value = comm.split(b'\0', 1)[0].decode('utf-8', 'replace')
+    elif kind == 'exit':
+        pid, tgid, value = struct.unpack_from('=2iI', buf, data)
+    else:
+        pid, tgid = struct.unpack_from('=2i', buf, data)
+    return ProcEvent(kind, cpu, timestamp, pid, tgid, parent_pid, parent_tgid,
+                     value)
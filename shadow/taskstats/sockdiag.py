@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+This module dumps the sockets of the calling network namespace over
+NETLINK_SOCK_DIAG: state, queue depths and (for TCP) round trip times of
+every TCP, UDP and unix socket, keyed by inode so they can be joined to the
+socket fds of a process.
+'''
+
+import socket
+import struct
+
+from collections import namedtuple
+
+from .netlink import *
+from .controller import Connection, NETLINK_SOCK_DIAG
+
+
+SOCK_DIAG_BY_FAMILY = 20
+
+# Extensions requested with an inet dump (bit "attribute - 1")
+INET_DIAG_MEMINFO = 1
+INET_DIAG_INFO    = 2
+
+UNIX_DIAG_NAME  = 0
+UNIX_DIAG_PEER  = 2
+UNIX_DIAG_RQLEN = 4
+
+UDIAG_SHOW_NAME  = 0x01
+UDIAG_SHOW_PEER  = 0x04
+UDIAG_SHOW_RQLEN = 0x10
+
+# Every state (the TCP_* values double as unix socket states)
+ALL_STATES = 0xffffffff
+
+TCP_STATES = {1:'ESTABLISHED', 2:'SYN_SENT', 3:'SYN_RECV', 4:'FIN_WAIT1',
+              5:'FIN_WAIT2', 6:'TIME_WAIT', 7:'CLOSE', 8:'CLOSE_WAIT',
+              9:'LAST_ACK', 10:'LISTEN', 11:'CLOSING', 12:'NEW_SYN_RECV'}
+
+UNIX_TYPES = {socket.SOCK_STREAM:'unix_stream', socket.SOCK_DGRAM:'unix_dgram',
+              socket.SOCK_SEQPACKET:'unix_seqpacket'}
+
+PROTOCOLS = {'tcp':socket.IPPROTO_TCP, 'udp':socket.IPPROTO_UDP}
+
+# struct inet_diag_req_v2 and struct unix_diag_req
+INET_DIAG_REQ = struct.Struct('=BBBxI48x')
+UNIX_DIAG_REQ = struct.Struct('=BxxxIIIII')
+
+# struct inet_diag_msg (sockid ports and addresses are big endian)
+INET_DIAG_MSG = struct.Struct('=BBBB2s2s16s16s12xIIIII')
+UNIX_DIAG_MSG = struct.Struct('=BBBxI8x')
+
+# rtt and rttvar (in usec) of struct tcp_info
+TCP_INFO_RTT = struct.Struct('=68xII')
+
+SocketInfo = namedtuple('SocketInfo', ['inode', 'protocol', 'family', 'state',
+                                       'local', 'remote', 'rqueue', 'wqueue',
+                                       'rtt', 'rttvar', 'uid'])
+
+
+class SockDiag(Connection):
+    '''
+    The SockDiag class dumps sockets over a NETLINK_SOCK_DIAG connection.  Each
+    dump is one multipart request/reply exchange; `sockets` runs them for
+    every requested protocol and family back to back on the same socket.
+
+    Sockets are returned as <SocketInfo>: "local" and "remote" are
+    (address, port) tuples for inet sockets, and the bound path ('@' leading
+    for abstract names) and peer inode for unix sockets; "rtt" and "rttvar"
+    (usec) are only known for TCP.
+    '''
+    def __init__(self, rcvbuf=1 << 20):
+        super(SockDiag, self).__init__(NETLINK_SOCK_DIAG, rcvbuf)
+
+    def dump_inet(self, protocol='tcp', family=socket.AF_INET,
+                  states=ALL_STATES):
+        '''
+        Returns a generator of <SocketInfo> for the "protocol" ('tcp' or
+        'udp') sockets of "family" in any of "states" (a bit per state).
+        '''
+        ext = 1 << (INET_DIAG_INFO - 1) if protocol == 'tcp' else 0
+        request = INET_DIAG_REQ.pack(family, PROTOCOLS[protocol], ext, states)
+        for buf, offset, end in self.__dump(request):
+            yield parse_inet(buf, offset, end, protocol)
+
+    def dump_unix(self, states=ALL_STATES):
+        '''
+        Returns a generator of <SocketInfo> for the unix sockets in any of
+        "states".
+        '''
+        show = UDIAG_SHOW_NAME | UDIAG_SHOW_PEER | UDIAG_SHOW_RQLEN
+        request = UNIX_DIAG_REQ.pack(socket.AF_UNIX, states, 0, show, 0, 0)
+        for buf, offset, end in self.__dump(request):
+            yield parse_unix(buf, offset, end)
+
+    def sockets(self, protocols=('tcp', 'udp', 'unix'), inodes=None):
+        '''
+        Returns <type 'dict'> of inode to <SocketInfo> for every socket of
+        "protocols" (IPv4 and IPv6 alike), restricted to "inodes" if given.
+        '''
+        sockets = dict()
+        dumps = list()
+        for protocol in protocols:
+            if protocol == 'unix':
+                dumps.append(self.dump_unix())
+            else:
+                for family in (socket.AF_INET, socket.AF_INET6):
+                    dumps.append(self.dump_inet(protocol, family))
+        for dump in dumps:
+            for info in dump:
+                if inodes is None or info.inode in inodes:
+                    sockets[info.inode] = info
+        return sockets
+
+    def __dump(self, request):
+        '''
+        Private class method: (not meant to be called directly) sends a dump
+        "request" and yields the (buffer, payload offset, payload end) of each
+        part of the reply.  Payloads are only valid until the next one.
+        '''
+        seq = self.next_seq()
+        msg_len = NLMSG_HDRLEN + len(request)
+        self.send(NLMSG_HDR.pack(msg_len, SOCK_DIAG_BY_FAMILY,
+                                 NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + request)
+        for msg in self.messages(seq):
+            yield msg.buf, msg.offset, msg.end
+
+
+def inet_address(family, raw_addr, raw_port):
+    '''
+    Returns <type 'tuple'> of the printable address and port of a sockid
+    address and big endian port.
+    '''
+    if family == socket.AF_INET:
+        raw_addr = raw_addr[:4]
+    return (socket.inet_ntop(family, raw_addr),
+            struct.unpack('>H', raw_port)[0])
+
+def parse_inet(buf, offset, end, protocol):
+    '''
+    Returns <SocketInfo> of the struct inet_diag_msg (and its attributes)
+    between "offset" and "end" of "buf".
+    '''
+    (family, state, _, _, sport, dport, src, dst, _, rqueue, wqueue, uid,
+     inode) = INET_DIAG_MSG.unpack_from(buf, offset)
+    rtt = rttvar = None
+    for nla_type, nla_offset, nla_len in iter_attrs(buf, offset +
+                                                    INET_DIAG_MSG.size, end):
+        if nla_type == INET_DIAG_INFO and nla_len >= TCP_INFO_RTT.size:
+            rtt, rttvar = TCP_INFO_RTT.unpack_from(buf, nla_offset)
+    return SocketInfo(inode, protocol, family, TCP_STATES.get(state, state),
+                      inet_address(family, src, sport),
+                      inet_address(family, dst, dport),
+                      rqueue, wqueue, rtt, rttvar, uid)
+
+def parse_unix(buf, offset, end):
+    '''
+    Returns <SocketInfo> of the struct unix_diag_msg (and its attributes)
+    between "offset" and "end" of "buf".
+    '''
+    family, sock_type, state, inode = UNIX_DIAG_MSG.unpack_from(buf, offset)
+    name = ''
+    peer = rqueue = wqueue = None
+    for nla_type, nla_offset, nla_len in iter_attrs(buf, offset +
+                                                    UNIX_DIAG_MSG.size, end):
+        if nla_type == UNIX_DIAG_NAME:
+            raw_name = bytes(buf[nla_offset:nla_offset + nla_len])
+            if raw_name.startswith(b'\0'):
+                raw_name = b'@' + raw_name[1:]
+            name = raw_name.rstrip(b'\0').decode('utf-8', 'replace')
+        elif nla_type == UNIX_DIAG_PEER:
+            peer = struct.unpack_from('I', buf, nla_offset)[0]
+        elif nla_type == UNIX_DIAG_RQLEN:
+            rqueue, wqueue = struct.unpack_from('II', buf, nla_offset)
+    return SocketInfo(inode, UNIX_TYPES.get(sock_type, 'unix'), family,
+                      TCP_STATES.get(state, state), name, peer, rqueue,
+                      wqueue, None, None, None)
@@ -6,11 +6,16 @@ This module sets a netlink connection, which will be used to communicate
 the taskstats data to the shadowed PID's profile.
 '''
 
+import errno
+import os
+import socket
 import struct
 
-from netlink import *
+from contextlib import contextmanager
+
+from .netlink import *
 from ..exception import *
-from controller import Controller, Genlmsg
+from .controller import Controller, Genlmsg, connection_pool
 
 
 # Taskstats commands
@@ -39,61 +44,400 @@ __TASKSTATS_CMD_ATTR_MAX              = 5
 
 TASKSTATS_GENL_NAME    = 'TASKSTATS'
 
-taskstat_struct = (('version', 'H'), ('ac_exitcode', 'I'), ('ac_flag', 'B'),
-                   ('ac_nice', 'B'), ('align', 'I'), ('cpu_count', 'Q'),
-                   ('cpu_delay_total', 'Q'), ('blkio_count', 'Q'),
-                   ('blkio_delay_total', 'Q'), ('swapin_count', 'Q'),
-                   ('swapin_delay_total', 'Q'), ('cpu_run_real_total', 'Q'),
-                   ('cpu_run_virtual_total', 'Q'), ('ac_comm', '32s'),
-                   ('ac_sched', 'B'), ('ac_pad', '3x'), ('align', 'BB'),
-                   ('ac_uid', 'I'), ('ac_gid', 'I'), ('ac_pid', 'I'),
-                   ('ac_ppid', 'I'), ('ac_btime', 'I'), ('align', 'B'),
-                   ('ac_etime', 'Q'), ('ac_utime', 'Q'), ('ac_stime', 'Q'),
-                   ('ac_minflt', 'Q'), ('ac_majflt', 'Q'), ('coremem', 'Q'),
-                   ('virtmem', 'Q'), ('hiwater_rss', 'Q'), ('hiwater_vm', 'Q'),
-                   ('read_char', 'Q'), ('write_char', 'Q'), 
-                   ('read_syscalls', 'Q'), ('write_syscalls', 'Q'), 
-                   ('read_bytes', 'Q'), ('write_bytes', 'Q'), 
-                   ('cancelled_write_bytes', 'Q'), ('nvcsw', 'Q'), 
-                   ('nivcsw', 'Q'), ('ac_utimescaled', 'Q'), 
-                   ('ac_stimescaled', 'Q'), ('cpu_scaled_run_real_total', 'Q'), 
-                   ('freepages_count', 'Q'), ('freepages_delay_total', 'Q'))
+# Receive buffer for batched queries and the kernel memory charged against it
+# per queued reply (skb truesize), used to bound the requests in flight.
+TASKSTATS_RCVBUF       = 1 << 21
+TASKSTATS_REPLY_SIZE   = 4096
+
+# Per task io accounting, not aggregated by thread group replies
+TASKSTATS_IO_FIELDS = ('read_char', 'write_char', 'read_syscalls',
+                       'write_syscalls', 'read_bytes', 'write_bytes',
+                       'cancelled_write_bytes')
+
+# struct taskstats as (version introduced, field, format); `None` fields are
+# the padding of the struct's aligned(8) members.  Every version before 8 is
+# decoded as 8, versions past the last listed decode the known prefix.
+taskstat_struct = ((8, 'version', 'H'), (8, None, '2x'),
+                   (8, 'ac_exitcode', 'I'), (8, 'ac_flag', 'B'),
+                   (8, 'ac_nice', 'B'), (8, None, '6x'),
+                   (8, 'cpu_count', 'Q'), (8, 'cpu_delay_total', 'Q'),
+                   (8, 'blkio_count', 'Q'), (8, 'blkio_delay_total', 'Q'),
+                   (8, 'swapin_count', 'Q'), (8, 'swapin_delay_total', 'Q'),
+                   (8, 'cpu_run_real_total', 'Q'),
+                   (8, 'cpu_run_virtual_total', 'Q'), (8, 'ac_comm', '32s'),
+                   (8, 'ac_sched', 'B'), (8, None, '7x'),
+                   (8, 'ac_uid', 'I'), (8, 'ac_gid', 'I'), (8, 'ac_pid', 'I'),
+                   (8, 'ac_ppid', 'I'), (8, 'ac_btime', 'I'), (8, None, '4x'),
+                   (8, 'ac_etime', 'Q'), (8, 'ac_utime', 'Q'),
+                   (8, 'ac_stime', 'Q'), (8, 'ac_minflt', 'Q'),
+                   (8, 'ac_majflt', 'Q'), (8, 'coremem', 'Q'),
+                   (8, 'virtmem', 'Q'), (8, 'hiwater_rss', 'Q'),
+                   (8, 'hiwater_vm', 'Q'), (8, 'read_char', 'Q'),
+                   (8, 'write_char', 'Q'), (8, 'read_syscalls', 'Q'),
+                   (8, 'write_syscalls', 'Q'), (8, 'read_bytes', 'Q'),
+                   (8, 'write_bytes', 'Q'), (8, 'cancelled_write_bytes', 'Q'),
+                   (8, 'nvcsw', 'Q'), (8, 'nivcsw', 'Q'),
+                   (8, 'ac_utimescaled', 'Q'), (8, 'ac_stimescaled', 'Q'),
+                   (8, 'cpu_scaled_run_real_total', 'Q'),
+                   (8, 'freepages_count', 'Q'),
+                   (8, 'freepages_delay_total', 'Q'),
+                   (9, 'thrashing_count', 'Q'),
+                   (9, 'thrashing_delay_total', 'Q'),
+                   (10, 'ac_btime64', 'Q'),
+                   (11, 'compact_count', 'Q'), (11, 'compact_delay_total', 'Q'),
+                   (12, 'ac_tgid', 'I'), (12, None, '4x'),
+                   (12, 'ac_tgetime', 'Q'), (12, 'ac_exe_dev', 'Q'),
+                   (12, 'ac_exe_inode', 'Q'),
+                   (13, 'wpcopy_count', 'Q'), (13, 'wpcopy_delay_total', 'Q'),
+                   (14, 'irq_count', 'Q'), (14, 'irq_delay_total', 'Q'))
+
+
+class TaskstatsRecord(object):
+    '''
+    Slotted, read-only record of one decoded taskstats struct.  Fields newer
+    than the struct's version are <type 'NoneType'>; `ac_comm` is decoded to
+    <type 'str'>.  Fields may be read as attributes or by key.
+    '''
+
+    __slots__ = tuple(field for _, field, _ in taskstat_struct if field)
+
+    def __init__(self, fields, values, absent=()):
+        setter = super(TaskstatsRecord, self).__setattr__
+        for field, value in zip(fields, values):
+            setter(field, value)
+        for field in absent:
+            setter(field, None)
+        comm = self.ac_comm.split(b'\0', 1)[0]
+        setter('ac_comm', comm.decode('utf-8', 'replace'))
+
+    def __getitem__(self, field):
+        try:
+            return getattr(self, field)
+        except AttributeError:
+            raise KeyError(field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+    def as_dict(self):
+        return {field:getattr(self, field) for field in self.__slots__}
+
+    def __setattr__(self, name, value):
+        raise AttributeError("<TaskstatsRecord> attribute '%s' is read-only" %
+                             name)
+
+    def __repr__(self):
+        return "<TaskstatsRecord (pid: %s | version: %s)>" % (self.ac_pid,
+                                                              self.version)
+
+
+class TaskstatsLayout(object):
+    '''
+    Precompiled <struct.Struct> decoder of the taskstats struct as laid out
+    by "version".
+    '''
+    def __init__(self, version):
+        self.version = version
+        members = [(field, fmt) for since, field, fmt in taskstat_struct
+                   if since <= version]
+        self.struct = struct.Struct('=' + ''.join(fmt for _, fmt in members))
+        self.fields = tuple(field for field, _ in members if field)
+        self.absent = tuple(field for field in TaskstatsRecord.__slots__
+                            if field not in self.fields)
+        self.size = self.struct.size
+        self.offsets = dict()
+        offset = 0
+        for field, fmt in members:
+            if field:
+                self.offsets[field] = (offset, struct.Struct('=' + fmt))
+            offset += struct.calcsize('=' + fmt)
+
+    def decode(self, buf, offset=0):
+        '''
+        Returns <TaskstatsRecord> of the struct at "offset" in "buf".
+        '''
+        return TaskstatsRecord(self.fields,
+                               self.struct.unpack_from(buf, offset),
+                               self.absent)
+
+    def field(self, buf, field, offset=0):
+        '''
+        Returns the single "field" of the struct at "offset" in "buf" without
+        decoding the rest.
+        '''
+        if field not in self.offsets:
+            return
+        field_offset, field_struct = self.offsets[field]
+        return field_struct.unpack_from(buf, offset + field_offset)[0]
+
+
+TASKSTATS_LAYOUTS = dict((version, TaskstatsLayout(version)) for version in
+                         sorted(set(since for since, _, _ in taskstat_struct)))
+TASKSTATS_MIN_VERSION = min(TASKSTATS_LAYOUTS)
+TASKSTATS_MAX_VERSION = max(TASKSTATS_LAYOUTS)
+
+
+def taskstats_layout(buf, offset=0, length=None):
+    '''
+    Returns <TaskstatsLayout> for the struct at "offset" in "buf", picked by
+    its version field and narrowed to the largest layout "length" bytes hold.
+    '''
+    if length is None:
+        length = len(buf) - offset
+    version = struct.unpack_from('=H', buf, offset)[0]
+    version = max(TASKSTATS_MIN_VERSION, min(version, TASKSTATS_MAX_VERSION))
+    while version > TASKSTATS_MIN_VERSION and \
+            TASKSTATS_LAYOUTS[version].size > length:
+        version -= 1
+    layout = TASKSTATS_LAYOUTS[version]
+    if layout.size > length:
+        raise StructParseError('taskstats_layout', None)
+    return layout
+
+def parse_reply(task_response):
+    '''
+    Returns <type 'tuple'> of a taskstats reply's sequence number, a view of
+    the raw taskstats struct (<type 'NoneType'> if absent) and the netlink
+    error code (0 on success).
+    '''
+    nl_len, nl_type, _, nl_seq = struct.unpack_from('IHHI', task_response)
+    if nl_type == NLMSG_ERROR:
+        err = struct.unpack_from('i', task_response, NLMSG_HDRLEN)[0]
+        return nl_seq, None, err
+    end = min(nl_len, len(task_response))
+    start = NLMSG_HDRLEN + GENL_HDRLEN
+    for aggr_type in (TASKSTATS_TYPE_AGGR_PID, TASKSTATS_TYPE_AGGR_TGID):
+        aggr = find_attr(task_response, aggr_type, start, end)
+        if aggr is None:
+            continue
+        stats = find_attr(task_response, TASKSTATS_TYPE_STATS, aggr[0],
+                          aggr[0] + aggr[1])
+        if stats is not None:
+            offset, length = stats
+            return nl_seq, memoryview(task_response)[offset:offset + length], 0
+    return nl_seq, None, 0
+
+def request_msg(fam_id, pid, seq, cmd_attr=TASKSTATS_CMD_ATTR_PID):
+    '''
+    Returns <type 'bytes'> of a packed TASKSTATS_CMD_GET for "pid" (a tgid
+    with "cmd_attr" TASKSTATS_CMD_ATTR_TGID) carrying sequence number "seq".
+    '''
+    task_msg = Nlmsg(fam_id, Genlmsg(TASKSTATS_CMD_GET, Nlattr(cmd_attr, pid)))
+    task_msg['nl_seq'] = seq
+    return task_msg.pack()
+
+def taskstats_pool():
+    '''
+    Returns the process-wide <ConnectionPool> of taskstats connections.
+    '''
+    return connection_pool(TASKSTATS_GENL_NAME, TASKSTATS_RCVBUF)
 
 
 class Taskstats(object):
     '''
     The Taskstats class makes requests to assemble netlink messages that
-    communicate taskstats.
+    communicate taskstats.  The "pid" given on initialization is the default
+    target of each request; a single instance (and so a single netlink
+    socket) may be shared to query any number of pids.
+
+    Given a "pool" (see `taskstats_pool`) no socket is owned: every query
+    borrows a pooled connection instead, which makes the instance safe to use
+    from several threads.  Replies are received into the connection's
+    reusable buffer and decoded in place.
     '''
-    def __init__(self, pid):
+    def __init__(self, pid=None, rcvbuf=TASKSTATS_RCVBUF, pool=None):
         super(Taskstats, self).__init__()
         self.pid = pid
-        self.genlctrl = Controller(TASKSTATS_GENL_NAME)
-        self.attrs = dict()
-        self.taskstat_fields = [task[0] for task in taskstat_struct]
-        self.fmt = ''.join([task[1] for task in taskstat_struct])
-
-    def get_task(self, task):
-        task_msg_payload = Genlmsg(TASKSTATS_CMD_GET, Nlattr(
-                                   TASKSTATS_CMD_ATTR_PID, self.pid))
-        self.genlctrl.send(Nlmsg(self.genlctrl.fam_id, task_msg_payload).pack())
-        task_response = self.genlctrl.recv()
-        parse_response(self, task_response[NLA_HDRLEN:])
-        if not self.attrs.get(TASKSTATS_TYPE_STATS):
-            return -1
-        taskstats_raw = self.attrs[TASKSTATS_TYPE_STATS]
-        taskstats = dict(zip(self.taskstat_fields, 
-                             struct.unpack(self.fmt, taskstats_raw)))
-        return taskstats.get(task)
+        self.pool = pool
+        self.genlctrl = None
+        if pool is None:
+            self.genlctrl = Controller(TASKSTATS_GENL_NAME, rcvbuf)
+
+    @contextmanager
+    def connection(self):
+        '''
+        Class method: context manager yielding the <Controller> to exchange
+        messages over, borrowed from the pool for the duration if pooled.
+        '''
+        if self.pool is None:
+            yield self.genlctrl
+        else:
+            with self.pool.connection() as genlctrl:
+                yield genlctrl
+
+    def decode(self, taskstats_raw, offset=0, length=None):
+        '''
+        Returns <TaskstatsRecord> of the taskstats struct in "taskstats_raw".
+        '''
+        layout = taskstats_layout(taskstats_raw, offset, length)
+        return layout.decode(taskstats_raw, offset)
+
+    def send_request(self, pid, genlctrl=None,
+                     cmd_attr=TASKSTATS_CMD_ATTR_PID):
+        '''
+        Sends a TASKSTATS_CMD_GET for "pid" (a tgid with "cmd_attr"
+        TASKSTATS_CMD_ATTR_TGID) and returns <type 'int'> of the netlink
+        sequence number its reply will carry.
+        '''
+        genlctrl = genlctrl or self.genlctrl
+        seq = genlctrl.next_seq()
+        genlctrl.send(request_msg(genlctrl.fam_id, pid, seq, cmd_attr))
+        return seq
+
+    def parse_reply(self, task_response):
+        '''
+        Returns <type 'tuple'> of the reply's sequence number, a view of the
+        raw taskstats struct (<type 'NoneType'> if absent) and the netlink
+        error code (0 on success).
+        '''
+        return parse_reply(task_response)
+
+    def query(self, genlctrl, pid=None, cmd_attr=TASKSTATS_CMD_ATTR_PID):
+        '''
+        Returns <type 'memoryview'> of the raw taskstats struct for "pid"
+        exchanged over "genlctrl" (valid until its next receive), or
+        <type 'NoneType'> if the kernel sent no stats.  A query refused for
+        lack of CAP_NET_ADMIN raises <InsufficientRights>.
+        '''
+        pid = self.pid if pid is None else pid
+        seq = self.send_request(pid, genlctrl, cmd_attr)
+        while True:
+            nl_seq, taskstats_raw, err = self.parse_reply(genlctrl.recv_view())
+            if nl_seq == seq:
+                break
+        if err in (-errno.EPERM, -errno.EACCES):
+            raise InsufficientRights('query', pid)
+        if err:
+            raise NetlinkError(err, pid)
+        return taskstats_raw
+
+    def get_stats(self, pid=None):
+        '''
+        Returns <TaskstatsRecord> of the whole decoded taskstats struct for
+        "pid", or <type 'NoneType'> if the kernel sent no stats.
+        '''
+        with self.connection() as genlctrl:
+            taskstats_raw = self.query(genlctrl, pid)
+            if not taskstats_raw:
+                return
+            return self.decode(taskstats_raw)
+
+    def get_tgid_stats(self, tgid=None):
+        '''
+        Returns <TaskstatsRecord> of the thread group "tgid" as aggregated by
+        the kernel over its live and exited threads, or <type 'NoneType'> if
+        the kernel sent no stats.
+        '''
+        with self.connection() as genlctrl:
+            taskstats_raw = self.query(genlctrl, tgid, TASKSTATS_CMD_ATTR_TGID)
+            if not taskstats_raw:
+                return
+            return self.decode(taskstats_raw)
+
+    def get_tasks(self, pids, window=None, cmd_attr=TASKSTATS_CMD_ATTR_PID):
+        '''
+        Returns <type 'dict'> of pid to the decoded taskstats struct for every
+        pid in "pids" that could be queried: of that one task, or of its
+        whole thread group with "cmd_attr" TASKSTATS_CMD_ATTR_TGID (the
+        kernel leaves the io fields of thread group replies zero, see
+        `get_io`).
+
+        Requests are pipelined over the one socket with at most "window"
+        awaiting a reply (by default as many as the receive buffer holds) and
+        the replies are matched back to their pid by sequence number.  If the
+        receive buffer still overruns, the requests whose replies were dropped
+        are sent again.
+        '''
+        with self.connection() as genlctrl:
+            if window is None:
+                window = max(1, genlctrl.rcvbuf // TASKSTATS_REPLY_SIZE)
+            pending = list(pids)
+            pending.reverse()
+            inflight = dict()
+            tasks = dict()
+            while pending or inflight:
+                while pending and len(inflight) < window:
+                    pid = pending.pop()
+                    inflight[self.send_request(pid, genlctrl,
+                                               cmd_attr)] = pid
+                try:
+                    replies = [genlctrl.recv_view()]
+                except socket.error as err:
+                    if err.errno != errno.ENOBUFS:
+                        raise
+                    replies = genlctrl.recv_pending()
+                    self.__collect(replies, inflight, tasks)
+                    pending.extend(inflight.values())
+                    inflight.clear()
+                    window = max(1, window // 2)
+                    continue
+                self.__collect(replies, inflight, tasks)
+            return tasks
+
+    def get_io(self, pids, window=None):
+        '''
+        Returns <type 'dict'> of pid to <type 'dict'> of TASKSTATS_IO_FIELDS
+        summed over the live threads of each process in "pids", from one
+        batched query over all of their tasks; like "/proc/<pid>/io" but
+        without the io of threads that already exited.
+        '''
+        thread_ids = dict()
+        for pid in pids:
+            try:
+                thread_ids[pid] = [int(tid) for tid in
+                                   os.listdir('/proc/%s/task' % pid)]
+            except OSError:
+                continue
+        tasks = self.get_tasks([tid for tids in thread_ids.values()
+                                for tid in tids], window)
+        io = dict()
+        for pid, tids in thread_ids.items():
+            records = [tasks[tid] for tid in tids if tid in tasks]
+            if records:
+                io[pid] = {field:sum(record[field] for record in records)
+                           for field in TASKSTATS_IO_FIELDS}
+        return io
+
+    def __collect(self, replies, inflight, tasks):
+        '''
+        Private class method: (not meant to be called directly) decodes the
+        "replies" of in-flight requests into "tasks".
+        '''
+        for task_response in replies:
+            nl_seq, taskstats_raw, err = self.parse_reply(task_response)
+            pid = inflight.pop(nl_seq, None)
+            if pid is None or not taskstats_raw:
+                continue
+            tasks[pid] = self.decode(taskstats_raw)
+
+    def get_task(self, task, pid=None):
+        with self.connection() as genlctrl:
+            taskstats_raw = self.query(genlctrl, pid)
+            if not taskstats_raw:
+                return -1
+            layout = taskstats_layout(taskstats_raw)
+            return layout.field(taskstats_raw, task)
  
-    def read(self):
-        taskstats_read = self.get_task('read_bytes')
+    def read(self, pid=None):
+        taskstats_read = self.get_task('read_bytes', pid)
         if taskstats_read == -1:
-            raise InsufficientRights(self.read.func_name, self.pid)
+            raise InsufficientRights('read', pid or self.pid)
         return taskstats_read
 
-    def write(self):
-        taskstats_write = self.get_task('write_bytes')
+    def write(self, pid=None):
+        taskstats_write = self.get_task('write_bytes', pid)
         if taskstats_write == -1:
-            raise InsufficientRights(self.write.func_name, self.pid)
+            raise InsufficientRights('write', pid or self.pid)
         return taskstats_write
+
+    def read_write(self, pid=None):
+        '''
+        Returns <type 'tuple'> of read and write bytes from a single query.
+        '''
+        with self.connection() as genlctrl:
+            taskstats_raw = self.query(genlctrl, pid)
+            if not taskstats_raw:
+                raise InsufficientRights('read_write', pid or self.pid)
+            layout = taskstats_layout(taskstats_raw)
+            return (layout.field(taskstats_raw, 'read_bytes'),
+                    layout.field(taskstats_raw, 'write_bytes'))
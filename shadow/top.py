@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+'''
+`shadow top`: a live, top-style view of the busiest processes by io, delay
+accounting stalls, context switches, rss growth or cpu.  Each refresh is a
+single <ProcessTable> sweep plus one batched taskstats query for all pids.
+'''
+
+import argparse
+import os
+import sys
+import time
+
+from collections import namedtuple
+
+from .exception import *
+from .table import ProcessTable
+from .taskstats.taskstats import (TASKSTATS_CMD_ATTR_TGID, Taskstats,
+                                  taskstats_pool)
+
+
+PAGE_KB = os.sysconf('SC_PAGE_SIZE') // 1024
+SC_CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+DELAY_TOTALS = ('cpu_delay_total', 'blkio_delay_total', 'swapin_delay_total',
+                'freepages_delay_total')
+
+TopRow = namedtuple('TopRow', ['pid', 'name', 'state', 'cpu', 'read_rate',
+                               'write_rate', 'io_rate', 'delay', 'switches',
+                               'rss', 'rss_growth'])
+
+# Sort key to the <TopRow> field ranked on
+SORT_KEYS = {'io':'io_rate', 'delay':'delay', 'switches':'switches',
+             'rss-growth':'rss_growth', 'rss':'rss', 'cpu':'cpu'}
+
+# <ProcessTable> columns read per process
+COUNTER_COLUMNS = ('start_time', 'tcomm', 'state', 'utime', 'stime',
+                   'read_bytes', 'write_bytes', 'rss')
+
+HEADER = '%7s %-16s %1s %6s %10s %10s %9s %9s %10s %9s' % (
+    'PID', 'COMMAND', 'S', 'CPU%', 'READ/s', 'WRITE/s', 'DELAY%', 'CSW/s',
+    'RSS', 'RSS/s')
+
+
+class Top(object):
+    '''
+    Top object: turns consecutive sweeps of every process into per-second
+    rates.  `refresh` returns <TopRow> records ordered by "sort" (see
+    SORT_KEYS): "cpu" and "delay" are percentages of one cpu, io rates are
+    bytes/s, "switches" context switches/s, "rss" kB and "rss_growth" kB/s.
+
+    Processes are matched across sweeps by pid and start time, so a reused
+    pid starts over instead of reporting the difference of two processes.
+    Delays and context switches come from one batched thread group query,
+    so they cover every thread; without "taskstats" (or rights to it) those
+    columns are <type 'NoneType'>.
+    '''
+    def __init__(self, sort='io', limit=None, taskstats=True, uids=None,
+                 names=None):
+        if sort not in SORT_KEYS:
+            raise ValueError("sort by one of %s, not %r" %
+                             (', '.join(sorted(SORT_KEYS)), sort))
+        self.sort = sort
+        self.limit = limit
+        self.taskstats = taskstats
+        self.table = ProcessTable(names=names, uids=uids, taskstats=False,
+                                  fds=False)
+        self.__taskstats = Taskstats(pool=taskstats_pool())
+        self.previous = dict()
+        self.timestamp = None
+
+    def refresh(self):
+        '''
+        Class method: returns <type 'list'> of <TopRow> since the previous
+        refresh (empty on the first, which only sets the baseline).
+        '''
+        self.table.refresh()
+        timestamp = time.time()
+        tasks = dict()
+        io = dict()
+        if self.taskstats:
+            read_bytes = self.table['read_bytes']
+            missing_io = [pid for i, pid in enumerate(self.table.pids)
+                          if read_bytes[i] is None]
+            try:
+                tasks = self.__taskstats.get_tasks(
+                    self.table.pids, cmd_attr=TASKSTATS_CMD_ATTR_TGID)
+                if missing_io:
+                    io = self.__taskstats.get_io(missing_io)
+            except EnvironmentError:
+                self.taskstats = False
+        current = dict()
+        rows = list()
+        elapsed = None
+        if self.timestamp is not None:
+            elapsed = timestamp - self.timestamp
+        columns = [self.table[column] for column in COUNTER_COLUMNS]
+        for i, pid in enumerate(self.table.pids):
+            row = dict(zip(COUNTER_COLUMNS, [column[i] for column in
+                                             columns]))
+            sample = self.__counters(row, tasks.get(pid), io.get(pid))
+            current[pid] = sample
+            before = self.previous.get(pid)
+            if not elapsed or before is None or before[0] != sample[0]:
+                continue
+            rows.append(self.__rates(pid, before, sample, elapsed))
+        self.previous = current
+        self.timestamp = timestamp
+        field = SORT_KEYS[self.sort]
+        rows.sort(key=lambda row: getattr(row, field) or 0, reverse=True)
+        return rows[:self.limit] if self.limit else rows
+
+    def __counters(self, row, task, task_io):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <type 'tuple'> of the counters of one process compared between
+        sweeps.
+        '''
+        read_bytes, write_bytes = row['read_bytes'], row['write_bytes']
+        if read_bytes is None and task_io is not None:
+            read_bytes = task_io['read_bytes']
+            write_bytes = task_io['write_bytes']
+        delay = switches = None
+        if task is not None:
+            delay = sum(task.get(field) or 0 for field in DELAY_TOTALS)
+            switches = task.nvcsw + task.nivcsw
+        return (row['start_time'], row['tcomm'], row['state'],
+                row['utime'] + row['stime'], read_bytes, write_bytes, delay,
+                switches, row['rss'] * PAGE_KB)
+
+    def __rates(self, pid, before, after, elapsed):
+        '''
+        Private class method: (not meant to be called directly) returns
+        <TopRow> of the change between two counter samples.
+        '''
+        def rate(i, scale=1.0):
+            if before[i] is None or after[i] is None:
+                return
+            return (after[i] - before[i]) * scale / elapsed
+        read_rate, write_rate = rate(4), rate(5)
+        io_rate = None
+        if read_rate is not None:
+            io_rate = read_rate + write_rate
+        cpu = rate(3, 100.0 / SC_CLK_TCK)
+        delay = rate(6, 100.0 / 1e9)
+        return TopRow(pid, after[1], after[2], cpu, read_rate, write_rate,
+                      io_rate, delay, rate(7), after[8], rate(8))
+
+
+def human(value, suffix=''):
+    '''
+    Returns <type 'str'> of "value" scaled to K/M/G/T ('-' for
+    <type 'NoneType'>).
+    '''
+    if value is None:
+        return '-'
+    for unit in ('', 'K', 'M', 'G'):
+        if abs(value) < 1024:
+            return '%.0f%s%s' % (value, unit, suffix)
+        value /= 1024.0
+    return '%.1fT%s' % (value, suffix)
+
+def render(rows):
+    '''
+    Returns <type 'str'> table of <TopRow> "rows" under HEADER.
+    '''
+    lines = [HEADER]
+    for row in rows:
+        lines.append('%7d %-16.16s %1s %6s %10s %10s %9s %9s %10s %9s' % (
+            row.pid, row.name, row.state,
+            '-' if row.cpu is None else '%.1f' % row.cpu,
+            human(row.read_rate), human(row.write_rate),
+            '-' if row.delay is None else '%.1f' % row.delay,
+            '-' if row.switches is None else '%.0f' % row.switches,
+            human(row.rss * 1024), human(row.rss_growth * 1024)))
+    return '\n'.join(lines)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='shadow',
+                                     description='Process profiling tools.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+    top = commands.add_parser('top', help='live view of the busiest '
+                                          'processes')
+    top.add_argument('-s', '--sort', choices=sorted(SORT_KEYS), default='io',
+                     help='rank processes by (default: io)')
+    top.add_argument('-d', '--delay', type=float, default=2.0,
+                     help='seconds between refreshes (default: 2)')
+    top.add_argument('-n', '--iterations', type=int, default=None,
+                     help='refreshes to show before exiting')
+    top.add_argument('-l', '--limit', type=int, default=20,
+                     help='processes to show (default: 20)')
+    top.add_argument('-u', '--uid', type=int, action='append', dest='uids',
+                     help='only processes of this uid (repeatable)')
+    top.add_argument('-b', '--batch', action='store_true',
+                     help='print each refresh instead of redrawing')
+    top.add_argument('--no-taskstats', dest='taskstats', action='store_false',
+                     help='skip taskstats (no delay and switch columns)')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    '''
+    Entry point of the `shadow` console script.
+    '''
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    top = Top(args.sort, args.limit, args.taskstats, args.uids)
+    redraw = not args.batch and sys.stdout.isatty()
+    top.refresh()
+    shown = 0
+    try:
+        while args.iterations is None or shown < args.iterations:
+            time.sleep(args.delay)
+            view = render(top.refresh())
+            shown += 1
+            if redraw:
+                sys.stdout.write('\033[H\033[J')
+            else:
+                view += '\n'
+            sys.stdout.write(time.strftime('%H:%M:%S') + '  sort: %s\n' %
+                             args.sort + view + '\n')
+            sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())